@@ -0,0 +1,256 @@
+"""
+Throughput benchmarks of the parsers.
+
+Each case parses a document with DocumentParser in a separate process and reports
+the speed in characters per second, the speed of the compiled DocumentParser (see 
+string_parser.compileParser()), the peak memory of the process and the number of
+objects created by the parse which are kept alive (tracked by the garbage collector).
+The results are compared with the baselines stored in benchmark_baseline.json and the
+worse ones are reported as regressions.
+
+Usage:
+    python benchmark.py [--threshold 0.25] [--update] [case ...]
+
+Options:
+    --threshold T   allowed relative change before a result counts as a regression.
+    --update        store the results as the new baselines.
+"""
+import gc
+import json
+import os
+import subprocess
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# the directory of this file
+_here = os.path.dirname(os.path.abspath(__file__))
+
+baseline_file = os.path.join(_here, 'benchmark_baseline.json')
+
+def proseSource():
+    """The prose corpus: a plain text with paragraphs."""
+    f = open(os.path.join(_here, '20k_c1.txt'), 'rU')
+    try:
+        s = f.read()
+    finally:
+        f.close()
+    return '\n\n'.join(s.split('\n')) * 5
+
+def mathSource(n = 200):
+    """Paragraphs of text with nested fractions, sums and scripts.
+
+    Args:
+        n (int): number of paragraphs.
+    """
+    paragraphs = []
+    for i in range(n):
+        depth = i % 4 + 1
+        expr = 'x_{%d}^{2}' % i
+        for j in range(depth):
+            expr = r'\frac{%s + %d}{\sum_{k=%d}^{n} a_{k}^{%d} b^{k}}' % (expr, j, j, j + 1)
+        paragraphs.append(r'The value $ y = %s - (1 + z)^2 $ is found in step %d.' % (expr, i))
+    return '\n\n'.join(paragraphs)
+
+def bracketsSource(depth = 300):
+    """Pathological nesting of brackets: deep fractions and subscripts.
+
+    Args:
+        depth (int): the nesting depth.
+    """
+    frac = r'\frac{' * depth + 'x' + '}{1}' * depth
+    sub = 'x_{' * depth + 'y' + '}' * depth
+    return 'Deep $%s$ and $%s$ nesting.' % (frac, sub)
+
+# case name -> function returning the source
+cases = {'prose': proseSource,
+         'math': mathSource,
+         'brackets': bracketsSource,
+        }
+
+# names of the results compared with the baselines -> True if a bigger value is better
+metrics = {'chars_per_sec': True,
+           'compiled_chars_per_sec': True,
+           'peak_kb': False,
+           'objects': False,
+          }
+
+def peakMemory():
+    """Return the peak memory of this process in KB or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes on Mac OS
+        peak //= 1024
+    return peak
+
+def measure(s, repeat = 9):
+    """Parse a document and measure the parser.
+
+    Args:
+        s (str): the document source.
+        repeat (int): number of timed runs, the fastest one is reported.
+
+    Return:
+        A dict with the results: chars, chars_per_sec, compiled_chars_per_sec, peak_kb 
+        and objects.
+    """
+    from latex_parser import DocumentParser
+    from string_parser import compileParser
+    parser = DocumentParser()
+    # the first run counts the objects kept alive by the parse
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        parser.match(s)
+        if not parser.hasMatch() or parser.getEnd() != len(s):
+            raise Exception('Benchmark source is not parsed completely.')
+        objects = len(gc.get_objects()) - before
+    finally:
+        gc.enable()
+    # only one parsed document is kept alive at a time
+    del parser
+    best = bestTime(DocumentParser, s, repeat)
+    # the peak memory of the interpreted parser, before the compiled one runs
+    peak = peakMemory()
+    compiled = bestTime(lambda: compileParser(DocumentParser()), s, repeat)
+    return {'chars': len(s),
+            'chars_per_sec': len(s) / max(best, 1e-9),
+            'compiled_chars_per_sec': len(s) / max(compiled, 1e-9),
+            'peak_kb': peak,
+            'objects': objects,
+           }
+
+def bestTime(makeParser, s, repeat):
+    """Return the time of the fastest of repeated parses of a document.
+
+    Args:
+        makeParser (callable): function creating the parser, called before each timed run.
+        s (str): the document source.
+        repeat (int): number of timed runs.
+    """
+    best = None
+    for i in range(repeat):
+        parser = makeParser()
+        t = time.time()
+        parser.match(s)
+        t = time.time() - t
+        if best is None or t < best:
+            best = t
+    return best
+
+def runCase(name, repeat = 9):
+    """Run a benchmark case in a new process so its peak memory is measured separately.
+
+    Return:
+        The dict of the results, see measure().
+    """
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                   '--child', name, str(repeat)])
+    return json.loads(out)
+
+def compare(results, baselines, threshold):
+    """Compare the results with the baselines.
+
+    Args:
+        results (dict): case name -> results of the case.
+        baselines (dict): case name -> stored results.
+        threshold (float): allowed relative change of a result.
+
+    Return:
+        A list of (case, metric, value, baseline) tuples of the regressions.
+    """
+    regressions = []
+    for name in sorted(results):
+        base = baselines.get(name)
+        if base is None:
+            continue
+        for metric, higherIsBetter in sorted(metrics.items()):
+            value = results[name].get(metric)
+            old = base.get(metric)
+            if value is None or old is None:
+                continue
+            if higherIsBetter:
+                worse = value < old * (1.0 - threshold)
+            else:
+                worse = value > old * (1.0 + threshold)
+            if worse:
+                regressions.append((name, metric, value, old))
+    return regressions
+
+def loadBaselines(path = baseline_file):
+    """Read the stored baselines, return an empty dict if there are none."""
+    if not os.path.exists(path):
+        return {}
+    f = open(path)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def saveBaselines(results, path = baseline_file):
+    """Store results as the baselines."""
+    f = open(path, 'w')
+    try:
+        json.dump(results, f, indent = 1, sort_keys = True, separators = (',', ': '))
+        f.write('\n')
+    finally:
+        f.close()
+
+def formatResults(results, baselines):
+    """Format a table of the results and the changes relative to the baselines."""
+    lines = ['%-10s %10s %14s %14s %10s %10s  %s' % ('case', 'chars', 'chars/sec', 'compiled/sec', 
+                                                     'peak KB', 'objects', 'change')]
+    for name in sorted(results):
+        r = results[name]
+        base = baselines.get(name)
+        change = ''
+        if base:
+            change = '%+.0f%% speed' % (100.0 * (r['chars_per_sec'] / base['chars_per_sec'] - 1))
+        lines.append('%-10s %10d %14.0f %14.0f %10s %10d  %s' % (name, r['chars'], r['chars_per_sec'],
+                                                                 r['compiled_chars_per_sec'],
+                                                                 r['peak_kb'], r['objects'], change))
+    return '\n'.join(lines)
+
+def main(args):
+    """Run the benchmarks, return the exit status: 1 if there are regressions."""
+    if args[:1] == ['--child']:
+        sys.path.insert(0, _here)
+        print json.dumps(measure(cases[args[1]](), int(args[2])))
+        return 0
+    threshold = 0.25
+    update = False
+    names = []
+    while args:
+        arg = args.pop(0)
+        if arg == '--threshold':
+            threshold = float(args.pop(0))
+        elif arg == '--update':
+            update = True
+        elif arg in cases:
+            names.append(arg)
+        else:
+            print __doc__
+            return 2
+    results = {}
+    for name in names or sorted(cases):
+        results[name] = runCase(name)
+    baselines = loadBaselines()
+    print formatResults(results, baselines)
+    if update:
+        baselines.update(results)
+        saveBaselines(baselines)
+        return 0
+    regressions = compare(results, baselines, threshold)
+    for name, metric, value, old in regressions:
+        print 'REGRESSION %s %s: %s (baseline %s)' % (name, metric, value, old)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,25 @@
+import unittest
+import benchmark
+
+class TestBenchmark(unittest.TestCase):
+    
+    def test_measure(self):
+        
+        for source in (benchmark.mathSource(4), benchmark.bracketsSource(20)):
+            r = benchmark.measure(source, 1)
+            self.assertEqual( r['chars'], len(source) )
+            self.assertTrue( r['chars_per_sec'] > 0 )
+            self.assertTrue( r['compiled_chars_per_sec'] > 0 )
+            self.assertTrue( r['objects'] > 0 )
+        
+    def test_compare(self):
+        
+        base = {'math': {'chars_per_sec': 1000.0, 'peak_kb': 100, 'objects': 50}}
+        results = {'math': {'chars_per_sec': 800.0, 'peak_kb': 120, 'objects': 50},
+                   'prose': {'chars_per_sec': 1.0, 'peak_kb': 1, 'objects': 1}}
+        self.assertEqual( benchmark.compare(results, base, 0.25), [] )
+        results['math']['chars_per_sec'] = 700.0
+        results['math']['peak_kb'] = None
+        results['math']['objects'] = 70
+        self.assertEqual( benchmark.compare(results, base, 0.25), 
+                          [('math', 'chars_per_sec', 700.0, 1000.0), ('math', 'objects', 70, 50)] )
@@ -23,18 +23,133 @@ character's baseline"""
 pdf_baseline = 0.81
 
 #---------------------------------------------------------------------------------
-def initPDF(pdf):
-    """Set up a FPDF object to work with latex parsers"""
-    pdf.c_margin = 0.0 # inner cell margin
-    pdf.add_page()
-    pdf.add_font('math-var','','font/lmroman7-italic.ttf',uni=True)
-    pdf.add_font('math-symbol','','font/GFSDidot-Regular.ttf',uni=True)
-    f = default_styles['body']
-    pdf.set_font(f[0],f[1],f[2])
+class TextWidthCache:
+    """Bounded cache of the widths of strings measured in the layout font of a pdf object.
+    
+    The widths are keyed by the layout font (see layoutFont()) and the text. The least recently used widths are dropped: the entries are kept in 
+    two generations, when the recent one is full the old one is forgotten and a width found 
+    in the old generation is moved to the recent one. The cache is cleared by initPDF() 
+    as the fonts are registered there, call clear() after registering fonts elsewhere.
+    """
+    def __init__(self, maxsize = 10000):
+        """Constructor.
+        
+        Args:
+            maxsize (int): maximum number of stored widths.
+        """
+        self.maxsize = maxsize
+        self.clear()
+        
+    def clear(self):
+        """Forget all widths and reset the statistics."""
+        self.hits = 0
+        self.misses = 0
+        self._recent = {}
+        self._old = {}
+        
+    def __len__(self):
+        """Return number of stored widths."""
+        return len(self._recent) + len(self._old)
+        
+    def hitRate(self):
+        """Return the fraction of the width requests found in the cache."""
+        n = self.hits + self.misses
+        if n == 0:
+            return 0.0
+        return float(self.hits) / n
+    
+    def width(self, pdf, text):
+        """Return the width of a text in the current font of a FPDF object.
+        
+        Args:
+            pdf (FPDF): the pdf object.
+            text (str): the text.
+        """
+        font = layoutFont(pdf)
+        key = (font.key, font.font_size, text)
+        w = self._recent.get(key)
+        if w is not None:
+            self.hits += 1
+            return w
+        w = self._old.pop(key, None)
+        if w is None:
+            self.misses += 1
+            w = font.stringWidth(text)
+        else:
+            self.hits += 1
+        recent = self._recent
+        if len(recent) >= self.maxsize // 2:
+            self._old = recent
+            recent = self._recent = {}
+        recent[key] = w
+        return w
+
+# the width cache used by the document items
+text_widths = TextWidthCache()
 
 #---------------------------------------------------------------------------------
-def setFontPDF(pdf,style, styles = default_styles):
-    """Set font of a pdf object based on the styles in a style list"""
+# attributes of FPDF describing the current font
+_fontState = ('font_family', 'font_style', 'font_size_pt', 'font_size', 'underline', 
+              'current_font', 'unifontsubset')
+
+class FontHandle:
+    """A font of a FPDF object resolved for measuring text.
+    
+    Holds what FPDF.set_font() finds for a family, style and size: the font key, the size in 
+    user units and the table of the character widths. Measuring with a handle doesn't change 
+    the current font of the pdf object and doesn't write anything to the page.
+    """
+    def __init__(self, pdf, family, style, size):
+        """Constructor.
+        
+        Args:
+            pdf (FPDF): the pdf object with the registered fonts.
+            family, style, size: the arguments of FPDF.set_font().
+        """
+        saved = [(name, getattr(pdf, name)) for name in _fontState if hasattr(pdf, name)]
+        missing = [name for name in _fontState if not hasattr(pdf, name)]
+        page = pdf.page
+        # set_font() writes the font to the page only if there is one
+        pdf.page = 0
+        try:
+            pdf.font_family = ''
+            pdf.set_font(family, style, size)
+            self.family = pdf.font_family
+            self.style = pdf.font_style
+            self.key = self.family + self.style
+            self.size_pt = pdf.font_size_pt
+            self.font_size = pdf.font_size
+            self.font = pdf.current_font
+            self.cw = self.font['cw']
+            self.unifontsubset = pdf.unifontsubset
+        finally:
+            pdf.page = page
+            for name, value in saved:
+                setattr(pdf, name, value)
+            for name in missing:
+                if hasattr(pdf, name):
+                    delattr(pdf, name)
+                    
+    def stringWidth(self, s):
+        """Return the width of a string in this font, same as FPDF.get_string_width()."""
+        cw = self.cw
+        w = 0
+        if self.unifontsubset:
+            for char in s:
+                char = ord(char)
+                if len(cw) > char:
+                    w += cw[char]
+                elif self.font['desc']['MissingWidth']:
+                    w += self.font['desc']['MissingWidth']
+                else:
+                    w += 500
+        else:
+            for c in s:
+                w += cw.get(c, 0)
+        return w*self.font_size/1000.0
+
+def fontHandlePDF(pdf, style, styles = default_styles):
+    """Return the FontHandle of a style for a FPDF object."""
     if isinstance(style,tuple):
         style_name = style[0]
         factor = style[1]
@@ -42,8 +157,62 @@ def setFontPDF(pdf,style, styles = default_styles):
         style_name = style
         factor = 1
     f = styles[style_name]
-    font_size = f[2] * factor
-    pdf.set_font(f[0],f[1],font_size)
+    return _fontHandle(pdf, f[0], f[1], f[2] * factor)
+
+def _fontHandle(pdf, family, style, size):
+    """Return the FontHandle of a font, the handles are created once and stored in the pdf object."""
+    key = (family, style, size)
+    try:
+        handles = pdf.font_handles
+    except AttributeError:
+        handles = pdf.font_handles = {}
+    handle = handles.get(key)
+    if handle is None:
+        handle = handles[key] = FontHandle(pdf, family, style, size)
+    return handle
+
+def layoutFont(pdf):
+    """Return the FontHandle the document items are measured with.
+    
+    It is the font last selected with useFontPDF() or setFontPDF(), if there is none 
+    the current font of the pdf object.
+    """
+    font = getattr(pdf, 'layout_font', None)
+    if font is None:
+        font = pdf.layout_font = _fontHandle(pdf, pdf.font_family, pdf.font_style, pdf.font_size_pt)
+    return font
+
+def useFontPDF(pdf, style, styles = default_styles):
+    """Select the font of a style for measuring the document items.
+    
+    Unlike setFontPDF() the current font of the pdf object isn't changed and nothing is 
+    written to the page, resizePDF() methods use this function to switch fonts.
+    """
+    pdf.layout_font = fontHandlePDF(pdf, style, styles)
+
+#---------------------------------------------------------------------------------
+def initPDF(pdf):
+    """Set up a FPDF object to work with latex parsers"""
+    # the fonts are (re-)registered
+    text_widths.clear()
+    layouts.clear()
+    pdf.font_handles = {}
+    pdf.layout_font = None
+    pdf.c_margin = 0.0 # inner cell margin
+    pdf.add_page()
+    pdf.add_font('math-var','','font/lmroman7-italic.ttf',uni=True)
+    pdf.add_font('math-symbol','','font/GFSDidot-Regular.ttf',uni=True)
+    setFontPDF(pdf, 'body')
+
+#---------------------------------------------------------------------------------
+def setFontPDF(pdf,style, styles = default_styles):
+    """Set font of a pdf object based on the styles in a style list.
+    
+    The font also becomes the layout font, see useFontPDF().
+    """
+    font = fontHandlePDF(pdf, style, styles)
+    pdf.set_font(font.family, font.style, font.size_pt)
+    pdf.layout_font = font
 
 #---------------------------------------------------------------------------------
 class DocItem:
@@ -62,9 +231,24 @@ class DocItem:
     def showRect(self,pdf):
         pdf.rect(self.rect.x0(), self.rect.y0(), self.rect.width(), self.rect.height(), 'B')
 
+    def isFitted(self):
+        """Check if refit() of this item can be skipped because it wouldn't move anything."""
+        return False
+
+    def layoutKey(self):
+        """Return a structural key of this item: items with equal keys have the same layout
+        when resized in the same font. See LayoutCache."""
+        return (self.__class__, self.text)
+
 #---------------------------------------------------------------------------------
 class MultiItem(DocItem):
-    """A complex item containing other items."""
+    """A complex item containing other items.
+    
+    The rects of the children are stored relative to this item: the position of a child in 
+    the coordinates of this item's rect is child.rect translated by self.offset. Moving this 
+    item together with its content changes only self.rect and self.offset, the absolute 
+    coordinates are computed when the items are output in cellPDF().
+    """
     def __init__(self):
         DocItem.__init__(self)
         self.items = []
@@ -73,6 +257,10 @@ class MultiItem(DocItem):
         self.style = ('body',1)
         # left and top inner margins
         self.margins = rect.Point(0,0)
+        # translation from the coordinates of the children to the coordinates of self.rect
+        self.offset = rect.Point(0,0)
+        # (rect, x0, y0) of self.rect when refit() was called last
+        self._fit = None
         
     def appendItem(self, item):
         """Append a child document item."""
@@ -85,14 +273,53 @@ class MultiItem(DocItem):
         (a parent of this item for example). Other objects mustn't (shouldn't?) resize this rect however.
         Although I don't know how to enforce it in python.
         
-        This method moves children's rects and refits them. 
+        This method moves the children by changing self.offset, their rects don't change. 
+        The children moved by this item's resizePDF() since they were fitted are refitted.
         """
         old_rect = self.getUnionRect()
-        dp = self.rect.p0() - old_rect.p0() + self.margins
+        self.offset = self.rect.p0() - old_rect.p0() + self.margins
         for item in self.items:
-            if item:
-                item.rect.translate(dp)
+            if item and not item.isFitted():
                 item.refit()
+        self._fit = (self.rect, self.rect.x0(), self.rect.y0())
+                
+    def isFitted(self):
+        """Check if the rect hasn't been changed since the last refit()."""
+        fit = self._fit
+        return fit is not None and fit[0] is self.rect and \
+               fit[1] == self.rect.x0() and fit[2] == self.rect.y0()
+        
+    def resetLayout(self, x, y):
+        """Start a new layout at point x,y: the rect is empty and the children use the
+        coordinates of this item."""
+        self.rect = Rect(x,y,x,y)
+        self.offset = rect.Point(0,0)
+        self._fit = None
+        
+    def layoutKey(self):
+        """Return a structural key of this item and its children, see DocItem.layoutKey()."""
+        keys = []
+        for item in self.items:
+            if item:
+                keys.append(item.layoutKey())
+            else:
+                keys.append(None)
+        return (self.__class__, self.style, id(self.styles), tuple(keys))
+        
+    def itemRect(self, item):
+        """Return the rect of a child item in the coordinates of this item's rect."""
+        r = Rect(item.rect)
+        r.translate(self.offset)
+        return r
+        
+    def itemsFrame(self, r = None):
+        """Return the output rect r of cellPDF() in the coordinates of the children."""
+        if r:
+            r = Rect(r)
+        else:
+            r = Rect()
+        r.translate(-self.offset.x(), -self.offset.y())
+        return r
                 
     def moveTo(self,x,y):
         """Moves this multi-item to point with coordinates x,y."""
@@ -110,6 +337,7 @@ class MultiItem(DocItem):
     def cellPDF(self, pdf, r = None):
         """Output the item to PDF"""
         style = self.style
+        r = self.itemsFrame(r)
         for item in self.items:
             if item:
                 if item.style != style:
@@ -127,20 +355,161 @@ class MultiItem(DocItem):
     def setFontPDF(self,pdf,item):
         setFontPDF(pdf,item.style, self.styles)
 
+    def useFontPDF(self,pdf,item):
+        """Select the font of an item for measuring, see useFontPDF()."""
+        useFontPDF(pdf,item.style, self.styles)
+
     def resizeItemsPDF(self,pdf, x, y):
         """Resize all items with origin at x,y"""
         for item in self.items:
             if item:
-                self.setFontPDF(pdf, item)
-                item.resizePDF(pdf, x, y)
+                self.useFontPDF(pdf, item)
+                layouts.resize(pdf, item, x, y)
                 
     def getLineHeight(self, pdf):
-        return pdf.font_size_pt / pdf.k
+        return layoutFont(pdf).font_size
     
     def addItems(self, *items):
         for item in items:
             self.appendItem(item)
                 
+#---------------------------------------------------------------------------------
+class LayoutCache:
+    """Bounded cache of the layouts of the complex items.
+    
+    A layout is keyed by the layout font the item is resized in and the structural key of 
+    the item (see DocItem.layoutKey()), so repeated formulas are measured once. A layout holds 
+    the rects, offsets, margins and styles of all the items of a subtree with the top rect 
+    relative to the point the subtree was resized at: a hit copies them and places the top 
+    item at the new point, the children follow through its offset. The entries are dropped 
+    as in TextWidthCache and the cache is cleared by initPDF().
+    
+    Large subtrees are resized without the cache: their keys and layouts would be built again
+    at every level of nesting while the parts found in the cache leave little to resize.
+    """
+    def __init__(self, maxsize = 2000, maxItems = 32):
+        """Constructor.
+        
+        Args:
+            maxsize (int): maximum number of stored layouts.
+            maxItems (int): maximum number of items in a cached subtree.
+        """
+        self.maxsize = maxsize
+        self.maxItems = maxItems
+        self.clear()
+        
+    def clear(self):
+        """Forget all layouts and reset the statistics."""
+        self.hits = 0
+        self.misses = 0
+        self._recent = {}
+        self._old = {}
+        
+    def __len__(self):
+        """Return number of stored layouts."""
+        return len(self._recent) + len(self._old)
+        
+    def hitRate(self):
+        """Return the fraction of the resized items found in the cache."""
+        n = self.hits + self.misses
+        if n == 0:
+            return 0.0
+        return float(self.hits) / n
+    
+    def resize(self, pdf, item, x = 0, y = 0):
+        """Resize a child item with origin at x,y in the current layout font of a pdf object.
+        
+        Text items are always resized, their widths are cached by text_widths.
+        
+        Args:
+            pdf (FPDF): the pdf object.
+            item (DocItem): the item to resize.
+            x, y (float): the origin.
+        """
+        items = None
+        if isinstance(item, MultiItem):
+            items = _layoutItems(item, self.maxItems)
+        if items is None:
+            item.resizePDF(pdf, x, y)
+            return
+        font = layoutFont(pdf)
+        key = (font.key, font.font_size, item.layoutKey())
+        layout = self._recent.get(key)
+        if layout is None:
+            layout = self._old.pop(key, None)
+            if layout is None:
+                self.misses += 1
+                item.resizePDF(pdf, x, y)
+                layout = (_saveLayout(items, x, y), layoutFont(pdf))
+            else:
+                self.hits += 1
+                _restoreLayout(items, layout[0], x, y)
+            recent = self._recent
+            if len(recent) >= self.maxsize // 2:
+                self._old = recent
+                recent = self._recent = {}
+            recent[key] = layout
+        else:
+            self.hits += 1
+            _restoreLayout(items, layout[0], x, y)
+        # the font selected by the resized items
+        pdf.layout_font = layout[1]
+        
+def _layoutItems(item, limit):
+    """Return the items of a subtree in the order the layouts are stored in or None if 
+    there are more than limit items."""
+    items = [item]
+    i = 0
+    while i < len(items):
+        item = items[i]
+        i += 1
+        if isinstance(item, MultiItem):
+            for child in item.items:
+                if child:
+                    items.append(child)
+            if len(items) > limit:
+                return None
+    return items
+        
+def _saveLayout(items, x, y):
+    """Return the layout of a resized subtree for LayoutCache.
+    
+    Args:
+        items (list): the items of the subtree returned by _layoutItems().
+        x, y (float): the origin the top item was resized at.
+    """
+    layout = []
+    dx, dy = -x, -y
+    for item in items:
+        r = item.rect
+        state = [r.x0() + dx, r.y0() + dy, r.x1() + dx, r.y1() + dy, item.style]
+        if isinstance(item, MultiItem):
+            state += [item.offset.x() + dx, item.offset.y() + dy, 
+                      item.margins.x(), item.margins.y(), item.isFitted()]
+        layout.append(tuple(state))
+        # the children are relative to their parents
+        dx = dy = 0.0
+    return layout
+    
+def _restoreLayout(items, layout, x, y):
+    """Set the layout stored by _saveLayout() to the items of an identical subtree placing 
+    it at x,y."""
+    dx, dy = x, y
+    for item, state in zip(items, layout):
+        item.rect = Rect(state[0] + dx, state[1] + dy, state[2] + dx, state[3] + dy)
+        item.style = state[4]
+        if len(state) > 5:
+            item.offset = rect.Point(state[5] + dx, state[6] + dy)
+            item.margins = rect.Point(state[7], state[8])
+            if state[9]:
+                item._fit = (item.rect, item.rect.x0(), item.rect.y0())
+            else:
+                item._fit = None
+        dx = dy = 0.0
+
+# the layout cache used by the complex items
+layouts = LayoutCache()
+
 #---------------------------------------------------------------------------------
 symbols = {'alpha': u'\u03b1',
            'beta': u'\u03b2',
@@ -215,8 +584,8 @@ class TextItem(DocItem):
     
     def resizePDF(self, pdf, x = 0, y = 0):
         """Resize internal Rect according to current settings of pdf"""
-        width = pdf.get_string_width( self.getText() )
-        height = pdf.font_size_pt / pdf.k
+        width = text_widths.width( pdf, self.getText() )
+        height = layoutFont(pdf).font_size
         self.rect = Rect( x, y, x + width, y + height )
     
     def cellPDF(self, pdf, r = None):
@@ -234,6 +603,14 @@ class TextItem(DocItem):
         """Doesn't need to do anything as cellPDF uses self.rect to output the content"""
         pass
         
+    def isFitted(self):
+        """A text item never needs refitting."""
+        return True
+        
+    def layoutKey(self):
+        """Return a structural key of this item, see DocItem.layoutKey()."""
+        return (self.__class__, self.text, self.style)
+        
 #---------------------------------------------------------------------------------
 class Word(TextItem):
     """Prints a word"""
@@ -290,8 +667,8 @@ class InlineMathBlock(MultiItem):
             self.appendItem(item)
         
     def resizePDF(self, pdf, x = 0, y = 0):
-        self.rect = Rect(x,y,x,y)
-        dx = pdf.get_string_width(' ')
+        self.resetLayout(x, y)
+        dx = text_widths.width(pdf, ' ')
         dx *= self.style[1]
         rectList = []
         width = 0.0
@@ -299,8 +676,8 @@ class InlineMathBlock(MultiItem):
         for item in self.items:
             if item:
                 if hasattr(item,'style') and item.style != style:
-                    setFontPDF(pdf, item.style, self.styles)
-                item.resizePDF(pdf,x,y)
+                    useFontPDF(pdf, item.style, self.styles)
+                layouts.resize(pdf, item, x, y)
                 rectList.append(item.rect)
                 width += item.rect.width() + dx
                 
@@ -320,19 +697,19 @@ class MathPower(MultiItem):
         if len(self.items) < 2 or not self.items[0] or not self.items[1]:
             raise Exception('MathPower must have two items.')
 
-        self.rect = Rect(x,y,x,y)
-        dx = pdf.get_string_width(' ') * self.style[1]
+        self.resetLayout(x, y)
+        dx = text_widths.width(pdf, ' ') * self.style[1]
         
         base = self.items[0] 
         if hasattr(base,'style'):
-            setFontPDF(pdf, base.style, self.styles)
-        base.resizePDF(pdf,x,y)
+            useFontPDF(pdf, base.style, self.styles)
+        layouts.resize(pdf, base, x, y)
 
         index = self.items[1] 
         index.scaleFont(0.8)
         if hasattr(index,'style'):
-            setFontPDF(pdf, index.style, self.styles)
-        index.resizePDF(pdf, base.rect.x1() + dx, y - base.rect.height() * 0.4)
+            useFontPDF(pdf, index.style, self.styles)
+        layouts.resize(pdf, index, base.rect.x1() + dx, y - base.rect.height() * 0.4)
 
         self.rect.unite(base.rect)
         self.rect.unite(index.rect)
@@ -367,21 +744,21 @@ class MathFrac(MultiItem):
         if len(self.items) < 2 or not self.items[0] or not self.items[1]:
             raise Exception('MathFrac must have two items.')
 
-        self.rect = Rect(x,y,x,y)
-        dx = pdf.get_string_width(' ') * self.style[1]
+        self.resetLayout(x, y)
+        dx = text_widths.width(pdf, ' ') * self.style[1]
         self.margins.set(dx, 0.0)
-        setFontPDF(pdf, self.style, self.styles)
-        lineHeight = pdf.font_size_pt / pdf.k
+        useFontPDF(pdf, self.style, self.styles)
+        lineHeight = layoutFont(pdf).font_size
         
         numerator = self.items[0] 
         if hasattr(numerator,'style'):
-            setFontPDF(pdf, numerator.style, self.styles)
-        numerator.resizePDF(pdf,x + dx, y - lineHeight * 0.5)
+            useFontPDF(pdf, numerator.style, self.styles)
+        layouts.resize(pdf, numerator, x + dx, y - lineHeight * 0.5)
 
         denominator = self.items[1] 
         if hasattr(denominator,'style'):
-            setFontPDF(pdf, denominator.style, self.styles)
-        denominator.resizePDF(pdf, x + dx, numerator.rect.y1())
+            useFontPDF(pdf, denominator.style, self.styles)
+        layouts.resize(pdf, denominator, x + dx, numerator.rect.y1())
         
         if numerator.rect.width() > denominator.rect.width():
             denominator.rect.alignXCenter(numerator.rect)
@@ -394,7 +771,7 @@ class MathFrac(MultiItem):
 
     def cellPDF(self, pdf, r = None):
         MultiItem.cellPDF(self, pdf, r)
-        y = self.items[0].rect.y1()
+        y = self.items[0].rect.y1() + self.offset.y()
         pdf.set_line_width(0.2)
         if r:
             x_shift = r.x0()
@@ -425,6 +802,10 @@ class MathBigBrackets(InlineMathBlock):
         else:
             self.data = None
         
+    def layoutKey(self):
+        """Return a structural key of this item, see DocItem.layoutKey()."""
+        return InlineMathBlock.layoutKey(self) + (self.bra is None, self.ket is None)
+        
     def appendItem(self, item):
         """Override append a child item. There can only be one item"""
         self.items = []
@@ -451,6 +832,8 @@ class MathBigBrackets(InlineMathBlock):
             dy = h * ( 1.0 - pdf_baseline )
             self.data.rect.translate(0,dy)
             self.data.refit()
+            # the content has moved: the next refit() must check it
+            self._fit = None
         #self.showRect(pdf)
         
 #---------------------------------------------------------------------------------
@@ -476,24 +859,24 @@ class MathBelowAndAbove(MultiItem):
     def resizePDF(self, pdf, x = 0, y = 0):
         if len(self.items) == 0:
             raise Exception('MathAboveAndBelow must have at least one item.')
-        self.rect = Rect(x,y,x,y)
+        self.resetLayout(x, y)
         base = self.items[0]
-        self.setFontPDF(pdf, base)
-        base.resizePDF(pdf,x,y)
+        self.useFontPDF(pdf, base)
+        layouts.resize(pdf, base, x, y)
         self.rect.unite(base.rect)
 
         if len(self.items) > 1 and self.items[1]:
             below = self.items[1]
-            self.setFontPDF(pdf, below)
-            below.resizePDF(pdf,x,y)
+            self.useFontPDF(pdf, below)
+            layouts.resize(pdf, below, x, y)
             below.rect.translate(0, base.rect.height())
             below.rect.alignXCenter( base.rect )
             self.rect.unite(below.rect)
             
         if len(self.items) > 2 and self.items[2]:
             above = self.items[2]
-            self.setFontPDF(pdf, above)
-            above.resizePDF(pdf,x,y)
+            self.useFontPDF(pdf, above)
+            layouts.resize(pdf, above, x, y)
             above.rect.translate(0, - above.rect.height())
             above.rect.alignXCenter( base.rect )
             self.rect.unite(above.rect)
@@ -511,10 +894,10 @@ class MathColumn(MultiItem):
             self.appendItem(item)
         
     def resizePDF(self, pdf, x = 0, y = 0):
-        self.rect = Rect(x,y,x,y)
+        self.resetLayout(x, y)
         for item in self.items:
-            self.setFontPDF(pdf, item)
-            item.resizePDF(pdf,x,y)
+            self.useFontPDF(pdf, item)
+            layouts.resize(pdf, item, x, y)
             item.rect.translate(0,self.rect.height())
             self.rect.unite(item.rect)
                 
@@ -533,7 +916,7 @@ class MathSumLike(MathBelowAndAbove):
         MathBelowAndAbove.__init__(self, sigma, below, above)
         
     def resizePDF(self, pdf, x = 0, y = 0):
-        self.setFontPDF(pdf, self)
+        self.useFontPDF(pdf, self)
         lineHeight = self.getLineHeight(pdf)
         MathBelowAndAbove.resizePDF(self, pdf, x, y)
         dy = self.items[0].rect.height() * pdf_baseline - lineHeight
@@ -572,11 +955,26 @@ class MathSubSuperscript(MultiItem):
         if superscript:
             superscript.scaleFont(0.8)
             self.appendItem(superscript)
+            
+    def setBase(self, base):
+        """Replace the base item."""
+        self.items[0] = base
+        self.base = base
+        
+    def setSuperscript(self, superscript):
+        """Add a superscript to an item created without one."""
+        superscript.scaleFont(0.8)
+        self.superscript = superscript
+        self.appendItem(superscript)
+        
+    def layoutKey(self):
+        """Return a structural key of this item, see DocItem.layoutKey()."""
+        return MultiItem.layoutKey(self) + (not self.subscript, not self.superscript)
         
     def resizePDF(self, pdf, x = 0, y = 0):
+        self.resetLayout(x, y)
         self.resizeItemsPDF(pdf, x, y)
-        dx = pdf.get_string_width(' ') * self.style[1]
-        self.rect = Rect(x,y,x,y)
+        dx = text_widths.width(pdf, ' ') * self.style[1]
          
         h = self.base.rect.height()
         w = self.base.rect.width() + dx
@@ -632,7 +1030,8 @@ class Paragraph(MultiItem):
                 margins.
         """
         style = self.style
-        setFontPDF(pdf, style, self.styles)
+        useFontPDF(pdf, style, self.styles)
+        self.resetLayout(x, y)
 
         if self.width <= 0:
             self.width = pdf.fw - pdf.l_margin - pdf.r_margin - x
@@ -643,7 +1042,7 @@ class Paragraph(MultiItem):
             xstart = x
             xend = x + self.width
         
-        self.space = pdf.get_string_width(' ')
+        self.space = text_widths.width(pdf, ' ')
         self.lineHeight = self.getLineHeight(pdf) * 1.2
         if self.t_margin < 0:
             self.t_margin = self.lineHeight * 0.5
@@ -658,26 +1057,27 @@ class Paragraph(MultiItem):
             if item:
                 if item.style != style:
                     style = item.style
-                    self.setFontPDF(pdf, item)
-                item.resizePDF(pdf, 0, y)
+                    self.useFontPDF(pdf, item)
+                layouts.resize(pdf, item, 0, y)
                 rectList.append( item.rect )
             
         # position the items on the page
             
-        alignFunction = textAlignments[self.textAlignment]
-        
-        onFirstLine = True
-        while len( rectList ) > 0:
-            n = alignFunction(rectList, xstart, xend, self.space)
-            if n == len( rectList ) and self.textAlignment == 'j':
-                rect.alignLeft(rectList, xstart, xend, self.space)
-            if not onFirstLine:
-                for r in rectList:
-                    r.translate(rect.Point(0,self.lineHeight))
-#            for r in rectList[:n]:
-#                self.rect.unite(r)
-            onFirstLine = False
-            del rectList[:n]
+        n = len( rectList )
+        x0, x1 = rect.xArrays(rectList)
+        dy = 0.0
+        for start, end, rwidth in rect.breakLinesArrays(x0, x1, xstart, xend, self.space):
+            alignment = self.textAlignment
+            # the last line isn't justified
+            if end == n and alignment == 'j':
+                alignment = 'l'
+            rect.alignArrays(x0, x1, start, end, xstart, xend, rwidth, alignment)
+            for i in range(start, end):
+                r = rectList[i]
+                r.setX(x0[i], x1[i])
+                if dy:
+                    r.translate(rect.Point(0,dy))
+            dy += self.lineHeight
         #self.rect = Rect( xstart, y, xend, y )
         self.rect = self.getUnionRect()
         # add top and bottom margins
@@ -688,16 +1088,19 @@ class Paragraph(MultiItem):
     def outputPDF(self, pdf, r):
         """Output the paragraph to PDF"""
         style = self.style
+        oy = self.offset.y()
+        frame = self.itemsFrame(r)
         for item in self.items:
             if item:
                 if item.style != style:
                     style = item.style
                     self.setFontPDF(pdf, item)
-                if item.rect.y1() > r.y0() + r.height():# - self.doc.pdf.t_margin:
+                if item.rect.y1() + oy > r.y0() + r.height():# - self.doc.pdf.t_margin:
                     self.doc.addPage()
-                    dy = item.rect.y0() - r.y0() - self.doc.pdf.t_margin
+                    dy = item.rect.y0() + oy - r.y0() - self.doc.pdf.t_margin
                     r.translate(0, dy)
-                item.cellPDF(pdf, r)
+                    frame = self.itemsFrame(r)
+                item.cellPDF(pdf, frame)
                 
 #---------------------------------------------------------------------------------
 class Title(Paragraph):
@@ -721,6 +1124,20 @@ class Title(Paragraph):
                 item.style = 'title'
         Paragraph.resizePDF(self, pdf, x_start + self.width * 0.1, y_start)
         
+class ErrorParagraph(Paragraph):
+    """A part of a document source which couldn't be parsed, printed as plain words."""
+    def __init__(self, source, width = -1):
+        """Constructor.
+        
+        Args:
+            source (str): the source which couldn't be parsed.
+            width (float): see Paragraph.
+        """
+        Paragraph.__init__(self, width)
+        self.source = source
+        for word in source.split():
+            self.appendItem(Word(word))
+        
 #---------------------------------------------------------------------------------
 class Document:
     """Entire document"""
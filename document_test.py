@@ -142,9 +142,37 @@ class TestDocument(unittest.TestCase):
         item.rect.translate(100,50)
         item.refit()
         self.assertEqual(item.rect, rect.Rect(100,50,103,54))
-        self.assertEqual(item.items[0].rect, rect.Rect(100,50,101,52))
-        self.assertEqual(child.rect, rect.Rect(100.5,51,103,54))
-        self.assertEqual(child.rect, child.items[0].rect)
+        # the children are moved by the offset of their parent
+        self.assertEqual(item.items[0].rect, rect.Rect(0,0,1,2))
+        self.assertEqual(item.itemRect(item.items[0]), rect.Rect(100,50,101,52))
+        self.assertEqual(item.itemRect(child), rect.Rect(100.5,51,103,54))
+        self.assertEqual(child.rect, child.itemRect(child.items[0]))
+        
+    def test_MultiItem_moveTo(self):
+        # moving a fitted item doesn't refit or move its descendants
+        item = MultiItem()
+        child = MultiItem()
+        word = Word('a')
+        child.appendItem(word)
+        item.appendItem(child)
+        word.rect = rect.Rect(1,2,3,4)
+        child.rect = rect.Rect(1,2,3,4)
+        item.rect = rect.Rect(1,2,3,4)
+        item.refit()
+        self.assertTrue(item.isFitted())
+        self.assertTrue(child.isFitted())
+        refits = []
+        child.refit = lambda: refits.append(child)
+        item.moveTo(10,20)
+        self.assertEqual(refits, [])
+        self.assertEqual(word.rect, rect.Rect(1,2,3,4))
+        self.assertEqual(item.itemRect(child), rect.Rect(10,20,12,22))
+        self.assertEqual(item.itemsFrame(rect.Rect(10,20,30,40)), rect.Rect(1,2,21,22))
+        # a moved child is refitted
+        child.rect.translate(1,1)
+        self.assertFalse(child.isFitted())
+        item.refit()
+        self.assertEqual(refits, [child])
         
     def test_TextItem(self):
         """It's a base class for text based items"""
@@ -621,6 +649,109 @@ class TestDocument(unittest.TestCase):
         
         pdf.output('out/document/test_Paragraph.pdf', 'F')
         
+    def test_Paragraph_lines(self):
+        pdf = FPDF()
+        initPDF(pdf)
+        for alignment in 'jlrc':
+            par = Paragraph(30)
+            par.textAlignment = alignment
+            # the long word doesn't fit on a line
+            par.addItems(w('one'),w('two'),w('three'),w('four'),w('fivefivefivefivefivefive'),w('six'))
+            par.resizePDF(pdf)
+            lines = [item.rect.y0() for item in par.items]
+            self.assertEqual(len(set(lines)), 4)
+            self.assertEqual(lines, sorted(lines))
+            for i, y in enumerate(sorted(set(lines))):
+                self.assertAlmostEqual(y, lines[0] + i * par.lineHeight)
+            if alignment in 'jl':
+                self.assertAlmostEqual(par.items[4].rect.x0(), 0)
+        
+    def test_TextWidthCache(self):
+        
+        pdf = FPDF()
+        initPDF(pdf)
+        cache = TextWidthCache(4)
+        self.assertEqual(cache.width(pdf, 'word'), pdf.get_string_width('word'))
+        self.assertEqual(cache.width(pdf, 'word'), pdf.get_string_width('word'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # the widths depend on the font
+        setFontPDF(pdf, 'title')
+        self.assertEqual(cache.width(pdf, 'word'), pdf.get_string_width('word'))
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.hitRate(), 1.0 / 3)
+        # the size is bounded, the recently used widths are kept
+        for text in ('a', 'b', 'c', 'word', 'd', 'e'):
+            cache.width(pdf, text)
+        self.assertTrue(len(cache) <= 4)
+        hits = cache.hits
+        cache.width(pdf, 'word')
+        self.assertEqual(cache.hits, hits + 1)
+        # the fonts are re-registered
+        initPDF(pdf)
+        self.assertEqual(len(text_widths), 0)
+        self.assertEqual(text_widths.hits, 0)
+        
+    def test_LayoutCache(self):
+        
+        pdf = FPDF()
+        initPDF(pdf)
+        cache = LayoutCache(4)
+        frac1 = f(ss(v('x'), n('1')), br(b(v('a'), si('+'), sy('alpha'))))
+        frac2 = f(ss(v('x'), n('1')), br(b(v('a'), si('+'), sy('alpha'))))
+        self.assertEqual(frac1.layoutKey(), frac2.layoutKey())
+        self.assertNotEqual(frac1.layoutKey(), f(ss(v('x'), None, n('1')), v('a')).layoutKey())
+        useFontPDF(pdf, frac1.style)
+        cache.resize(pdf, frac1, 1, 2)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        font = layoutFont(pdf)
+        useFontPDF(pdf, frac2.style)
+        cache.resize(pdf, frac2, 11, 22)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # the copy is placed at the new origin
+        r = rect.Rect(frac1.rect)
+        r.translate(10, 20)
+        self.assertTrue(frac2.rect.p0().isNear(r.p0(), 1e-12))
+        self.assertTrue(frac2.rect.p1().isNear(r.p1(), 1e-12))
+        # the children keep their coordinates relative to the parent
+        self.assertEqual(frac2.items[1].rect, frac1.items[1].rect)
+        self.assertEqual(frac2.items[1].items[0].style, frac1.items[1].items[0].style)
+        self.assertTrue(frac2.offset.isNear(frac1.offset + rect.Point(10, 20), 1e-12))
+        # the font is left as by resizing
+        self.assertTrue(layoutFont(pdf) is font)
+        # the layouts depend on the font
+        setFontPDF(pdf, 'title')
+        cache.resize(pdf, frac2, 11, 22)
+        self.assertEqual(cache.misses, 2)
+        # the size is bounded
+        for text in ('a', 'b', 'c', 'd', 'e'):
+            cache.resize(pdf, b(v(text)))
+        self.assertTrue(len(cache) <= 4)
+        # the fonts are re-registered
+        initPDF(pdf)
+        self.assertEqual(len(layouts), 0)
+        self.assertEqual(layouts.hits, 0)
+        
+    def test_FontHandle(self):
+        
+        pdf = FPDF()
+        initPDF(pdf)
+        for style in ('body', 'title', ('math-var', 0.8), 'math-symbol'):
+            font = fontHandlePDF(pdf, style)
+            self.assertTrue(font is fontHandlePDF(pdf, style))
+            setFontPDF(pdf, style)
+            self.assertTrue(layoutFont(pdf) is font)
+            for text in ('word', u'\u03b1+x', ' '):
+                self.assertEqual(font.stringWidth(text), pdf.get_string_width(text))
+            self.assertEqual(font.font_size, pdf.font_size)
+        # switching the layout font doesn't change the pdf and writes nothing
+        page = pdf.pages[pdf.page]
+        useFontPDF(pdf, 'body')
+        self.assertEqual(pdf.pages[pdf.page], page)
+        self.assertEqual(pdf.font_family, 'math-symbol')
+        self.assertTrue(layoutFont(pdf) is fontHandlePDF(pdf, 'body'))
+        w('word').resizePDF(pdf)
+        self.assertEqual(pdf.pages[pdf.page], page)
+        
     def test_Document(self):
         
         pdf = FPDF('P','mm',(100,40))
@@ -1,10 +1,60 @@
 """Simple latex parser"""
+import bisect
+import itertools
+import multiprocessing
+import re
 from string_parser import *
 from document import *
+from math_parser import OpListParser
     
 ######################################################################################
 #        Parsers
 ######################################################################################
+# version of the grammar: increment when the parsers produce different document items 
+# for the same source (used by parse_cache)
+grammar_version = 2
+
+class WordTable:
+    """Shares the text of equal words between the document items.
+    
+    The latex parsers take the texts of the words, variables, signs and numbers from 
+    the source through text(). When enabled, equal texts are stored once: a large document 
+    then keeps a single copy of every distinct word instead of a copy per occurrence. 
+    Off by default. The table of the texts is kept in the index cache with the parsed 
+    string, so it lives for one top-level parse (see IndexCache) and is never kept after it.
+    """
+    def __init__(self):
+        """Constructor."""
+        self.enabled = False
+        
+    def enable(self):
+        """Switch sharing on."""
+        self.enabled = True
+        
+    def disable(self):
+        """Switch sharing off."""
+        self.enabled = False
+        
+    def text(self, m, s, skip = 0):
+        """Return the text of a match.
+        
+        Args:
+            m (Match): the match.
+            s (str): the parsed string.
+            skip (int): number of characters to skip at the start of the match.
+        """
+        text = s[m.start + skip:m.start + m.size]
+        if not self.enabled:
+            return text
+        table = indexes.lookup(s, ('words',))
+        if table is None:
+            table = {}
+            indexes.store(s, ('words',), table)
+        return table.setdefault(text, text)
+
+# the word table used by the latex parsers
+words = WordTable()
+
 """ Commands without arguments:
 Dictionaries containing DocItem class names with constructors taking
 a single argument - the command name
@@ -25,6 +75,138 @@ two arguments: the command name, and the argument
 doc_command_names_1 = {'title': Title,
                   }
 
+#---------------------------------------------------------------------------------
+# token kinds by the group index in the token pattern
+_tokenKinds = (None, 'command', 'number', 'alpha', 'space', 'sign', 'char')
+_tokenRe = r'(\\[^\W\d_]+)|(\d+(?:\.\d*)?)|([^\W\d_]+)|([ \t\n]+)|([-+=><,!/()])|(.)'
+_tokenPattern = re.compile(_tokenRe, re.DOTALL)
+_utokenPattern = re.compile(_tokenRe, re.DOTALL | re.UNICODE)
+
+def tokenize(s):
+    """Split a string into latex tokens in one pass.
+    
+    The tokens are: commands (\\name), numbers, runs of letters, runs of spaces, 
+    math signs and single other characters. The tokens are kept in the index cache 
+    while the same string object is parsed (see IndexCache).
+    
+    Args:
+        s (str): the string.
+        
+    Return:
+        A dict mapping the starting index of each token to a list [kind, end, wordEnd]
+        where wordEnd is the end of the word (a run of characters other than spaces 
+        and backslashes) starting at the token. The kind is None if the token doesn't
+        match the way the character parsers would match it (can happen with some 
+        unicode characters).
+    """
+    tokens = indexes.lookup(s, ('tokens',))
+    if tokens is not None:
+        return tokens
+    if isinstance(s, unicode):
+        pattern = _utokenPattern
+    else:
+        pattern = _tokenPattern
+    tokens = {}
+    # tokens of the current word
+    word = []
+    for m in pattern.finditer(s):
+        i, j = m.span()
+        kind = _tokenKinds[m.lastindex]
+        token = [kind, j, i]
+        tokens[i] = token
+        if kind == 'space' or s[i] == '\\':
+            for t in word:
+                t[2] = i
+            word = []
+            if kind == 'command' and (s[j:j + 1].isalpha() or not m.group(1)[1:].isalpha()):
+                token[0] = None
+            continue
+        word.append(token)
+        # check the tokens against AlphaParser and DigitParser 
+        following = s[j:j + 1]
+        if kind == 'alpha':
+            if following.isalpha() or not m.group(3).isalpha():
+                token[0] = None
+        elif kind == 'number':
+            if following.isdigit() or (following == '.' and s[j - 1] == '.'):
+                token[0] = None
+    for t in word:
+        t[2] = len(s)
+    indexes.store(s, ('tokens',), tokens)
+    return tokens
+
+#---------------------------------------------------------------------------------
+class TokenParser(Parser):
+    """Matches a token of a kind returned by tokenize().
+    
+    Where the tokens cannot be used (the string is parsed from the middle of a token 
+    or the token is cut by the end index) a character parser is used instead.
+    """
+    def __init__(self, kind, parser):
+        """Constructor.
+        
+        Args:
+            kind (str): the token kind or 'word' to match a word.
+            parser (Parser): a parser matching the same strings as the tokens.
+        """
+        Parser.__init__(self)
+        self.kind = kind
+        self.parser = parser
+        
+    def clone(self):
+        """Implements cloning."""
+        return TokenParser(self.kind, self.parser)
+    
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (TokenParser, self.kind)
+    
+    def _firstChars(self):
+        """The first characters of the character parser."""
+        return self.parser._firstChars()
+    
+    def _parse(self, s, start, end):
+        """Implements the match test."""
+        token = tokenize(s).get(start)
+        if token is not None:
+            if self.kind == 'word':
+                size = min(token[2], end) - start
+                if size > 0:
+                    return Match(self, start, size)
+                return None
+            if token[0] is not None and token[1] <= end:
+                if token[0] == self.kind:
+                    return Match(self, start, token[1] - start)
+                return None
+        m = self.parser.parse(s, start, end)
+        if m is None:
+            return None
+        return Match(self, start, m.size)
+    
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        me = gen.const(self)
+        token = gen.tmp()
+        i = gen.tmp()
+        m = gen.tmp()
+        gen.line('%s = None' % out)
+        gen.line('%s = %s(s).get(%s)' % (token, gen.const(tokenize), pos))
+        if self.kind == 'word':
+            gen.line('if %s is not None:' % token)
+            gen.line('    %s = min(%s[2], %s)' % (i, token, end))
+            gen.line('    if %s > %s:' % (i, pos))
+            gen.line('        %s = Match(%s, %s, %s - %s)' % (out, me, pos, i, pos))
+        else:
+            gen.line('if %s is not None and %s[0] is not None and %s[1] <= %s:' % (token, token, token, end))
+            gen.line('    if %s[0] == %r:' % (token, self.kind))
+            gen.line('        %s = Match(%s, %s, %s[1] - %s)' % (out, me, pos, token, pos))
+        gen.line('else:')
+        gen.indent()
+        gen.emit(self.parser, m, pos, end, True)
+        gen.line('if %s is not None:' % m)
+        gen.line('    %s = Match(%s, %s, %s.size)' % (out, me, pos, m))
+        gen.dedent()
+    
 #---------------------------------------------------------------------------------
 class LatexParser(Parser):
     """Base class for latex parsers."""
@@ -37,37 +219,133 @@ class LatexParser(Parser):
         Parser.__init__(self)
         self.mode = mode
         self.docItem = None
+        
+    def _parse(self, s, start, end):
+        """Implements the match test: match self.parser and check the match with _accept().
+        
+        The doc item isn't created here but in _build() when the whole match is found.
+        """
+        m = self.parser.parse(s, start, end)
+        if m is None or not self._accept(m, s):
+            return None
+        return Match(self, m.start, m.size, None, [m])
+    
+    def _parseSteps(self, s, start, end):
+        """Implements the match test for StackParser."""
+        m = yield (self.parser, start, end)
+        if m is None or not self._accept(m, s):
+            yield (None,)
+        else:
+            yield (Match(self, m.start, m.size, None, [m]),)
+    
+    def _accept(self, m, s):
+        """Virtual protected method checking a match of self.parser while parsing.
+        
+        Must not create doc items: the match can still be abandoned.
+        
+        Args:
+            m (Match): the match of self.parser.
+            s (str): the string being parsed.
+        Return:
+            True to accept the match (default), False to reject it.
+        """
+        return True
+    
+    def _action(self, m, s):
+        """Virtual protected method creating the doc item of this parser.
+        
+        Called by _build() after the whole string is matched. The doc items of 
+        the latex parsers inside m are already created.
+        
+        Args:
+            m (Match): the match of self.parser.
+            s (str): the string being parsed.
+        Return:
+            The doc item.
+        """
+        raise Exception('_action method not implemented')
+    
+    def _build(self, m, s):
+        """Implements the deferred action: pass the match of self.parser to _action()."""
+        return self._action(m.children[0], s)
+    
+    def _firstChars(self):
+        """The first characters of self.parser."""
+        if overrides(self, '_parse', LatexParser):
+            return None
+        return self.parser._firstChars()
+    
+    def _compileAsRule(self):
+        """Latex parsers built on self.parser are compiled into separate functions."""
+        return not overrides(self, '_parse', LatexParser)
+    
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation: inline the code of self.parser and call _action()."""
+        if overrides(self, '_parse', LatexParser):
+            Parser._compile(self, gen, out, pos, end)
+            return
+        m = gen.tmp()
+        me = gen.const(self)
+        gen.emit(self.parser, m, pos, end, True)
+        gen.line('%s = None' % out)
+        if overrides(self, '_accept', LatexParser):
+            gen.line('if %s is not None and %s._accept(%s, s):' % (m, me, m))
+        else:
+            gen.line('if %s is not None:' % m)
+        gen.line('    %s = Match(%s, %s.start, %s.size, None, [%s])' % (out, me, m, m, m))
+        
+    def _setResult(self, m, start):
+        """Store the result and the created doc item."""
+        Parser._setResult(self, m, start)
+        if m:
+            self.docItem = m.docItem
+        else:
+            self.docItem = None
 
+#---------------------------------------------------------------------------------
+def commandParser():
+    """Create a character parser matching a command: a backslash followed by letters."""
+    parser = SeqParser()
+    parser.addParser( CharParser('\\') )
+    parser.addParser( AlphaParser() )
+    return parser
+    
 #---------------------------------------------------------------------------------
 class CommandParser(LatexParser):
     """Parses a latex command of the form: \command_name ."""
-    def __init__(self, creator, mode = 'body'):
-        """Constructor."""
+    def __init__(self, creator, mode = 'body', names = None):
+        """Constructor.
+        
+        Args:
+            creator (function): creates the doc item from the command name, returns None
+                for unknown commands.
+            mode (str): a latex mode.
+            names (dict or set): the known command names. If None the creator is called 
+                to check if a command is known.
+        """
         LatexParser.__init__(self, mode)
-        self.nameParser = SeqParser()
-        self.nameParser.addParser( CharParser('\\') )
-        self.nameParser.addParser( AlphaParser() )
+        self.parser = TokenParser('command', commandParser())
         self.creator = creator
+        self.names = names
         
     def clone(self):
         """Implement cloning"""
-        return CommandParser(self.creator, self.mode)
-    
-    def _test(self, s, start, end):
-        """Implements the match test."""
-        self.nameParser.match(s, start, end)
-        if not self.nameParser.hasMatch():
-            return (False, 0)
+        return CommandParser(self.creator, self.mode, self.names)
 
-        name = self.nameParser[1].getMatch(s)        
-#        if name in command_names_0:
-#            self.docItem = command_names_0[name](name)
-#            return (True, self.nameParser.getEnd() - start)
-        self.docItem = self.creator(name)
-        if self.docItem: 
-            return (True, self.nameParser.getEnd() - start)
-        
-        return (False, 0)
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (CommandParser, self.creator, self.mode)
+    
+    def _accept(self, m, s):
+        """Accept only the known commands."""
+        name = s[m.start + 1:m.getEnd()]
+        if self.names is not None:
+            return name in self.names
+        return self.creator(name) is not None
+    
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
+        return self.creator(words.text(m, s, 1))
 
 #---------------------------------------------------------------------------------
 class WordParser(LatexParser):
@@ -75,20 +353,21 @@ class WordParser(LatexParser):
     def __init__(self, mode = 'body'):
         """Constructor."""
         LatexParser.__init__(self, mode)
-        self.parser = AllNotCharParser(' \t\n\\')
+        self.parser = TokenParser('word', AllNotCharParser(' \t\n\\'))
         
     def clone(self):
         """Implement cloning"""
         return WordParser(self.mode)
+
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (WordParser, self.mode)
     
-    def _test(self, s, start, end):
-        """Implements the match test."""
-        self.parser.match(s, start, end)
-        if not self.parser.hasMatch():
-            return (False, 0)
-        self.docItem = Word(self.parser.getMatch(s))
-        self.docItem.style = self.mode
-        return (True, self.parser.getEnd() - start)
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
+        docItem = Word(words.text(m, s))
+        docItem.style = self.mode
+        return docItem
     
 #---------------------------------------------------------------------------------
 def ParagraphItemCreator(cmd_name, arg1 = None):
@@ -100,220 +379,353 @@ def ParagraphItemCreator(cmd_name, arg1 = None):
 class MathVariableParser(LatexParser):
     def __init__(self):
         LatexParser.__init__(self, mode='math-var')
+        self.parser = TokenParser('alpha', AlphaParser())
 
     def clone(self):
         """Implement cloning"""
         return MathVariableParser()
+
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (MathVariableParser,)
     
-    def _test(self, s, start, end):
-        parser = AlphaParser()
-        parser.match(s, start, end)
-        if not parser.hasMatch():
-            return (False, 0)
-        self.docItem = MathVariable(parser.getMatch(s))
-        return (True, parser.getEnd() - start)
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
+        return MathVariable(words.text(m, s))
 
 #---------------------------------------------------------------------------------
 class MathSignParser(LatexParser):
     def __init__(self):
         LatexParser.__init__(self, mode='math-var')
+        self.parser = TokenParser('sign', CharParser('+-=><,!/()'))
 
     def clone(self):
         """Implement cloning"""
         return MathSignParser()
+
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (MathSignParser,)
     
-    def _test(self, s, start, end):
-        parser = CharParser('+-=><,!/()')
-        parser.match(s, start, end)
-        if not parser.hasMatch():
-            return (False, 0)
-        self.docItem = MathSign(parser.getMatch(s))
-        return (True, parser.getEnd() - start)
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
+        return MathSign(words.text(m, s))
 
 #---------------------------------------------------------------------------------
 class MathSymbolParser(LatexParser):
     def __init__(self):
         LatexParser.__init__(self, mode='math-var')
+        self.parser = TokenParser('command', commandParser())
 
     def clone(self):
         """Implement cloning"""
         return MathSymbolParser()
+
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (MathSymbolParser,)
     
-    def _test(self, s, start, end):
-        parser = SeqParser()
-        parser.addParser( CharParser('\\') )
-        parser.addParser( AlphaParser() )
-        parser.match(s, start, end)
-        if not parser.hasMatch():
-            return (False, 0)
-        name = parser[1].getMatch(s)
+    def _accept(self, m, s):
+        """Accept only the known symbols and functions."""
+        name = s[m.start + 1:m.getEnd()]
+        return name in symbols or name in funs
+    
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
+        name = words.text(m, s, 1)
         if name in symbols:
-            self.docItem = Symbol(name)
-            return (True, parser.getEnd() - start)
-        elif name in funs:
-            self.docItem = MathFunction(name)
-            return (True, parser.getEnd() - start)
-        else:
-            return (False, 0)
+            return Symbol(name)
+        return MathFunction(name)
 
 #---------------------------------------------------------------------------------
 class MathNumberParser(LatexParser):
     def __init__(self):
         LatexParser.__init__(self, mode='math-var')
+        parser = SeqParser()
+        parser.addParser( ListParser(DigitParser()) )
+        parser.addParser( ListParser(CharParser('.'),True,1) )
+        parser.addParser( ListParser(DigitParser(),True) )
+        self.parser = TokenParser('number', parser)
 
     def clone(self):
         """Implement cloning"""
         return MathNumberParser()
+
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (MathNumberParser,)
     
-    def _test(self, s, start, end):
-        parser = SeqParser()
-        parser.addParser( ListParser(DigitParser()) )
-        parser.addParser( ListParser(CharParser('.'),True,1) )
-        parser.addParser( ListParser(DigitParser(),True) )
-        parser.match(s, start, end)
-        if not parser.hasMatch():
-            return (False, 0)
-        name = parser.getMatch(s)
-        self.docItem = MathNumber(name)
-        return (True, parser.getEnd() - start)
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
+        return MathNumber(words.text(m, s))
     
 #---------------------------------------------------------------------------------
 class MathFracParser(LatexParser):
     def __init__(self, inner_parser):
+        """Constructor.
+        
+        Args:
+            inner_parser (Parser): parser of the numerator and the denominator. Can be 
+                the grammar containing this parser.
+        """
         LatexParser.__init__(self, mode='math-var')
         self.inner_parser = inner_parser
+        self.nameParser = StringParser('\\frac')
+        self.argsParser = SeqParser()
+        self.argsParser.addParser( ZeroOrMoreSpaces() )
+        self.argsParser.addParser( BracketsParser('{','}',inner_parser) )
+        self.argsParser.addParser( ZeroOrMoreSpaces() )
+        self.argsParser.addParser( BracketsParser('{','}',inner_parser) )
 
     def clone(self):
         """Implement cloning"""
         return MathFracParser(self.inner_parser)
+
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (MathFracParser, self.inner_parser)
     
-    def _test(self, s, start, end):
-        numerator = self.inner_parser()
-        denominator = self.inner_parser()
-        nameParser = StringParser('\\frac')
-        nameParser.match(s, start, end)
-        if not nameParser.hasMatch():
-            return (False, 0)
-        parser = SeqParser()
-        parser.addParser( ZeroOrMoreSpaces() )
-        parser.addParser( BracketsParser('{','}',numerator) )
-        parser.addParser( ZeroOrMoreSpaces() )
-        parser.addParser( BracketsParser('{','}',denominator) )
-        parser.match(s, nameParser.getEnd(), end)
-        if not numerator.hasMatch() or not denominator.hasMatch():
+    def _firstChars(self):
+        """Starts with a backslash."""
+        return frozenset('\\')
+    
+    def _parse(self, s, start, end):
+        return runSteps(self._parseSteps(s, start, end), s)
+    
+    def _parseSteps(self, s, start, end):
+        m = self.nameParser.parse(s, start, end)
+        if m is None:
+            yield (None,)
+            return
+        m = yield (self.argsParser, m.getEnd(), end)
+        if m is None:
             raise Exception("Error in frac.")
-        self.docItem = MathFrac()
-        self.docItem.appendItem( numerator.docItem )
-        self.docItem.appendItem( denominator.docItem )
-        return (True, parser.getEnd() - start)
+        yield (Match(self, start, m.getEnd() - start, None, [m]),)
+    
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        name = gen.tmp()
+        i = gen.tmp()
+        args = gen.tmp()
+        gen.line('%s = None' % out)
+        gen.emit(self.nameParser, name, pos, end, True)
+        gen.line('if %s is not None:' % name)
+        gen.indent()
+        gen.line('%s = %s.start + %s.size' % (i, name, name))
+        gen.emit(self.argsParser, args, i, end)
+        gen.line('if %s is None:' % args)
+        gen.line('    raise Exception("Error in frac.")')
+        gen.line('%s = Match(%s, %s, %s.start + %s.size - %s, None, [%s])' % 
+                 (out, gen.const(self), pos, args, args, pos, args))
+        gen.dedent()
+    
+    def _action(self, m, s):
+        """Create the doc item from the match of the arguments."""
+        docItem = MathFrac()
+        docItem.appendItem( m[1][0].docItem )
+        docItem.appendItem( m[3][0].docItem )
+        return docItem
     
 #---------------------------------------------------------------------------------
 class MathSumParser(LatexParser):
+    # command names -> symbols
+    names = {'sum':'Sigma', 'prod': 'Pi'}
+    
     def __init__(self, inner_parser):
+        """Constructor.
+        
+        Args:
+            inner_parser (Parser): parser of the limits. Can be the grammar containing 
+                this parser.
+        """
         LatexParser.__init__(self, mode='math-var')
         self.inner_parser = inner_parser
+        nameParser = AltParser()
+        for name in self.names:
+            nameParser.addParser(StringParser(name))
+        self.nameParser = SeqParser()
+        self.nameParser.addParser( CharParser('\\') )
+        self.nameParser.addParser(nameParser)
+        self.belowParser = SeqParser()
+        self.belowParser.addParser( CharParser('_') )
+        self.belowParser.addParser( BracketsParser('{','}',inner_parser) )
+        self.aboveParser = SeqParser()
+        self.aboveParser.addParser( CharParser('^') )
+        self.aboveParser.addParser( BracketsParser('{','}',inner_parser) )
 
     def clone(self):
         """Implement cloning"""
         return MathSumParser(self.inner_parser)
+
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (MathSumParser, self.inner_parser)
     
-    def _test(self, s, start, end):
-        below = self.inner_parser()
-        above = self.inner_parser()
-        
-        names = {'sum':'Sigma', 'prod': 'Pi'}
-        
-        nameParser = AltParser()
-        for name in names:
-            nameParser.addParser(StringParser(name))
-        parser = SeqParser()
-        parser.addParser( CharParser('\\') )
-        parser.addParser(nameParser)
-        parser.match(s, start, end)
-        if not parser.hasMatch():
-            return (False, 0)
-        
-        start1 = parser.getEnd()
-        parser = SeqParser()
-        parser.addParser( CharParser('_') )
-        parser.addParser( BracketsParser('{','}',below) )
-        parser.match(s, start1, end)
-        if parser.hasMatch():
-            start1 = parser.getEnd()
-        parser = SeqParser()
-        parser.addParser( CharParser('^') )
-        parser.addParser( BracketsParser('{','}',above) )
-        parser.match(s, start1, end)
+    def _firstChars(self):
+        """Starts with a backslash."""
+        return frozenset('\\')
+    
+    def _parse(self, s, start, end):
+        return runSteps(self._parseSteps(s, start, end), s)
+    
+    def _parseSteps(self, s, start, end):
+        m = self.nameParser.parse(s, start, end)
+        if m is None:
+            yield (None,)
+            return
+        nameMatch = m
         
-        if below.hasMatch():
-            below = below.docItem
-        else:
-            below = None
-            
-        if above.hasMatch():
-            above = above.docItem
-        else:
-            above = None
+        start1 = m.getEnd()
+        below = yield (self.belowParser, start1, end)
+        if below:
+            start1 = below.getEnd()
+        above = yield (self.aboveParser, start1, end)
+        if above:
+            start1 = above.getEnd()
             
-        self.docItem = MathSumLike(names[nameParser.getMatch(s)],below,above)
-        return (True, parser.getEnd() - start)
+        yield (Match(self, start, start1 - start, None, [nameMatch, below, above]),)
+    
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        name = gen.tmp()
+        i = gen.tmp()
+        below = gen.tmp()
+        above = gen.tmp()
+        gen.line('%s = None' % out)
+        gen.emit(self.nameParser, name, pos, end, True)
+        gen.line('if %s is not None:' % name)
+        gen.indent()
+        gen.line('%s = %s.start + %s.size' % (i, name, name))
+        gen.emit(self.belowParser, below, i, end)
+        gen.line('if %s:' % below)
+        gen.line('    %s = %s.start + %s.size' % (i, below, below))
+        gen.emit(self.aboveParser, above, i, end)
+        gen.line('if %s:' % above)
+        gen.line('    %s = %s.start + %s.size' % (i, above, above))
+        gen.line('%s = Match(%s, %s, %s - %s, None, [%s, %s, %s])' % 
+                 (out, gen.const(self), pos, i, pos, name, below, above))
+        gen.dedent()
+    
+    def _build(self, m, s):
+        """Create the doc item from the matches of the name and the limits."""
+        name, below, above = m.children
+        if below:
+            below = below[1][0].docItem
+        if above:
+            above = above[1][0].docItem
+        return MathSumLike(self.names[name[1].getMatch(s)],below,above)
     
 #---------------------------------------------------------------------------------
 class MathSubSuperscriptParser(LatexParser):
     def __init__(self, inner_parser):
+        """Constructor.
+        
+        Args:
+            inner_parser (Parser): parser of the subscript and the superscript. Can be 
+                the grammar containing this parser.
+        """
         LatexParser.__init__(self, mode='math-var')
         self.inner_parser = inner_parser
+        self.subscriptParser = SeqParser()
+        self.subscriptParser.addParser( CharParser('_') )
+        self.subscriptParser.addParser( BracketsParser('{','}',inner_parser) )
+        self.superscriptParser = SeqParser()
+        self.superscriptParser.addParser( CharParser('^') )
+        self.superscriptParser.addParser( BracketsParser('{','}',inner_parser) )
 
     def clone(self):
         """Implement cloning"""
         return MathSubSuperscriptParser(self.inner_parser)
     
-    def _test(self, s, start, end):
-        self.subscript = self.inner_parser()
-        self.superscript = self.inner_parser()
-        
+    def _parse(self, s, start, end):
+        return runSteps(self._parseSteps(s, start, end), s)
+    
+    def _parseSteps(self, s, start, end):
         start1 = start
-        parser = SeqParser()
-        parser.addParser( CharParser('_') )
-        parser.addParser( BracketsParser('{','}',self.subscript) )
-        parser.match(s, start1, end)
-        if parser.hasMatch():
-            start1 = parser.getEnd()
-        parser = SeqParser()
-        parser.addParser( CharParser('^') )
-        parser.addParser( BracketsParser('{','}',self.superscript) )
-        parser.match(s, start1, end)
-        
-        if self.subscript.hasMatch():
-            self.subscript = self.subscript.docItem
+        m = yield (self.subscriptParser, start1, end)
+        if m:
+            start1 = m.getEnd()
+            subscript = m[1][0]
         else:
-            self.subscript = None
-            
-        if self.superscript.hasMatch():
-            self.superscript = self.superscript.docItem
+            subscript = None
+        m = yield (self.superscriptParser, start1, end)
+        if m:
+            start1 = m.getEnd()
+            superscript = m[1][0]
+            if subscript is None:
+                # the subscript can follow the superscript: x^{2}_{i}
+                m = yield (self.subscriptParser, start1, end)
+                if m:
+                    start1 = m.getEnd()
+                    subscript = m[1][0]
         else:
-            self.superscript = None
+            superscript = None
             
-        if not self.subscript and not self.superscript:
+        if not subscript and not superscript:
             raise Exception("Error in subscript or superscript.")
-        return (True, parser.getEnd() - start)
+        # the base is set in lookAtParent()
+        yield (Match(self, start, start1 - start, None, [subscript, superscript, None]),)
     
-    def lookAtParent(self, parser, s):
-        baseToken = parser.lastToken()
-        if baseToken:
-            base = baseToken.docItem
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        i = gen.tmp()
+        m = gen.tmp()
+        subscript = gen.tmp()
+        superscript = gen.tmp()
+        gen.line('%s = %s' % (i, pos))
+        gen.line('%s = None' % subscript)
+        gen.line('%s = None' % superscript)
+        gen.emit(self.subscriptParser, m, i, end, True)
+        gen.line('if %s:' % m)
+        gen.line('    %s = %s.start + %s.size' % (i, m, m))
+        gen.line('    %s = %s.children[1].children[0]' % (subscript, m))
+        gen.emit(self.superscriptParser, m, i, end)
+        gen.line('if %s:' % m)
+        gen.indent()
+        gen.line('%s = %s.start + %s.size' % (i, m, m))
+        gen.line('%s = %s.children[1].children[0]' % (superscript, m))
+        gen.line('if %s is None:' % subscript)
+        gen.indent()
+        gen.emit(self.subscriptParser, m, i, end)
+        gen.line('if %s:' % m)
+        gen.line('    %s = %s.start + %s.size' % (i, m, m))
+        gen.line('    %s = %s.children[1].children[0]' % (subscript, m))
+        gen.dedent()
+        gen.dedent()
+        gen.line('if not %s and not %s:' % (subscript, superscript))
+        gen.line('    raise Exception("Error in subscript or superscript.")')
+        gen.line('%s = Match(%s, %s, %s - %s, None, [%s, %s, None])' % 
+                 (out, gen.const(self), pos, i, pos, subscript, superscript))
+    
+    def lookAtParent(self, m, last, s):
+        """The preceding item becomes the base."""
+        m.children[2] = last
+    
+    def _build(self, m, s):
+        """Create the doc item taking the doc item of the base."""
+        subscript, superscript, last = m.children
+        if subscript:
+            subscript = subscript.docItem
+        if superscript:
+            superscript = superscript.docItem
+        if last:
+            base = last.docItem
+            last.docItem = None
         else:
             base = MathVariable('')
-        self.docItem = MathSubSuperscript(base,self.subscript,self.superscript)
-        if baseToken:
-            baseToken.docItem = None
+        return MathSubSuperscript(base,subscript,superscript)
         
     
 #---------------------------------------------------------------------------------
 class InlineMathItemParser(LatexParser):
     """Parser for an item in a paragraph: a word or a command."""
     def __init__(self, recursion_parser):
-        """Constructor."""
+        """Constructor.
+        
+        Args:
+            recursion_parser (Parser): parser of the arguments of fractions, sums and 
+                scripts, usually the InlineMathParser containing this parser.
+        """
         LatexParser.__init__(self)
         self.recursion_parser = recursion_parser
         self.parser = AltParser()
@@ -324,28 +736,22 @@ class InlineMathItemParser(LatexParser):
         self.parser.addParser( MathFracParser(self.recursion_parser) )
         self.parser.addParser( MathSumParser(self.recursion_parser) )
         self.parser.addParser( MathSubSuperscriptParser(self.recursion_parser) )
-        self.good = None
         
     def clone(self):
         """Implement cloning"""
         return InlineMathItemParser(self.recursion_parser)
 
-    def _test(self, s, start, end):
-        """Implements the match test."""
-        self.parser.match(s, start, end)
-        if not self.parser.hasMatch():
-            return (False, 0)
-        self.good = self.parser.goodParser()
-        if isinstance( self.good, LatexParser ):
-            self.docItem = self.good.docItem
-        else:
-            return (False, 0)
-        return (True, self.parser.getEnd() - start)
+    def _accept(self, m, s):
+        """Accept only the matches of the latex parsers."""
+        return isinstance( m.parser, LatexParser )
+    
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
+        return m.docItem
     
-    def lookAtParent(self, parser, s):
-        if not self.docItem and self.good:
-            self.good.lookAtParent(parser,s)
-            self.docItem = self.good.docItem
+    def lookAtParent(self, m, last, s):
+        good = m[0]
+        good.parser.lookAtParent(good, last, s)
     
 #---------------------------------------------------------------------------------
 class InlineMathParser(LatexParser):
@@ -355,27 +761,24 @@ class InlineMathParser(LatexParser):
         LatexParser.__init__(self)
         self.parser = SeqParser()
         self.parser.addParser( ZeroOrMoreSpaces() )
-        self.itemParser = ListParser( (InlineMathItemParser(InlineMathParser), ZeroOrMoreSpaces()) )
+        # the arguments of the fractions etc are parsed by this grammar itself
+        self.itemParser = OpListParser( InlineMathItemParser(self) )
         self.parser.addParser( self.itemParser )
         
     def clone(self):
         """Implement cloning"""
         return InlineMathParser()
-    
-    def _test(self, s, start, end):
-        """Implements the match test."""
-        self.parser.match(s, start, end)
-        if not self.parser.hasMatch():
-            return (False, 0)
 
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (InlineMathParser,)
+    
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
         doc = InlineMathBlock()
-        n = len(self.itemParser)
-        for i in range(0,n,2):
-            p = self.itemParser[i]
-            if p.docItem:
-                doc.appendItem(p.docItem)
-        self.docItem = doc
-        return (True, self.parser.getEnd() - start)
+        for item in m[1].docItem:
+            doc.appendItem(item)
+        return doc
     
 #---------------------------------------------------------------------------------
 class ItemInBracketsParser(LatexParser):
@@ -389,13 +792,9 @@ class ItemInBracketsParser(LatexParser):
         """Implement cloning"""
         return ItemInBracketsParser()
     
-    def _test(self, s, start, end):
-        """Implements the match test."""
-        self.parser.match(s, start, end)
-        if not self.parser.hasMatch():
-            return (False, 0)
-        self.docItem = self.parser[0].docItem
-        return (True, self.parser.getEnd() - start)
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
+        return m[0].docItem
     
 #---------------------------------------------------------------------------------
 class ParagraphItemParser(LatexParser):
@@ -404,8 +803,9 @@ class ParagraphItemParser(LatexParser):
         """Constructor."""
         LatexParser.__init__(self, mode)
         self.parser = AltParser()
-        self.parser.addParser( CommandParser(ParagraphItemCreator, mode) )
-        self.parser.addParser( ItemInBracketsParser('$','$',InlineMathParser()) )
+        self.parser.addParser( CommandParser(ParagraphItemCreator, mode, para_command_names_0) )
+        # math can be nested deeper than the recursion limit allows
+        self.parser.addParser( ItemInBracketsParser('$','$',StackParser(InlineMathParser())) )
         self.parser.addParser( WordParser(mode) )
         
     def clone(self):
@@ -413,18 +813,18 @@ class ParagraphItemParser(LatexParser):
         p = ParagraphItemParser(self.mode)
         return p
 
-    def _test(self, s, start, end):
-        """Implements the match test."""
-        self.parser.match(s, start, end)
-        if not self.parser.hasMatch():
-            return (False, 0)
-        good = self.parser.goodParser()
-        if isinstance( good, LatexParser ):
-            self.docItem = good.docItem
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (ParagraphItemParser, self.mode)
+
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
+        if isinstance( m.parser, LatexParser ):
+            docItem = m.docItem
         else:
             # maybe it's an error?
-            self.docItem = Word(self.parser.getMatch(s))
-        return (True, self.parser.getEnd() - start)
+            docItem = Word(words.text(m, s))
+        return docItem
     
 #---------------------------------------------------------------------------------
 class ParagraphSpaces(Parser):
@@ -436,6 +836,7 @@ class ParagraphSpaces(Parser):
         """Constructor."""
         Parser.__init__(self)
         self._chars = ' \t'
+        self._pattern = charClass(' \t\n')
         
     def clone(self):
         """Implements cloning."""
@@ -443,14 +844,10 @@ class ParagraphSpaces(Parser):
 
     def _test(self, s, start, end):
         """Implements the match test."""
-        for i in range(start,end):
-            c = s[i]
-            if c not in self._chars:
-                if c != '\n':
-                    return (True, i - start)
-                elif i+1 < end and s[i+1] == '\n' :
-                    return (False, 0)
-        return (True, end - start)
+        i = self._pattern.match(s, start, end).end()
+        if s.find('\n\n', start, i) >= 0:
+            return (False, 0)
+        return (True, i - start)
 
 #---------------------------------------------------------------------------------
 class ParagraphParser(LatexParser):
@@ -467,19 +864,19 @@ class ParagraphParser(LatexParser):
         p = ParagraphParser(self.mode)
         return p
 
-    def _test(self, s, start, end):
-        """Implements the match test."""
-        self.parser.match(s, start, end)
-        if not self.parser.hasMatch():
-            return (False, 0)
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (ParagraphParser, self.mode, self.paragraph)
+
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
         
         para = self.paragraph()
-        for i in range(0,len(self.parser),2):
-            p = self.parser[i]
+        for i in range(0,len(m),2):
+            p = m[i]
             para.appendItem(p.docItem)
-        self.docItem = para
             
-        return (True, self.parser.getEnd() - start)
+        return para
 
 #def DocumentItemCreator(cmd_name, arg1 = None):
 #    if arg1:
@@ -508,22 +905,23 @@ class TitleParser(LatexParser):
         """Implement cloning"""
         return TitleParser()
 
-    def _test(self, s, start, end):
-        """Implements the match test."""
-        self.parser.match(s, start, end)
-        if not self.parser.hasMatch():
-            return (False, 0)
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (TitleParser,)
+
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
     
-        if not isinstance(self.textParser.docItem, Title):
+        # the match of self.textParser
+        docItem = m[3][0][1].docItem
+        if not isinstance(docItem, Title):
             raise Exception("Wrong doc item in title")
         
-        self.docItem = self.textParser.docItem
-        
-        for item in self.docItem.items:
+        for item in docItem.items:
             if not item:
                 del item
         
-        return (True, self.parser.getEnd() - start)
+        return docItem
         
 #---------------------------------------------------------------------------------
 class DocumentItemParser(LatexParser):
@@ -539,21 +937,24 @@ class DocumentItemParser(LatexParser):
         """Implement cloning"""
         return DocumentItemParser(self.mode)
 
-    def _test(self, s, start, end):
-        """Implements the match test."""
-        self.parser.match(s, start, end)
-        if not self.parser.hasMatch():
-            return (False, 0)
-        good = self.parser.goodParser()
-        if isinstance( good, LatexParser ):
-            self.docItem = good.docItem
-        else:
-            return (False, 0)
-        return (True, self.parser.getEnd() - start)
+    def _memoKey(self):
+        """Implements memoization key."""
+        return (DocumentItemParser, self.mode)
+
+    def _accept(self, m, s):
+        """Accept only the matches of the latex parsers."""
+        return isinstance( m.parser, LatexParser )
+    
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
+        return m.docItem
     
 #---------------------------------------------------------------------------------
 class DocumentParser(LatexParser):
     """Parse the whole document"""
+    # maximum number of chunks joined when a chunk cannot be parsed separately
+    maxJoinedChunks = 4
+    
     def __init__(self):
         """Constructor."""
         LatexParser.__init__(self)
@@ -566,19 +967,514 @@ class DocumentParser(LatexParser):
         """Implement cloning"""
         return DocumentParser()
 
-    def _test(self, s, start, end):
-        """Implements the match test."""
-        self.parser.match(s, start, end)
-        if not self.parser.hasMatch():
-            return (False, 0)
-        
+    def _action(self, m, s):
+        """Create the doc item from the match of self.parser."""
         doc = Document()
-        n = len(self.itemParser)
+        items = m[1]
+        n = len(items)
         for i in range(0,n,2):
-            p = self.itemParser[i]
+            p = items[i]
             if p.docItem:
                 doc.appendParagraph(p.docItem)
-        self.docItem = doc
             
-        return (True, self.parser.getEnd() - start)
+        return doc
+        
+    def profile(self, s):
+        """Parse a document collecting the statistics of the parsers.
+        
+        Args:
+            s (str): the document source.
+            
+        Return:
+            The Profiler with the statistics. Print profiler.formatReport() to see them.
+        """
+        profiler.reset()
+        profiler.enable()
+        try:
+            self.match(s)
+        finally:
+            profiler.disable()
+        return profiler
+        
+    def parseStream(self, source, doc = None):
+        """Parse a document read from a file object or an iterator over strings.
+        
+        The source is split into chunks at empty lines which are outside any {...} or $...$ 
+        and each chunk is parsed separately, so only one chunk is kept in memory at a time. 
+        A chunk that cannot be parsed completely is joined with the next ones (see _parseChunks()).
+        If it still cannot be parsed, the items of its parsed beginning are followed by an 
+        ErrorParagraph holding the rest of its source, so no text is dropped silently.
+        
+        Args:
+            source (iterable): a file object, a string or any iterable of strings.
+            doc (Document): a document to set as the parent of the yielded items. If None 
+                a new document is created. The items aren't appended to the document.
+            
+        Return:
+            A generator yielding the document items (paragraphs and titles).
+        """
+        if doc is None:
+            doc = Document()
+        for text, items, complete in self._parseChunks(splitChunks(source)):
+            for item in items:
+                item.setDocument(doc)
+                yield item
+            
+    def _parseChunks(self, chunks, reuse = None, results = None):
+        """Parse chunks of a document joining the chunks that cannot be parsed separately.
+        
+        A chunk that cannot be parsed completely is joined with the next ones, at most 
+        maxJoinedChunks chunks are joined. If they still cannot be parsed the first chunk is 
+        yielded as an incomplete text with its parsed beginning and the rest is tried again, so 
+        a bad paragraph costs a bounded number of parses and doesn't hold up the following ones.
+        The items of an incomplete text end with an ErrorParagraph (see _parseIncomplete()).
+        
+        Args:
+            chunks (iterable): the chunks.
+            reuse (dict): chunk text -> document items of chunks parsed before.
+            results (iterable): the document items of the single chunks parsed elsewhere in the
+                order of chunks: a list or None if the chunk cannot be parsed completely. 
+                If None all the chunks are parsed here.
+            
+        Return:
+            A generator yielding tuples (text, items, complete) where text is the source of 
+            the items (one or more chunks) and complete is False if the text wasn't matched 
+            to the end.
+        """
+        if reuse is None:
+            reuse = {}
+        if results is None:
+            results = itertools.repeat(_notParsed)
+        # list of (chunk, items of the chunk parsed elsewhere)
+        pending = []
+        for chunk, result in itertools.izip(chunks, results):
+            pending.append((chunk, result))
+            for unit in self._parsePending(pending, reuse, False):
+                yield unit
+        for unit in self._parsePending(pending, reuse, True):
+            yield unit
+            
+    def _parsePending(self, pending, reuse, final):
+        """Parse the chunks waiting in _parseChunks(), remove the parsed ones from the list.
+        
+        Args:
+            pending (list): the (chunk, result) tuples of _parseChunks().
+            reuse (dict): see _parseChunks().
+            final (bool): True if no more chunks follow.
+            
+        Return:
+            A generator yielding tuples (text, items, complete) as _parseChunks().
+        """
+        while pending:
+            if len(pending) == 1 and pending[0][1] is not _notParsed:
+                text, items = pending[0]
+            else:
+                text = ''.join([chunk for chunk, result in pending])
+                items = reuse.get(text)
+                if items is None:
+                    items = self._parseChunk(text, True)
+            if items is not None:
+                del pending[:]
+                yield text, items, True
+                return
+            if not final and len(pending) < self.maxJoinedChunks:
+                # wait for the next chunk
+                return
+            chunk = pending.pop(0)[0]
+            yield chunk, self._parseIncomplete(chunk), False
+            
+    def parseParallel(self, source, processes = None, chunksize = 8):
+        """Parse a document using a pool of processes.
+        
+        The source is split into chunks as in parseStream() and the chunks are parsed 
+        in the worker processes. The document items are sent back pickled.
+        
+        Args:
+            source (iterable): a file object, a string or any iterable of strings.
+            processes (int): number of the worker processes, if None use the number of cpus.
+            chunksize (int): number of chunks sent to a worker at a time.
+            
+        Return:
+            The Document.
+        """
+        doc = Document()
+        chunks = list(splitChunks(source))
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.imap(_parseChunkInProcess, chunks, chunksize)
+            # the chunks that failed are joined with the next ones and parsed here
+            for text, items, complete in self._parseChunks(chunks, None, results):
+                for item in items:
+                    doc.appendParagraph(item)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return doc
+            
+    def _parseChunk(self, s, complete):
+        """Parse a chunk of a document for parseStream().
+        
+        Args:
+            s (str): the chunk.
+            complete (bool): if True the chunk must be matched to the end.
+            
+        Return:
+            A list of the document items or None if the chunk cannot be parsed.
+        """
+        if not s.strip():
+            return []
+        self.match(s)
+        if not self.hasMatch() or (complete and self.getEnd() != len(s)):
+            return None
+        return self.docItem.paragraphs
+    
+    def _parseIncomplete(self, s):
+        """Parse a chunk of a document which cannot be matched to the end.
+        
+        Args:
+            s (str): the chunk.
+            
+        Return:
+            A list of the document items of the parsed beginning of the chunk followed 
+            by an ErrorParagraph with the rest of the chunk.
+        """
+        items = self._parseChunk(s, False)
+        if items is None:
+            return [ErrorParagraph(s)]
+        return items + [ErrorParagraph(s[self.getEnd():])]
+    
+#---------------------------------------------------------------------------------
+class IncrementalParser:
+    """Parses a document and updates it after edits of the source.
+    
+    The document is kept as a list of units: parts of the source separated by empty lines
+    (see splitChunks()) together with their document items. An edit re-parses the units 
+    it overlaps and stops as soon as a new unit ends where an old one started, so its 
+    cost depends on the size of the edited part and not on the size of the document. 
+    The source offsets and the paragraph indexes of the units are updated lazily: an edit
+    invalidates them after the edited units and they are recomputed when needed.
+    """
+    def __init__(self):
+        """Constructor."""
+        self.parser = DocumentParser()
+        self.doc = Document()
+        # list of (text, items, complete) tuples, see DocumentParser._parseChunks()
+        self.units = []
+        # source offsets and paragraph indexes of the units, valid below self._valid
+        self._starts = []
+        self._indexes = []
+        self._valid = 0
+        
+    def parse(self, s):
+        """Parse a new source.
+        
+        Args:
+            s (str): the source.
+            
+        Return:
+            The Document.
+        """
+        self.doc = Document()
+        self.units = list(self.parser._parseChunks(splitChunks(s)))
+        n = len(self.units)
+        self._starts = [0] * n
+        self._indexes = [0] * n
+        self._valid = 0
+        for text, items, complete in self.units:
+            for item in items:
+                self.doc.appendParagraph(item)
+        return self.doc
+        
+    def getSource(self):
+        """Return the current source."""
+        return ''.join([unit[0] for unit in self.units])
+        
+    def edit(self, start, end, text):
+        """Replace a part of the source and update the document.
+        
+        The paragraphs list of the document is updated in place.
+        
+        Args:
+            start (int): start of the replaced part of the source.
+            end (int): end of the replaced part of the source.
+            text (str): the new text.
+            
+        Return:
+            The Document.
+        """
+        units = self.units
+        n = len(units)
+        delta = len(text) - (end - start)
+        
+        # re-parse from the first unit touching the edit, after a unit which was 
+        # parsed completely: the parsing of the next units doesn't depend on the ones before
+        first = self._locate(start)
+        while first > 0 and not units[first - 1][2]:
+            first -= 1
+        begin = self._starts[first] if n else 0
+        index = self._indexes[first] if n else 0
+        
+        # the old units are walked along with the new ones
+        old = _OldUnits(units, first, begin, end, delta)
+        chunks = self._editedChunks(self._editedSource(first, begin, start, end, text), begin, old)
+        newUnits = []
+        newStarts = []
+        newIndexes = []
+        pos = begin
+        last = n
+        size = index
+        for unit in self.parser._parseChunks(chunks, old.reuse):
+            newUnits.append(unit)
+            newStarts.append(pos)
+            newIndexes.append(size)
+            pos += len(unit[0])
+            size += len(unit[1])
+            # the boundaries are in sync again: the rest of the old units are kept
+            if unit[2] and old.advance(pos):
+                last = old.index
+                break
+            
+        # splice the units and the paragraphs
+        removed = sum([len(u[1]) for u in units[first:last]])
+        items = []
+        for u in newUnits:
+            for item in u[1]:
+                item.setDocument(self.doc)
+                items.append(item)
+        self.doc.paragraphs[index:index + removed] = items
+        units[first:last] = newUnits
+        self._starts[first:last] = newStarts
+        self._indexes[first:last] = newIndexes
+        self._valid = first + len(newUnits)
+        return self.doc
+    
+    def _locate(self, pos):
+        """Find the first unit ending at or after a position in the source.
+        
+        The offsets of the units are computed up to the found unit if they aren't valid.
+        
+        Args:
+            pos (int): the position.
+            
+        Return:
+            The index of the unit, the last unit if the source is shorter than pos, 
+            0 if there are no units.
+        """
+        units = self.units
+        starts = self._starts
+        indexes = self._indexes
+        n = len(units)
+        k = self._valid
+        if k == 0 and n:
+            starts[0] = 0
+            indexes[0] = 0
+            k = 1
+        while k < n and starts[k - 1] + len(units[k - 1][0]) < pos:
+            text, items, complete = units[k - 1]
+            starts[k] = starts[k - 1] + len(text)
+            indexes[k] = indexes[k - 1] + len(items)
+            k += 1
+        self._valid = k
+        # the unit before the first one starting at or after pos
+        return max(bisect.bisect_left(starts, pos, 1, k) - 1, 0)
+        
+    def _editedSource(self, first, begin, start, end, text):
+        """Generate the source after an edit from the start of a unit.
+        
+        Args:
+            first (int): index of the unit.
+            begin (int): start of the unit.
+            start, end, text: the edit as in edit().
+            
+        Return:
+            A generator yielding the parts of the source.
+        """
+        pos = begin
+        inserted = False
+        for i in xrange(first, len(self.units)):
+            unitText = self.units[i][0]
+            unitEnd = pos + len(unitText)
+            if pos < start:
+                yield unitText[:min(unitEnd, start) - pos]
+            if not inserted and unitEnd >= start:
+                yield text
+                inserted = True
+            if unitEnd > end:
+                yield unitText[max(pos, end) - pos:]
+            pos = unitEnd
+        if not inserted:
+            yield text
+            
+    def _editedChunks(self, source, begin, old):
+        """Split the source after an edit into chunks making the old units they cover reusable.
+        
+        Args:
+            source (iterable): the source from the start of the first re-parsed unit.
+            begin (int): start of the first re-parsed unit.
+            old (_OldUnits): the old units.
+            
+        Return:
+            A generator yielding the chunks.
+        """
+        pos = begin
+        # a chunk ends with a line end unless it is at the start of the source
+        for chunk in splitChunks(source, '\n' if begin else ''):
+            pos += len(chunk)
+            old.advance(pos)
+            yield chunk
+
+class _OldUnits:
+    """Walks the units of IncrementalParser from before an edit along with the new units."""
+    def __init__(self, units, index, pos, end, delta):
+        """Constructor.
+        
+        Args:
+            units (list): the units.
+            index (int): index of the first re-parsed unit.
+            pos (int): start of the first re-parsed unit.
+            end (int): end of the edited part of the old source.
+            delta (int): change of the source length.
+        """
+        self.units = units
+        self.first = index
+        self.end = end
+        self.delta = delta
+        # the next old unit and its start in the old source
+        self.index = index
+        self.pos = pos
+        # text -> items of the passed complete units, see DocumentParser._parseChunks()
+        self.reuse = {}
+        
+    def advance(self, pos):
+        """Move to the first old unit starting at or after a position of the new source.
+        
+        Args:
+            pos (int): the position.
+            
+        Return:
+            True if an old unit after the edit starts at pos and the parsing of the 
+            following units can be resumed at it (the unit before it is complete).
+        """
+        units = self.units
+        n = len(units)
+        while self.index < n and self._newPos() < pos:
+            text, items, complete = units[self.index]
+            if complete:
+                self.reuse[text] = items
+            self.pos += len(text)
+            self.index += 1
+        if self.pos < self.end or self._newPos() != pos:
+            return False
+        i = self.index
+        return i == self.first or i == n or units[i - 1][2]
+        
+    def _newPos(self):
+        """Return the start of the next old unit in the new source."""
+        if self.pos >= self.end:
+            return self.pos + self.delta
+        return self.pos
+
+# marks a chunk in DocumentParser._parseChunks() which hasn't been parsed elsewhere
+_notParsed = object()
+
+# the parser used by the worker processes of DocumentParser.parseParallel()
+_processParser = None
+
+def _parseChunkInProcess(s):
+    """Parse a chunk of a document in a worker process.
+    
+    Return:
+        A list of the document items or None if the chunk cannot be parsed completely.
+    """
+    global _processParser
+    if _processParser is None:
+        _processParser = DocumentParser()
+    items = _processParser._parseChunk(s, True)
+    # don't send the temporary document back
+    for item in items or []:
+        item.doc = None
+    return items
+    
+# the maximum size of a chunk of splitChunks() which doesn't end at an empty line
+# because a {...} or $...$ seems to go on
+maxChunkSize = 4096
+
+# escaped characters, comments and the signs counted by splitChunks()
+_chunkSignPattern = re.compile(r'\\.|%.*|[{}$]')
+
+def splitChunks(source, last = ''):
+    """Split a document into chunks that can be parsed separately.
+    
+    The chunks end at empty lines which are outside any {...} or $...$. Escaped 
+    characters (\\{, \\$, ...) and comments (% to the end of the line) aren't counted. 
+    A chunk longer than maxChunkSize ends at the next empty line anyway and the counting 
+    starts again, so a stray bracket or dollar cannot make the rest of the source one chunk. 
+    A {...} or $...$ split this way is joined again by DocumentParser._parseChunks().
+    
+    Args:
+        source (iterable): a file object, a string or any iterable of strings.
+        last (str): the end of the line preceding the source if it starts after a chunk.
+        
+    Return:
+        A generator yielding the chunks.
+    """
+    chunk = []
+    size = 0
+    depth = 0
+    dollars = 0
+    for line in splitLines(source):
+        chunk.append(line)
+        size += len(line)
+        if line == '\n' and last.endswith('\n') and (
+                (depth == 0 and dollars % 2 == 0) or size > maxChunkSize):
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+            depth = 0
+            dollars = 0
+        else:
+            for m in _chunkSignPattern.finditer(line):
+                c = m.group()
+                if c == '{':
+                    depth += 1
+                elif c == '}':
+                    # a stray closing bracket doesn't close anything
+                    depth = max(depth - 1, 0)
+                elif c == '$':
+                    dollars += 1
+        last = line
+    if chunk:
+        yield ''.join(chunk)
+    
+def splitLines(source):
+    """Split strings from an iterable into lines.
+    
+    Args:
+        source (iterable): a file object, a string or any iterable of strings.
+        
+    Return:
+        A generator yielding the lines with the line ends. The parts of a line split in 
+        the source are joined, so a comment or an escape cannot be cut.
+    """
+    if isinstance(source, basestring):
+        source = [source]
+    # the beginning of the current line
+    parts = []
+    for text in source:
+        start = 0
+        n = len(text)
+        while start < n:
+            i = text.find('\n', start)
+            if i < 0:
+                parts.append(text[start:])
+                break
+            parts.append(text[start:i + 1])
+            yield ''.join(parts)
+            parts = []
+            start = i + 1
+    if parts:
+        yield ''.join(parts)
         
\ No newline at end of file
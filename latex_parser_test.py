@@ -1,11 +1,19 @@
 # -*- coding: UTF-8 -*-
+import sys
 import unittest
+from random import Random
 import latex_parser as lp
+import string_parser as sp
 from fpdf import FPDF
 from document import initPDF, setFontPDF
 
 long_string = 'The year 1866 was marked by a bizarre development, an unexplained and downright  inexplicable phenomenon that surely no one has forgotten. Without getting into those rumors that upset civilians in the seaports and deranged the public'
 
+def dumpItem(item):
+    """Convert a doc item tree into nested tuples for comparisons."""
+    children = getattr(item, 'paragraphs', None) or getattr(item, 'items', [])
+    return (item.__class__.__name__, getattr(item, 'text', None), [dumpItem(i) for i in children])
+
 class TestLatexParsers(unittest.TestCase):
     
     def test_CommandParser(self):
@@ -20,6 +28,14 @@ class TestLatexParsers(unittest.TestCase):
         s = '\\ALPHA \\beta'
         p.match( s )
         self.assertFalse( p.hasMatch() )
+        
+        p = lp.CommandParser(lp.ParagraphItemCreator, names = lp.para_command_names_0)
+        self.assertEqual( p.parse('\\ALPHA'), None )
+        m = p.parse('\\beta')
+        # the doc item is created by build()
+        self.assertEqual( m.docItem, None )
+        sp.build(m, '\\beta')
+        self.assertEqual( m.docItem.writePDF(), lp.Symbol('beta').writePDF() )
 
     def test_greek_letters(self):
         pdf=FPDF()
@@ -56,6 +72,65 @@ class TestLatexParsers(unittest.TestCase):
         
         pdf.output('out/latex/test_greek_letters.pdf', 'F')
         
+    def test_tokenize(self):
+        
+        s = r'a \alpha+12.5x_{i}\\ $'
+        sp.indexes.enter()
+        try:
+            tokens = lp.tokenize(s)
+            self.assertTrue( lp.tokenize(s) is tokens )
+        finally:
+            sp.indexes.leave()
+        # the tokens aren't kept after the top-level match
+        self.assertEqual( len(sp.indexes), 0 )
+        p = lp.DocumentParser()
+        p.match(long_string + s)
+        self.assertEqual( len(sp.indexes), 0 )
+        # parse() tokenizes the string once too
+        stored = []
+        store = sp.indexes.store
+        def countingStore(s, key, index):
+            stored.append(key)
+            store(s, key, index)
+        sp.indexes.store = countingStore
+        try:
+            m = p.parse(long_string + s)
+        finally:
+            del sp.indexes.store
+        self.assertTrue( m is not None )
+        self.assertEqual( stored.count(('tokens',)), 1 )
+        self.assertEqual( len(sp.indexes), 0 )
+        kinds = [(s[i:tokens[i][1]], tokens[i][0]) for i in sorted(tokens)]
+        self.assertEqual( kinds, [('a', 'alpha'), (' ', 'space'), ('\\alpha', 'command'), 
+                                  ('+', 'sign'), ('12.5', 'number'), ('x', 'alpha'), ('_', 'char'), 
+                                  ('{', 'char'), ('i', 'alpha'), ('}', 'char'), ('\\', 'char'),
+                                  ('\\', 'char'), (' ', 'space'), ('$', 'char')] )
+        # the word ends
+        self.assertEqual( tokens[0][2], 1 )
+        self.assertEqual( tokens[8][2], 18 )
+        self.assertEqual( tokens[15][2], 18 )
+        # tokens not matching the character parsers
+        self.assertEqual( lp.tokenize('1..2')[0][0], None )
+        self.assertEqual( lp.tokenize(u'x\xe9')[0][0], 'alpha' )
+        self.assertEqual( lp.tokenize(u'x\xb2')[0][0], None )
+        
+    def test_TokenParser(self):
+        
+        number = lp.MathNumberParser().parser.parser
+        for s in ['12.5', '1..2', '1.2.3', u'1\xb2', 'x12']:
+            p = lp.TokenParser('number', number)
+            for i in range(len(s)):
+                for j in range(i + 1, len(s) + 1):
+                    m = p.parse(s, i, j)
+                    n = number.parse(s, i, j)
+                    self.assertEqual( m and m.getMatch(s), n and n.getMatch(s) )
+        p = lp.TokenParser('word', sp.AllNotCharParser(' \t\n\\'))
+        s = r'ab{cd}\e f'
+        self.assertEqual( p.parse(s).getMatch(s), 'ab{cd}' )
+        self.assertEqual( p.parse(s, 0, 4).getMatch(s), 'ab{c' )
+        self.assertEqual( p.parse(s, 1).getMatch(s), 'b{cd}' )
+        self.assertEqual( p.parse(s, 6), None )
+        
     def test_WordParser(self):
         
         p = lp.WordParser()
@@ -72,6 +147,24 @@ class TestLatexParsers(unittest.TestCase):
         self.assertEquals( p.getMatch(s), 'beta')
         self.assertEquals( p.docItem.writePDF(), 'beta')
         
+    def test_ParagraphSpaces(self):
+        
+        p = lp.ParagraphSpaces()
+        s = 'a \t\n b'
+        p.match(s, 1)
+        self.assertTrue( p.hasMatch() )
+        self.assertEquals( p.getMatch(s), ' \t\n ')
+        
+        p = lp.ParagraphSpaces()
+        s = 'a \n\n b'
+        p.match(s, 1)
+        self.assertFalse( p.hasMatch() )
+        
+        p = lp.ParagraphSpaces()
+        p.match(s, 1, 3)
+        self.assertTrue( p.hasMatch() )
+        self.assertEquals( p.getMatch(s), ' \n')
+        
     def test_ParagraphItemParser(self):
         
         p = lp.ParagraphItemParser()
@@ -255,6 +348,285 @@ class TestLatexParsers(unittest.TestCase):
         doc.setPDF(FPDF())
         doc.outputPDF('out/latex/test_DocumentParser.pdf')
         
+    def test_compileParser(self):
+        
+        s = r'  \title { The Title}' + long_string + r' $x_{i}^{2} + \frac{\alpha}{\beta_{k}} \sin\theta$ ' + ' \n\n ' + long_string
+        p = lp.DocumentParser()
+        c = sp.compileParser(lp.DocumentParser())
+        p.match(s)
+        c.match(s)
+        self.assertTrue( c.hasMatch() )
+        self.assertEqual( c.getEnd(), p.getEnd() )
+        self.assertEqual( dumpItem(c.docItem), dumpItem(p.docItem) )
+        
+    def test_compileParser_sources(self):
+        
+        deep = r'\frac{' * 450 + 'x' + '}{1}' * 450
+        sources = [r'The value $ y = \frac{x_{1}^{2} + 1}{\sum_{k=1}^{n} a_{k}^{2} b^{k}} - (1 + z)^2 $ is found.', 
+                   'Deep $%s$ nesting.' % deep,
+                   r'Signs $a \over b + -x! (y)^2 - x^2_{i} z_{j}^{k} \sum_{n} \alpha 1.5$ and US$5',
+                   r'Words \alpha\beta 12.5x_{i}\\ \unknown{a} } unbalanced { $x']
+        for s in sources:
+            p = lp.DocumentParser()
+            c = sp.compileParser(lp.DocumentParser())
+            p.match(s)
+            c.match(s)
+            self.assertEqual( c.hasMatch(), p.hasMatch() )
+            self.assertEqual( c.getEnd(), p.getEnd() )
+            # the dumps of the deep source are compared recursively
+            limit = sys.getrecursionlimit()
+            sys.setrecursionlimit(10000)
+            try:
+                self.assertEqual( dumpItem(c.docItem), dumpItem(p.docItem) )
+            finally:
+                sys.setrecursionlimit(limit)
+        # with a low recursion limit the compiled code of the maths cannot go as deep as 
+        # the source is nested: the explicit stack is used
+        s = sources[1]
+        m = lp.DocumentParser().parse(s)
+        stackParse = sp.StackParser._parse
+        calls = []
+        def countingParse(self, s, start, end):
+            calls.append(start)
+            return stackParse(self, s, start, end)
+        c = sp.compileParser(lp.DocumentParser())
+        sp.StackParser._parse = countingParse
+        sys.setrecursionlimit(300)
+        try:
+            cm = c.parse(s)
+        finally:
+            sp.StackParser._parse = stackParse
+            sys.setrecursionlimit(limit)
+        self.assertTrue( calls )
+        self.assertEqual( cm.getEnd(), m.getEnd() )
+        # the errors are raised as by the interpreted parsers
+        for s in [r'$\frac{a}$', r'$x_$']:
+            self.assertRaises( Exception, lp.DocumentParser().match, s )
+            self.assertRaises( Exception, sp.compileParser(lp.DocumentParser()).match, s )
+        
+    def test_nested_maths(self):
+        
+        s = 'x'
+        for i in range(300):
+            s = r'\frac{%s}{y_{%d}}' % (s, i)
+        p = lp.ParagraphParser()
+        p.match('Deep $%s$ maths' % s)
+        self.assertTrue( p.hasMatch() )
+        item = p.docItem.items[1].items[0]
+        depth = 0
+        while isinstance(item, lp.MathFrac):
+            item = item.items[0].items[0]
+            depth += 1
+        self.assertEqual( depth, 300 )
+        self.assertEqual( item.text, 'x' )
+        
+    def test_profile(self):
+        
+        s = r'Hello, $ x+  y- \frac{\beta-1} { 2}\sin \alpha/2 +0.3$ maths!'
+        profiler = lp.DocumentParser().profile(s)
+        self.assertFalse( profiler.enabled )
+        stats = dict([(row.name, row) for row in profiler.report(True)])
+        self.assertEqual( stats['DocumentParser'].calls, 1 )
+        self.assertEqual( stats['DocumentParser'].chars, len(s) )
+        self.assertEqual( stats['MathFracParser'].successes, 1 )
+        # the alternatives which cannot start with the current character aren't tried
+        self.assertEqual( stats['ItemInBracketsParser'].backtracks, 0 )
+        self.assertFalse( 'TitleParser' in stats )
+        self.assertFalse( 'CommandParser' in stats )
+        profiler.reset()
+        
+    def test_WordTable(self):
+        
+        s = r'the $x+x$ and the $x-1$ the'
+        lp.words.enable()
+        try:
+            p = lp.DocumentParser()
+            p.match(s)
+            items = p.docItem.paragraphs[0].items
+            self.assertEqual( items[0].text, 'the' )
+            self.assertTrue( items[0].text is items[3].text )
+            self.assertTrue( items[0].text is items[5].text )
+            self.assertTrue( items[1].items[0].text is items[1].items[2].text )
+            self.assertTrue( items[1].items[0].text is items[4].items[0].text )
+            # the table is dropped with the index cache when the parse ends
+            self.assertEqual( len(sp.indexes), 0 )
+            q = lp.DocumentParser()
+            q.match(s)
+            self.assertEqual( q.docItem.paragraphs[0].items[0].text, 'the' )
+            self.assertFalse( q.docItem.paragraphs[0].items[0].text is items[0].text )
+        finally:
+            lp.words.disable()
+        p.match(s)
+        items = p.docItem.paragraphs[0].items
+        self.assertEqual( items[0].text, items[3].text )
+        self.assertFalse( items[0].text is items[3].text )
+        
+    def test_parseStream(self):
+        
+        s = r'\title{The $x$ Title}' + '\n\n' + long_string + ' $a\n\nb$\n\n\n' + long_string + '\n'
+        p = lp.DocumentParser()
+        p.match(s)
+        paragraphs = p.docItem.paragraphs
+        self.assertEqual( len(paragraphs), 3 )
+        
+        doc = lp.Document()
+        for source in ([s], s.splitlines(True), [s[i:i+5] for i in range(0, len(s), 5)]):
+            items = list( lp.DocumentParser().parseStream(source, doc) )
+            self.assertEqual( len(items), 3 )
+            self.assertTrue( isinstance(items[0], lp.Title) )
+            for item, para in zip(items, paragraphs):
+                self.assertEqual( dumpItem(item), dumpItem(para) )
+                self.assertTrue( item.doc is doc )
+        
+    def test_parseStream_bad_chunk(self):
+        
+        s = long_string + r' \foo bar' + '\n\n' + '\n\n'.join([long_string + ' $x_{%d}$' % i for i in range(20)])
+        p = lp.DocumentParser()
+        calls = []
+        parseChunk = p._parseChunk
+        def countingParseChunk(text, complete):
+            calls.append(text)
+            return parseChunk(text, complete)
+        p._parseChunk = countingParseChunk
+        units = list( p._parseChunks(lp.splitChunks(s)) )
+        # the bad chunk doesn't hold up the following ones
+        self.assertEqual( ''.join([u[0] for u in units]), s )
+        self.assertEqual( [u[2] for u in units], [False] + [True] * (len(units) - 1) )
+        # the unparsed rest of the bad chunk is kept in an error item
+        self.assertEqual( len(units[0][1]), 2 )
+        error = units[0][1][1]
+        self.assertTrue( isinstance(error, lp.ErrorParagraph) )
+        self.assertEqual( error.source, r'\foo bar' + '\n\n' )
+        self.assertEqual( [i.text for i in error.items], [r'\foo', 'bar'] )
+        self.assertEqual( sum([len(u[1]) for u in units]), 22 )
+        self.assertTrue( len(calls) <= 21 + p.maxJoinedChunks )
+        items = list( lp.DocumentParser().parseStream(s) )
+        self.assertEqual( len(items), 22 )
+        self.assertTrue( isinstance(items[1], lp.ErrorParagraph) )
+        doc = lp.DocumentParser().parseParallel(s, 2, 1)
+        self.assertEqual( [dumpItem(i) for i in doc.paragraphs], [dumpItem(i) for i in items] )
+        
+    def test_splitChunks(self):
+        
+        para = long_string + '\n\n'
+        s = 'a {b\n\nc} d\n\n' + para
+        self.assertEqual( list(lp.splitChunks(s)), ['a {b\n\nc} d\n\n', para] )
+        # escaped signs, comments and stray closing brackets aren't counted
+        for text in [r'costs \$5 \{', 'costs 5 % {$', 'a } b']:
+            s = text + '\n\n' + para
+            self.assertEqual( list(lp.splitChunks(s)), [text + '\n\n', para] )
+        # a comment split in the source is still one comment
+        self.assertEqual( list(lp.splitLines(['a %', ' {b\n', '\nc'])), ['a % {b\n', '\n', 'c'] )
+        self.assertEqual( list(lp.splitChunks(['a %', ' {b\n', '\nc'])), ['a % {b\n\n', 'c'] )
+        # a stray bracket or dollar joins a bounded number of paragraphs
+        n = 2000
+        for text in ['a {', 'costs US$5']:
+            s = text + '\n\n' + para * n
+            chunks = list(lp.splitChunks(s))
+            self.assertEqual( ''.join(chunks), s )
+            self.assertTrue( len(chunks) > n - lp.maxChunkSize // len(para) - 2 )
+            self.assertTrue( max([len(c) for c in chunks]) <= lp.maxChunkSize + len(para) )
+            items = list( lp.DocumentParser().parseStream(s) )
+            self.assertEqual( len(items), n + 1 )
+        
+    def test_parseParallel(self):
+        
+        s = r'\title{The $x$ Title}' + '\n\n' + long_string + ' $a\n\nb$\n\n\n' + long_string + '\n\n}' + long_string
+        p = lp.DocumentParser()
+        p.match(s)
+        doc = lp.DocumentParser().parseParallel(s, 2, 1)
+        self.assertEqual( len(doc.paragraphs), 4 )
+        self.assertEqual( dumpItem(doc), dumpItem(p.docItem) )
+        for para in doc.paragraphs:
+            self.assertTrue( para.doc is doc )
+        # a stray bracket still leaves many chunks to parse in parallel
+        s = 'a {\n\n' + '\n\n'.join([long_string] * 100)
+        self.assertTrue( len(list(lp.splitChunks(s))) > 50 )
+        doc = lp.DocumentParser().parseParallel(s, 2)
+        items = list( lp.DocumentParser().parseStream(s) )
+        self.assertEqual( len(doc.paragraphs), 101 )
+        self.assertEqual( [dumpItem(i) for i in doc.paragraphs], [dumpItem(i) for i in items] )
+        
+    def test_IncrementalParser(self):
+        
+        s = r'\title{The $x$ Title}' + '\n\n' + long_string + ' $a\n\nb$\n\n\n' + long_string + '\n'
+        p = lp.IncrementalParser()
+        doc = p.parse(s)
+        self.assertEqual( len(doc.paragraphs), 3 )
+        title, first, last = doc.paragraphs
+        
+        def check(start, end, text, n):
+            new = p.getSource()[:start] + text + p.getSource()[end:]
+            self.assertTrue( p.edit(start, end, text) is doc )
+            self.assertEqual( p.getSource(), new )
+            self.assertEqual( len(doc.paragraphs), n )
+            self.assertEqual( dumpItem(doc), dumpItem(lp.IncrementalParser().parse(new)) )
+            for para in doc.paragraphs:
+                self.assertTrue( para.doc is doc )
+            
+        # edit the second paragraph
+        i = s.index('$a')
+        check(i, i + 2, '$c', 3)
+        self.assertTrue( doc.paragraphs[0] is title )
+        self.assertTrue( doc.paragraphs[2] is last )
+        # split the second paragraph
+        check(i - 1, i - 1, '\n\n', 4)
+        self.assertTrue( doc.paragraphs[3] is last )
+        # join the paragraphs
+        check(i - 1, i + 1, '', 3)
+        # an unbalanced bracket joins the following paragraphs into one chunk
+        check(0, 0, '{', 4)
+        check(0, 1, '', 3)
+        # append a paragraph
+        n = len(p.getSource())
+        check(n, n, '\nThe end.', 4)
+        
+    def test_IncrementalParser_edits(self):
+        
+        # random edits give the same units and document as parsing the new source
+        parts = ['\n\n', '\n', ' ', '{', '}', '$', r'\$', '%', r'\foo ', r'\alpha', '1.5', 
+                 'word ', long_string]
+        random = Random(5)
+        s = '\n\n'.join([long_string] * 20)
+        p = lp.IncrementalParser()
+        doc = p.parse(s)
+        for k in range(100):
+            start = random.randint(0, len(s))
+            end = min(start + random.choice([0, 0, 1, 3, 300]), len(s))
+            text = ''.join([random.choice(parts) for i in range(random.randint(0, 3))])
+            new = s[:start] + text + s[end:]
+            fresh = lp.IncrementalParser()
+            try:
+                fresh.parse(new)
+            except Exception:
+                # bad maths raise an error and the document isn't changed
+                self.assertRaises( Exception, p.edit, start, end, text )
+                self.assertEqual( p.getSource(), s )
+                continue
+            s = new
+            p.edit(start, end, text)
+            self.assertEqual( [u[0] for u in p.units], [u[0] for u in fresh.units] )
+            self.assertEqual( [u[2] for u in p.units], [u[2] for u in fresh.units] )
+            self.assertEqual( dumpItem(doc), dumpItem(fresh.doc) )
+        self.assertEqual( p.getSource(), s )
+        
+    def test_IncrementalParser_cost(self):
+        
+        # an edit re-parses only the edited paragraph
+        p = lp.IncrementalParser()
+        p.parse('\n\n'.join([long_string] * 1000))
+        calls = []
+        parseChunk = p.parser._parseChunk
+        def countingParseChunk(text, complete):
+            calls.append(text)
+            return parseChunk(text, complete)
+        p.parser._parseChunk = countingParseChunk
+        i = 500 * (len(long_string) + 2) + 4
+        p.edit(i, i + 4, 'month')
+        self.assertEqual( len(calls), 1 )
+        self.assertEqual( p.doc.paragraphs[500].items[1].text, 'month' )
+        self.assertEqual( len(p.units), 1000 )
+        
     def test_Paragraphs_with_maths(self):
         
         s = r'Hello, $ x+  y- \frac{\beta-1} { 2}\sin \alpha/2 +0.3$ maths!'
@@ -293,9 +665,70 @@ class TestLatexParsers(unittest.TestCase):
         tester(pdf, r'\sum_{j}j^{2}',160)
         #self.assertRaises(Exception, tester(pdf, '\frac{}{}', 170))
         tester(pdf, r'x^{\sum_{j}j^{2}}',180)
+        tester(pdf, r'(a+b)^2 - x^-1',200)
+        tester(pdf, r'a+1 \over b',220)
         
         pdf.output('out/latex/test_inline_maths.pdf', 'F')
         
+    def test_InlineMathParser_shared(self):
+        
+        p = lp.InlineMathParser()
+        items = p.itemParser.operand.parser
+        frac = [items[i] for i in range(len(items)) if isinstance(items[i], lp.MathFracParser)][0]
+        # the arguments are parsed by the same grammar
+        self.assertTrue( frac.inner_parser is p )
+        created = []
+        init = sp.Parser.__init__
+        def countingInit(parser):
+            created.append(parser)
+            init(parser)
+        sp.Parser.__init__ = countingInit
+        try:
+            p.match(r'\frac{\sum_{i}^{n} x_{i}}{1 + \frac{a}{b^{2}}}')
+        finally:
+            sp.Parser.__init__ = init
+        self.assertTrue( p.hasMatch() )
+        self.assertEqual( created, [] )
+        
+    def test_InlineMathParser_operators(self):
+        p = lp.InlineMathParser()
+        p.match( r'x_{i}^2 + \frac{1}{2} \over y' )
+        self.assertTrue( p.hasMatch() )
+        self.assertEqual( dumpItem(p.docItem), ('InlineMathBlock', '', [
+            ('MathFrac', '', [
+                ('InlineMathBlock', '', [
+                    ('MathSubSuperscript', '', [('MathVariable', 'x', []), 
+                                                  ('InlineMathBlock', '', [('MathVariable', 'i', [])]),
+                                                  ('MathNumber', '2', [])]),
+                    ('MathSign', '+', []),
+                    ('MathFrac', '', [('InlineMathBlock', '', [('MathNumber', '1', [])]), 
+                                        ('InlineMathBlock', '', [('MathNumber', '2', [])])])]),
+                ('MathVariable', 'y', [])])]) )
+        
+    def test_InlineMathParser_scripts(self):
+        
+        x = ('MathVariable', 'x', [])
+        i = ('InlineMathBlock', '', [('MathVariable', 'i', [])])
+        for s, sup in [('x^2_{i}', ('MathNumber', '2', [])), 
+                       ('x_{i}^2', ('MathNumber', '2', [])),
+                       ('x^{2}_{i}', ('InlineMathBlock', '', [('MathNumber', '2', [])])),
+                       ('x_{i}^{2}', ('InlineMathBlock', '', [('MathNumber', '2', [])]))]:
+            # both scripts have the same base
+            for p in [lp.InlineMathParser(), sp.compileParser(lp.InlineMathParser())]:
+                p.match( s + ' + y' )
+                self.assertEqual( p.getEnd(), len(s) + 4 )
+                self.assertEqual( dumpItem(p.docItem), ('InlineMathBlock', '', [
+                    ('MathSubSuperscript', '', [x, i, sup]),
+                    ('MathSign', '+', []),
+                    ('MathVariable', 'y', [])]) )
+        p = lp.InlineMathParser()
+        p.match( 'a x^2_{i} b' )
+        items = p.docItem.items
+        self.assertEqual( [dumpItem(item)[0] for item in items], 
+                          ['MathVariable', 'MathSubSuperscript', 'MathVariable'] )
+        self.assertEqual( dumpItem(items[1].base), x )
+        self.assertEqual( dumpItem(items[1].superscript), ('MathNumber', '2', []) )
+        
 #    def test_MathSubSuperscriptParser(self):
 #        pdf = FPDF()
 #        lp.initPDF(pdf)
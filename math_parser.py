@@ -1,22 +1,299 @@
+"""Operator-precedence parser of math expressions."""
 import string_parser as sp
+from document import MathSign, MathVariable, MathPower, MathFrac, MathSubSuperscript, InlineMathBlock
 
 class Operators:
     """
     Operators used in an expression.
-    
+
     Args:
-        binary (list[str]): 
+        binary (list[str]): binary operators in the order of increasing precedence. Operators
+            of the same precedence are separated by spaces in one string. The empty string
+            gives the precedence of juxtaposition (two operands without an operator between them).
+        unary (str): space separated prefix operators.
+        unary_as (str): the binary operator (or '') which the prefix operators have the precedence of.
+        right (str): space separated right-associative binary operators.
+        postfix (str): space separated postfix operators. They bind tighter than any binary operator.
+        brackets (tuple): the opening and closing brackets grouping operands.
     """
-    def __init__(self, binary):
+    def __init__(self, binary, unary = '', unary_as = '', right = '', postfix = '', brackets = ('(', ')')):
         self.binary = binary
         self.precedence = {}
         self.op_chars = ''
         prec = 1
         for op_str in self.binary:
             ops = op_str.split(' ')
-            
+            for op in ops:
+                self.precedence[op] = prec
+            prec += 1
+        self.unary = frozenset(unary.split())
+        self.unary_precedence = self.precedence[unary_as]
+        self.right = frozenset(right.split())
+        self.postfix = frozenset(postfix.split())
+        self.bra, self.ket = brackets
+        # first character -> operators starting with it, the longest first
+        self._byChar = {}
+        allOps = set(self.precedence.keys()) | self.unary | self.postfix | set(brackets)
+        allOps.discard('')
+        for op in allOps:
+            self._byChar.setdefault(op[0], []).append(op)
+        for ops in self._byChar.values():
+            ops.sort(key = len, reverse = True)
+        self.op_chars = ''.join(sorted(self._byChar.keys()))
+
+    def match(self, s, start, end):
+        """Find an operator starting at an index in a string.
+
+        Args:
+            s (str): the string.
+            start (int): the index, must be less than end.
+            end (int): the end of the searched sub-string.
+        Return:
+            The operator or None. A name ending with a letter (\\over) isn't matched
+            if a letter follows it.
+        """
+        ops = self._byChar.get(s[start])
+        if ops is None:
+            return None
+        for op in ops:
+            i = start + len(op)
+            if i > end or not s.startswith(op, start):
+                continue
+            if op[-1].isalpha() and i < end and s[i].isalpha():
+                continue
+            return op
+        return None
+
+# the operators of inline maths
+math_operators = Operators(['\\over', ',', '= < >', '+ -', '/', '', '^'],
+                           unary = '+ -', right = '^', postfix = '!')
 
 class OpListParser(sp.Parser):
-    def __init__(self):
+    """Parses an expression: a list of operands and operators separated by spaces.
+
+    An operator-precedence parser working in linear time: parsing finds the tokens and when
+    the match is built the operands and the pending operators are kept on two stacks, 
+    an operator is applied when an operator of lower precedence or the end of the expression 
+    is found. Any sequence of operands and operators is accepted, a missing operand is empty.
+
+    The docItem of the match is the list of the created document items in the order of the
+    source: an operator is a MathSign between its operands except '^' which makes a MathPower
+    and '\\over' making a MathFrac. A '^' followed by '{' is a superscript left to the operand parser.
+    """
+    def __init__(self, operand, operators = math_operators):
+        """Constructor.
+
+        Args:
+            operand (Parser): parser of the operands. Its lookAtParent() is called with the match
+                of the preceding token as in ListParser.
+            operators (Operators): the operators.
+        """
         sp.Parser.__init__(self)
-        
+        self.operand = operand
+        self.operators = operators
+        self._spaces = sp.charClass(' \t\n')
+
+    def clone(self):
+        """Implements cloning."""
+        return OpListParser(self.operand, self.operators)
+
+    def _parse(self, s, start, end):
+        """Implements the match test."""
+        return sp.runSteps(self._parseSteps(s, start, end), s)
+
+    def _parseSteps(self, s, start, end):
+        """Implements the match test for StackParser.
+
+        Only finds the tokens: the children of the match are the matches of the operands
+        and the operators in the order of the source. The expression is built in _build().
+        """
+        operators = self.operators
+        tokens = []
+        # the match of the preceding token for lookAtParent()
+        last = None
+        i = start
+        while True:
+            i = self._spaces.match(s, i, end).end()
+            if i >= end:
+                break
+            op = operators.match(s, i, end)
+            if op == '^' and i + 1 < end and s[i + 1] == '{':
+                op = None
+            if op is None:
+                m = yield (self.operand, i, end)
+                if m is None:
+                    break
+                self.operand.lookAtParent(m, last, s)
+                last = m
+            else:
+                m = sp.Match(self, i, len(op), None, [])
+                if op == '\\over':
+                    last = None
+                else:
+                    last = m
+            tokens.append(m)
+            i = m.getEnd()
+        if not tokens:
+            yield (None,)
+            return
+        yield (sp.Match(self, start, i - start, None, tokens),)
+
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation: the loop of _parseSteps() with the operand parser inlined."""
+        me = gen.const(self)
+        operators = gen.const(self.operators)
+        operand = self.operand
+        tokens = gen.tmp()
+        last = gen.tmp()
+        i = gen.tmp()
+        op = gen.tmp()
+        m = gen.tmp()
+        gen.line('%s = []' % tokens)
+        gen.line('%s = None' % last)
+        gen.line('%s = %s' % (i, pos))
+        gen.line('while True:')
+        gen.indent()
+        gen.line('%s = %s.match(s, %s, %s).end()' % (i, gen.const(self._spaces), i, end))
+        gen.line('if %s >= %s:' % (i, end))
+        gen.line('    break')
+        gen.line('%s = %s.match(s, %s, %s)' % (op, operators, i, end))
+        gen.line("if %s == '^' and %s + 1 < %s and s[%s + 1] == '{':" % (op, i, end, i))
+        gen.line('    %s = None' % op)
+        gen.line('if %s is None:' % op)
+        gen.indent()
+        gen.emit(operand, m, i, end, True)
+        gen.line('if %s is None:' % m)
+        gen.line('    break')
+        if sp.overrides(operand, 'lookAtParent'):
+            gen.line('%s.lookAtParent(%s, %s, s)' % (gen.const(operand), m, last))
+        gen.line('%s = %s' % (last, m))
+        gen.dedent()
+        gen.line('else:')
+        gen.indent()
+        gen.line('%s = Match(%s, %s, len(%s), None, [])' % (m, me, i, op))
+        gen.line("if %s == %r:" % (op, '\\over'))
+        gen.line('    %s = None' % last)
+        gen.line('else:')
+        gen.line('    %s = %s' % (last, m))
+        gen.dedent()
+        gen.line('%s.append(%s)' % (tokens, m))
+        gen.line('%s = %s.start + %s.size' % (i, m, m))
+        gen.dedent()
+        gen.line('%s = None' % out)
+        gen.line('if %s:' % tokens)
+        gen.line('    %s = Match(%s, %s, %s - %s, None, %s)' % (out, me, pos, i, pos, tokens))
+
+    def _build(self, m, s):
+        """Implements the deferred action: apply the operators to the operands."""
+        operators = self.operators
+        if not m.children:
+            # an operator: take the string of the operator table, not a copy of the source
+            op = operators.match(s, m.start, m.getEnd())
+            if op == '\\over':
+                return None
+            return MathSign(op)
+        juxtaposition = operators.precedence['']
+        # operands: lists of matches holding the doc items (or None) in the order of the source
+        operands = []
+        # pending operators: tuples (precedence, kind, operator, match of the operator)
+        ops = []
+        expectOperand = True
+        for sign in m.children:
+            if sign.parser is not self:
+                if not expectOperand:
+                    if not [p for p in operands[-1] if p.docItem is not None]:
+                        # the operand took the preceding one (a script taking its base)
+                        operands[-1].append(sign)
+                        continue
+                    self._pushOperator(operands, ops, juxtaposition, 'binary', '', None)
+                operands.append([sign])
+                expectOperand = False
+                continue
+            op = operators.match(s, sign.start, sign.getEnd())
+            if expectOperand:
+                if op in operators.unary:
+                    ops.append((operators.unary_precedence, 'prefix', op, sign))
+                    continue
+                if op == operators.bra:
+                    ops.append((0, 'group', op, sign))
+                    continue
+                # the operand is missing
+                operands.append([])
+            expectOperand = False
+            if op == operators.bra:
+                self._pushOperator(operands, ops, juxtaposition, 'binary', '', None)
+                ops.append((0, 'group', op, sign))
+                expectOperand = True
+            elif op == operators.ket:
+                while ops and ops[-1][1] != 'group':
+                    self._apply(operands, ops.pop())
+                if ops:
+                    operands[-1] = [ops.pop()[3]] + operands[-1]
+                operands[-1].append(sign)
+            elif op in operators.postfix:
+                operands[-1].append(sign)
+            elif op in operators.precedence:
+                self._pushOperator(operands, ops, operators.precedence[op], 'binary', op, sign)
+                expectOperand = True
+            else:
+                # a prefix operator following an operand
+                self._pushOperator(operands, ops, juxtaposition, 'binary', '', None)
+                ops.append((operators.unary_precedence, 'prefix', op, sign))
+                expectOperand = True
+        if expectOperand:
+            operands.append([])
+        while ops:
+            self._apply(operands, ops.pop())
+        return [p.docItem for p in operands[0] if p.docItem is not None]
+
+    def _pushOperator(self, operands, ops, prec, kind, op, sign):
+        """Apply the pending operators of higher precedence and push a new operator on the stack."""
+        right = op in self.operators.right
+        while ops and (ops[-1][0] > prec or (ops[-1][0] == prec and not right)):
+            self._apply(operands, ops.pop())
+        ops.append((prec, kind, op, sign))
+
+    def _apply(self, operands, entry):
+        """Apply an operator from the stack to the operands on top of the operand stack."""
+        prec, kind, op, sign = entry
+        if kind != 'binary':
+            # prefix operators and not closed brackets
+            operands[-1] = [sign] + operands[-1]
+            return
+        right = operands.pop()
+        left = operands.pop()
+        if op == '^':
+            base = self._item(left)
+            index = self._item(right)
+            if isinstance(base, MathSubSuperscript) and not base.superscript:
+                # x_{i}^2: the power is the superscript of the script
+                base.setSuperscript(index)
+                item = base
+            elif isinstance(index, MathSubSuperscript) and not index.superscript and right[0].docItem is None:
+                # x^2_{i}: the script took the power as its base
+                index.setSuperscript(index.base)
+                index.setBase(base)
+                item = index
+            else:
+                item = MathPower()
+                item.appendItem(base)
+                item.appendItem(index)
+            operands.append([sp.Match(self, sign.start, 0, item)])
+        elif op == '\\over':
+            item = MathFrac()
+            item.appendItem(self._item(left))
+            item.appendItem(self._item(right))
+            operands.append([sp.Match(self, sign.start, 0, item)])
+        elif op == '':
+            operands.append(left + right)
+        else:
+            operands.append(left + [sign] + right)
+
+    def _item(self, operand):
+        """Make a single doc item from an operand."""
+        items = [p.docItem for p in operand if p.docItem is not None]
+        if len(items) == 1:
+            return items[0]
+        if not items:
+            return MathVariable('')
+        return InlineMathBlock(*items)
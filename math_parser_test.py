@@ -1,8 +1,79 @@
 import math_parser as mp
+import document as dc
+import string_parser as sp
 import unittest
 
+class OperandParser(sp.Parser):
+    """Test parser of operands: a letter or a digit"""
+    def _parse(self, s, start, end):
+        if s[start].isalpha():
+            return sp.Match(self, start, 1, dc.MathVariable(s[start]))
+        if s[start].isdigit():
+            return sp.Match(self, start, 1, dc.MathNumber(s[start]))
+        return None
+    
+def tree(item):
+    """Convert a doc item into a string showing its structure."""
+    if isinstance(item, dc.MathPower):
+        return '(%s^%s)' % (tree(item.items[0]), tree(item.items[1]))
+    if isinstance(item, dc.MathFrac):
+        return '{%s/%s}' % (tree(item.items[0]), tree(item.items[1]))
+    if isinstance(item, dc.InlineMathBlock):
+        return '[%s]' % ' '.join([tree(i) for i in item.items])
+    return item.text
+
 class TestMath(unittest.TestCase):
     
     def test_split(self):
         print 'a,b,c'.split(',')
-        
\ No newline at end of file
+        
+    def test_Operators(self):
+        ops = mp.Operators(['+ -', '', '^'], unary = '-', right = '^', postfix = '!')
+        self.assertEqual(ops.precedence['+'], 1)
+        self.assertEqual(ops.precedence['-'], 1)
+        self.assertEqual(ops.precedence[''], 2)
+        self.assertEqual(ops.precedence['^'], 3)
+        self.assertEqual(ops.unary_precedence, 2)
+        self.assertEqual(ops.op_chars, '!()+-^')
+        self.assertEqual(mp.math_operators.match('a \\over b', 2, 9), '\\over')
+        self.assertEqual(mp.math_operators.match('\\overline', 0, 9), None)
+        self.assertEqual(mp.math_operators.match('x', 0, 1), None)
+        
+    def parse(self, s):
+        p = mp.OpListParser(OperandParser())
+        p.match(s)
+        if not p.hasMatch():
+            return None
+        return ' '.join([tree(item) for item in p.getResult().docItem])
+        
+    def test_OpListParser(self):
+        self.assertEqual(self.parse('a + b - 1'), u'a + b \u2212 1')
+        self.assertEqual(self.parse('2ab'), '2 a b')
+        # precedence and associativity
+        self.assertEqual(self.parse('2x^2 + 1'), '2 (x^2) + 1')
+        self.assertEqual(self.parse('x^y^z'), '(x^(y^z))')
+        self.assertEqual(self.parse('a^b c^d'), '(a^b) (c^d)')
+        self.assertEqual(self.parse('(a+b)^2'), '([( a + b )]^2)')
+        self.assertEqual(self.parse('a, b = c \\over d'), '{[a , b = c]/d}')
+        # unary and postfix operators
+        self.assertEqual(self.parse('-x^2'), u'\u2212 (x^2)')
+        self.assertEqual(self.parse('x^-1'), u'(x^[\u2212 1])')
+        self.assertEqual(self.parse('n!^2'), '([n !]^2)')
+        # missing operands and unbalanced brackets keep the order of the source
+        self.assertEqual(self.parse('a + = b'), 'a + = b')
+        self.assertEqual(self.parse('(a'), '( a')
+        self.assertEqual(self.parse('a)(b'), 'a ) ( b')
+        self.assertEqual(self.parse('x^'), '(x^)')
+        self.assertEqual(self.parse('x^{y}'), 'x')
+        # no match
+        self.assertEqual(self.parse(''), None)
+        self.assertEqual(self.parse('  '), None)
+        self.assertEqual(self.parse('{a}'), None)
+        
+    def test_size(self):
+        p = mp.OpListParser(OperandParser())
+        s = 'a + b  {c}'
+        m = p.parse(s)
+        self.assertEqual(m.size, 7)
+        m = sp.StackParser(p).parse(s)
+        self.assertEqual(m.size, 7)
@@ -0,0 +1,335 @@
+"""
+On-disk cache of parsed documents.
+
+The document item trees are stored with marshal in a compact form. An instance is a tuple of
+the index of its class in a class table followed by the encoded values of its attributes. 
+The other values (strings, numbers, points, rects, ...) are stored once in a table of 
+constants and referred to by their indices, points and rects are stored there as tuples of 
+floats. An instance referenced from several places (as the base of MathSubSuperscript which 
+is also one of its items) is stored once, the other references are negative numbers.
+"""
+import hashlib
+import marshal
+import os
+import sys
+import types
+import document
+import point
+import rect
+from document import Document
+from latex_parser import DocumentParser, grammar_version
+
+# version of the format of the cache files
+format_version = 3
+
+# modules of the classes which can be restored from a cache file
+_modules = ('document', 'rect', 'point')
+
+# the types of the values stored in the table of constants as themselves
+_leafTypes = (str, unicode, int, long, float, bool, type(None))
+
+def _isLeaf(value):
+    """Check if a value can be stored in the table of constants as itself."""
+    if isinstance(value, tuple):
+        for v in value:
+            if not _isLeaf(v):
+                return False
+        return True
+    return isinstance(value, _leafTypes)
+
+class Encoder:
+    """Converts document items into marshallable values.
+    
+    An encoded value is:
+        a non-negative int: the index of a constant;
+        a negative int -n-1: a reference to the n-th encoded instance;
+        a tuple: an instance, the first element is the index of its class in the class table, 
+            the other ones are the values of the attributes named in the class table;
+        a list or a dict of encoded values.
+    """
+    def __init__(self):
+        # list of (class name, attribute names), the class name of a tuple of values 
+        # which aren't constants is 'tuple' and there are no attribute names
+        self.classes = []
+        self._classIndex = {}
+        # the stored values
+        self.constants = []
+        # index of a constant -> the class of a constant which isn't stored as itself
+        self.kinds = {}
+        self._constantIndex = {}
+        # id of an instance -> its number
+        self._objects = {}
+        # the encoded instances, keeps the ids valid
+        self._kept = []
+        
+    def _classOf(self, name, names):
+        """Return the index of a class in the class table."""
+        key = (name, names)
+        index = self._classIndex.get(key)
+        if index is None:
+            index = self._classIndex[key] = len(self.classes)
+            self.classes.append(key)
+        return index
+        
+    def _constant(self, value, kind = None):
+        """Return the index of a constant.
+        
+        Args:
+            value: the stored value.
+            kind (str): the class of the value restored from the stored value or None.
+        """
+        key = (kind, marshal.dumps(value, 2))
+        index = self._constantIndex.get(key)
+        if index is None:
+            index = self._constantIndex[key] = len(self.constants)
+            self.constants.append(value)
+            if kind is not None:
+                self.kinds[index] = kind
+        return index
+        
+    def encode(self, value):
+        """Convert a value of an attribute of a document item into a marshallable value."""
+        if isinstance(value, list):
+            return [self.encode(v) for v in value]
+        if value is document.default_styles:
+            return self._constant(None, 'default_styles')
+        if isinstance(value, dict):
+            return dict([(k, self.encode(v)) for k, v in value.items()])
+        if isinstance(value, point.Point):
+            return self._constant((value.x(), value.y()), 'point.Point')
+        if isinstance(value, rect.Rect):
+            return self._constant((value.x0(), value.y0(), value.x1(), value.y1()), 'rect.Rect')
+        if _isLeaf(value):
+            if type(value) is str:
+                value = intern(value)
+            return self._constant(value)
+        if isinstance(value, tuple):
+            return (self._classOf('tuple', ()),) + tuple([self.encode(v) for v in value])
+        if isinstance(value, Document):
+            raise Exception('Document cannot be encoded as a value.')
+        cls = getattr(value, '__class__', None)
+        if getattr(cls, '__module__', None) not in _modules:
+            raise Exception('Cannot encode a value of type %s.' % type(value).__name__)
+        number = self._objects.get(id(value))
+        if number is not None:
+            return -number - 1
+        self._objects[id(value)] = len(self._kept)
+        self._kept.append(value)
+        state = value.__dict__
+        names = tuple([name for name in sorted(state) 
+                       # the paragraphs get their document and styles when appended to a document
+                       if not (name == 'doc' or (name == 'styles' and isinstance(value, document.Paragraph)))])
+        index = self._classOf(cls.__module__ + '.' + cls.__name__, names)
+        return (index,) + tuple([self.encode(state[name]) for name in names])
+
+class Decoder:
+    """Restores the values converted by an Encoder."""
+    def __init__(self, classes, constants, kinds):
+        """Constructor.
+        
+        Args:
+            classes (list): the class table of the Encoder.
+            constants (list): the constants of the Encoder.
+            kinds (dict): the kinds of the constants of the Encoder.
+        """
+        self.classes = []
+        for name, names in classes:
+            if name == 'tuple':
+                self.classes.append((tuple, names))
+                continue
+            module, clsName = name.rsplit('.', 1)
+            if module not in _modules:
+                raise ValueError('Cannot restore an object of class %s' % name)
+            self.classes.append((getattr(sys.modules[module], clsName), names))
+        self.constants = constants
+        self.kinds = kinds
+        # the decoded instances in the order of their numbers
+        self._objects = []
+        
+    def _constant(self, index):
+        """Restore a constant. The points and rects are new objects as they are mutable."""
+        value = self.constants[index]
+        kind = self.kinds.get(index)
+        if kind is None:
+            return value
+        if kind == 'point.Point':
+            return point.Point(value[0], value[1])
+        if kind == 'rect.Rect':
+            return rect.Rect(value[0], value[1], value[2], value[3])
+        if kind == 'default_styles':
+            return document.default_styles
+        raise ValueError('Unknown kind of a constant: %s' % kind)
+        
+    def decode(self, data):
+        """Restore a value converted by Encoder.encode()."""
+        if isinstance(data, (int, long)):
+            if data >= 0:
+                return self._constant(data)
+            return self._objects[-data - 1]
+        if isinstance(data, list):
+            return [self.decode(v) for v in data]
+        if isinstance(data, dict):
+            return dict([(k, self.decode(v)) for k, v in data.iteritems()])
+        cls, names = self.classes[data[0]]
+        if cls is tuple:
+            return tuple([self.decode(v) for v in data[1:]])
+        if len(names) != len(data) - 1:
+            raise ValueError('Wrong number of attributes of %s' % cls.__name__)
+        if isinstance(cls, types.ClassType):
+            value = types.InstanceType(cls, {})
+        else:
+            value = cls.__new__(cls)
+        # register before the attributes are decoded: they may refer to the instance
+        self._objects.append(value)
+        for name, v in zip(names, data[1:]):
+            setattr(value, name, self.decode(v))
+        return value
+
+def encodeDocument(doc):
+    """Convert a Document into a marshallable value."""
+    encoder = Encoder()
+    paragraphs = [encoder.encode(para) for para in doc.paragraphs]
+    return (format_version, encoder.classes, encoder.constants, encoder.kinds, paragraphs)
+
+def decodeDocument(data):
+    """Restore a Document converted by encodeDocument()."""
+    if data[0] != format_version:
+        raise ValueError('Wrong version of the cache format: %s' % data[0])
+    version, classes, constants, kinds, paragraphs = data
+    decoder = Decoder(classes, constants, kinds)
+    doc = Document()
+    for para in paragraphs:
+        doc.appendParagraph(decoder.decode(para))
+    return doc
+
+class ParseCache:
+    """A directory with parsed documents.
+
+    The files are named by a hash of the source and the grammar version. When the total
+    size of the files exceeds a limit the least recently used files are deleted.
+    """
+    def __init__(self, directory, maxSize = 100 * 1024 * 1024):
+        """Constructor.
+
+        Args:
+            directory (str): path to the cache directory. Created if doesn't exist.
+            maxSize (int): maximum total size of the cache files in bytes.
+        """
+        self.directory = directory
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, s):
+        """Return the key of a document source."""
+        h = hashlib.sha1('%d.%d.' % (grammar_version, format_version))
+        if isinstance(s, unicode):
+            h.update('u')
+            h.update(s.encode('utf-8'))
+        else:
+            h.update('s')
+            h.update(s)
+        return h.hexdigest()
+
+    def _path(self, key):
+        """Return the path to the cache file of a key."""
+        return os.path.join(self.directory, key + '.doc')
+
+    def get(self, s):
+        """Find a document in the cache.
+
+        Args:
+            s (str): the source of the document.
+
+        Return:
+            The Document or None if the source isn't in the cache.
+        """
+        path = self._path(self.key(s))
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            self.misses += 1
+            return None
+        try:
+            try:
+                doc = decodeDocument(marshal.load(f))
+            finally:
+                f.close()
+        except (EOFError, ValueError, TypeError, IndexError, KeyError, AttributeError):
+            # a truncated or corrupt file
+            self.misses += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        # mark the file as recently used
+        os.utime(path, None)
+        self.hits += 1
+        return doc
+
+    def put(self, s, doc):
+        """Store a document in the cache.
+
+        Args:
+            s (str): the source of the document.
+            doc (Document): the parsed document.
+        """
+        path = self._path(self.key(s))
+        tmp = path + '.%d.tmp' % os.getpid()
+        f = open(tmp, 'wb')
+        try:
+            marshal.dump(encodeDocument(doc), f, 2)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        """Delete the least recently used files while the cache is too big."""
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.doc'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, path, st.st_size))
+            total += st.st_size
+        files.sort()
+        for mtime, path, size in files:
+            if total <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def parse(self, s, parser = None):
+        """Return the parsed document taking it from the cache if possible.
+
+        Args:
+            s (str): the source of the document.
+            parser (DocumentParser): the parser to use on a cache miss. If None a new
+                DocumentParser is created.
+
+        Return:
+            The Document or None if the source cannot be parsed.
+        """
+        doc = self.get(s)
+        if doc is not None:
+            return doc
+        if parser is None:
+            parser = DocumentParser()
+        parser.match(s)
+        if not parser.hasMatch():
+            return None
+        doc = parser.docItem
+        self.put(s, doc)
+        return doc
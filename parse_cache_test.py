@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+import cPickle
+import marshal
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import document
+import latex_parser as lp
+import parse_cache as pc
+from fpdf import FPDF
+
+long_string = 'The year 1866 was marked by a bizarre development, an unexplained and downright  inexplicable phenomenon that surely no one has forgotten.'
+
+def dumpItem(item):
+    """Convert a doc item tree into nested tuples for comparisons."""
+    children = getattr(item, 'paragraphs', None) or getattr(item, 'items', [])
+    return (item.__class__.__name__, getattr(item, 'text', None), getattr(item, 'style', None),
+            [dumpItem(i) for i in children])
+
+class TestParseCache(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+    def test_encode(self):
+        s = r'\title{The $x$ Title}' + '\n\n' + long_string + \
+            r' $x_{i}^{2} + \frac{\alpha}{\beta_{k}} - \sum_{j=0}^{N} y_{j} \sin\theta$ ' + u' \u03b1'
+        p = lp.DocumentParser()
+        p.match(s)
+        doc = pc.decodeDocument(pc.encodeDocument(p.docItem))
+        self.assertEqual( dumpItem(doc), dumpItem(p.docItem) )
+        for para in doc.paragraphs:
+            self.assertTrue( para.doc is doc )
+            self.assertTrue( para.styles is doc.styles )
+        
+        s = r'\title{The Title}' + '\n\n' + long_string
+        p.match(s)
+        doc = pc.decodeDocument(pc.encodeDocument(p.docItem))
+        doc.setPDF(FPDF())
+        doc.outputPDF('out/latex/test_parse_cache.pdf')
+        
+    def test_shared_items(self):
+        s = r'A $x_{i}$ b and $\frac{y_{j}^{2}}{z}$ c'
+        p = lp.DocumentParser()
+        p.match(s)
+        doc = pc.decodeDocument(pc.encodeDocument(p.docItem))
+        self.assertEqual( dumpItem(doc), dumpItem(p.docItem) )
+        sub = doc.paragraphs[0].items[1].items[0]
+        self.assertTrue( sub.base is sub.items[0] )
+        self.assertTrue( sub.subscript is sub.items[1] )
+        # the decoded document can be laid out
+        for para in doc.paragraphs:
+            para.styles = document.default_styles
+        doc.setPDF(FPDF())
+        self.assertTrue( sub.base.rect.width() > 0 )
+        
+    def test_compact(self):
+        s = '\n\n'.join([long_string + r' $x_{%d}^{2} + \frac{\alpha}{\beta_{k}}$' % i for i in range(20)])
+        p = lp.DocumentParser()
+        p.match(s)
+        size = len(marshal.dumps(pc.encodeDocument(p.docItem), 2))
+        self.assertTrue( size < len(cPickle.dumps(p.docItem, 2)) )
+        
+    def test_corrupt(self):
+        cache = pc.ParseCache(self.directory)
+        s = long_string + ' $x_{i}$'
+        doc = cache.parse(s)
+        path = cache._path(cache.key(s))
+        for data in (open(path, 'rb').read()[:100], 'garbage', marshal.dumps((pc.format_version, 1))):
+            f = open(path, 'wb')
+            f.write(data)
+            f.close()
+            misses = cache.misses
+            self.assertEqual( dumpItem(cache.parse(s)), dumpItem(doc) )
+            self.assertEqual( cache.misses, misses + 1 )
+            # the file is written again
+            self.assertTrue( cache.get(s) is not None )
+        
+    def test_cache(self):
+        cache = pc.ParseCache(self.directory)
+        s = long_string + ' $x^{2}$'
+        doc = cache.parse(s)
+        self.assertEqual( (cache.hits, cache.misses), (0, 1) )
+        doc1 = cache.parse(s)
+        self.assertEqual( (cache.hits, cache.misses), (1, 1) )
+        self.assertFalse( doc1 is doc )
+        self.assertEqual( dumpItem(doc1), dumpItem(doc) )
+        self.assertEqual( cache.get(s + ' '), None )
+        self.assertNotEqual( cache.key(s), cache.key(unicode(s)) )
+        
+    def test_eviction(self):
+        cache = pc.ParseCache(self.directory)
+        sources = [long_string + ' %d' % i for i in range(3)]
+        for s in sources:
+            cache.parse(s)
+        size = os.path.getsize(cache._path(cache.key(sources[0])))
+        files = [cache._path(cache.key(s)) for s in sources]
+        now = time.time()
+        for i, path in enumerate(files):
+            os.utime(path, (now - 100 + i, now - 100 + i))
+        # use the oldest file
+        cache.get(sources[0])
+        cache.maxSize = 2 * size + size / 2
+        cache.parse(long_string + ' 3')
+        self.assertTrue( os.path.exists(files[0]) )
+        self.assertFalse( os.path.exists(files[1]) )
+        self.assertFalse( os.path.exists(files[2]) )
+        
+if __name__ == "__main__":
+    unittest.main()
@@ -3,23 +3,33 @@ tolerance = 1e-15
 """
 A 2D point.
 """
-class Point:
+class Point(object):
+    
+    # no __dict__: a document creates many points
+    __slots__ = ('_x', '_y')
     
     def __init__(self, x = None, y = None):
         """ Constructor """
-        if x != None:
-            if isinstance(x, Point):
-                self._x = x._x
-                self._y = x._y
-                return
-            else:
-                self._x = float(x)
-        else:
+        if x is None:
             self._x = 0.0
-        if y != None:
-            self._y = float(y)
+        elif isinstance(x, Point):
+            self._x = x._x
+            self._y = x._y
+            return
         else:
+            self._x = float(x)
+        if y is None:
             self._y = 0.0
+        else:
+            self._y = float(y)
+    
+    def __getstate__(self):
+        """ Support pickling with any protocol """
+        return (self._x, self._y)
+    
+    def __setstate__(self, state):
+        """ Support unpickling """
+        self._x, self._y = state
     
     def x(self):
         """ Get the x component """
@@ -37,7 +47,8 @@ class Point:
     def translate(self, dx, dy = None):
         """ Translate this point by a vector """
         if isinstance(dx, Point):
-            self += dx
+            self._x += dx._x
+            self._y += dx._y
         else:
             self._x += float( dx )
             self._y += float( dy )
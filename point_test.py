@@ -1,3 +1,4 @@
+import pickle
 import unittest
 from point import Point
 
@@ -136,4 +137,9 @@ class TestPoint(unittest.TestCase):
         self.assertTrue( p.isNear(Point(1.1,1.8)) )
         p.translate( Point(-1,2) )
         self.assertTrue( p.isNear(Point(0.1,3.8)) )
-        
\ No newline at end of file
+        
+    def test_pickle(self):
+        p = Point(1.2, 2.3)
+        self.assertFalse(hasattr(p, '__dict__'))
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(pickle.loads(pickle.dumps(p, protocol)), p)
@@ -13,7 +13,10 @@ The bottom border of the rectangle is always at y0 regardless whether y0 < y1 or
 The top border is always at y1. ???
 
 """
-class Rect:
+class Rect(object):
+    
+    # the corners are kept as four floats, no __dict__: a document creates many rects
+    __slots__ = ('_x0', '_y0', '_x1', '_y1')
     
     def __init__(self, x0 = None, y0 = None, x1 = None, y1 = None):
         """
@@ -23,30 +26,44 @@ class Rect:
         are given the empty default Rect is created with both points at (0,0). Any other number of
         arguments are not allowed.
         """
-        if x0 == None:
-            self._p0 = Point()
-            self._p1 = Point()
-        elif y1 != None:
-            self._p0 = Point(x0,y0)
-            self._p1 = Point(x1,y1)
-        elif x1 != None:
+        if y1 is not None:
+            self._x0 = float(x0)
+            self._y0 = float(y0)
+            self._x1 = float(x1)
+            self._y1 = float(y1)
+        elif x0 is None:
+            self._x0 = self._y0 = self._x1 = self._y1 = 0.0
+        elif x1 is not None:
             raise Exception('Rect is given wrong number of arguments.')
-        elif  y0 == None:
+        elif  y0 is None:
             if isinstance(x0, Rect):
-                self._p0 = Point( x0.p0() )
-                self._p1 = Point( x0.p1() )
+                self._x0 = x0._x0
+                self._y0 = x0._y0
+                self._x1 = x0._x1
+                self._y1 = x0._y1
             else:
                 raise Exception('Rect is given arguments of wrong type.')
         elif not isinstance(x0,Point) or not isinstance(y0,Point):
             raise Exception('Rect is given arguments of wrong type.')
         else:
-            self._p0 = Point( x0 )
-            self._p1 = Point( y0 )
+            self._x0 = x0._x
+            self._y0 = x0._y
+            self._x1 = y0._x
+            self._y1 = y0._y
+    
+    def __getstate__(self):
+        """ Support pickling with any protocol """
+        return (self._x0, self._y0, self._x1, self._y1)
+    
+    def __setstate__(self, state):
+        """ Support unpickling """
+        self._x0, self._y0, self._x1, self._y1 = state
                 
     def __eq__(self, other):
         """ Comparison == """
         if isinstance(other, Rect):
-            return self._p0 == other._p0 and self._p1 == other._p1
+            return self._x0 == other._x0 and self._y0 == other._y0 and \
+                   self._x1 == other._x1 and self._y1 == other._y1
         return NotImplemented
 
     def __ne__(self, other):
@@ -57,44 +74,44 @@ class Rect:
         return not result
     
     def p0(self):
-        """ Return the bottom-left point """
-        return self._p0;
+        """ Return the bottom-left point. It is a copy: changing it doesn't change the Rect. """
+        return Point(self._x0, self._y0)
 
     def p1(self):
-        """ Return the top-right point """
-        return self._p1;
+        """ Return the top-right point. It is a copy: changing it doesn't change the Rect. """
+        return Point(self._x1, self._y1)
     
     def x0(self):
-        return self._p0.x();
+        return self._x0
 
     def y0(self):
-        return self._p0.y();
+        return self._y0
 
     def x1(self):
-        return self._p1.x();
+        return self._x1
 
     def y1(self):
-        return self._p1.y();
+        return self._y1
 
     def __str__(self):
         """ Convert to string (print) """
-        return '(' + str(self._p0) + ',' + str(self._p1) + ')'
+        return '(' + str(self.p0()) + ',' + str(self.p1()) + ')'
     
     def xSpan(self):
         """ p1.x - p0.x  """
-        return self._p1.x() - self._p0.x()
+        return self._x1 - self._x0
     
     def ySpan(self):
         """ p1.y - p0.y  """
-        return self._p1.y() - self._p0.y()
+        return self._y1 - self._y0
     
     def width(self):
         """ Get the size of the Rect in x direction """
-        return abs( self.xSpan() )
+        return abs( self._x1 - self._x0 )
     
     def height(self):
         """ Get the size of the Rect in y direction """
-        return abs( self.ySpan() )
+        return abs( self._y1 - self._y0 )
     
     def isEmpty(self):
         """ Check if this Rect is empty ie has a zero area """
@@ -102,27 +119,33 @@ class Rect:
 
     def center(self):
         """ Get the centre of this Rect """
-        return Point( ( self._p0.x() + self._p1.x() ) / 2, ( self._p0.y() + self._p1.y() ) / 2 )
+        return Point( ( self._x0 + self._x1 ) / 2, ( self._y0 + self._y1 ) / 2 )
     
     def moveCenter(self, c):
         """ Translate this Rect such that its center moves to c """
-        dp = c - self.center()
-        self._p0 += dp
-        self._p1 += dp
+        dx = c.x() - ( self._x0 + self._x1 ) / 2
+        dy = c.y() - ( self._y0 + self._y1 ) / 2
+        self._x0 += dx
+        self._y0 += dy
+        self._x1 += dx
+        self._y1 += dy
         
     def alignXCenter(self, r):
         """Align center of this rect with the center of rect r."""
-        rc = ( r.x0() + r.x1() ) / 2
-        xc = ( self.x0() + self.x1() ) / 2
-        dp = Point(rc - xc, 0)
-        self._p0 += dp
-        self._p1 += dp
+        rc = ( r._x0 + r._x1 ) / 2
+        xc = ( self._x0 + self._x1 ) / 2
+        dx = rc - xc
+        self._x0 += dx
+        self._x1 += dx
         
     def moveTo(self, p):
         """ Translate this Rect such that its p0 moves to p """
-        dp = p - self._p0
-        self._p0 += dp
-        self._p1 += dp
+        dx = p.x() - self._x0
+        dy = p.y() - self._y0
+        self._x0 += dx
+        self._y0 += dy
+        self._x1 += dx
+        self._y1 += dy
         
     def vertex(self, i):
         """ 
@@ -130,200 +153,305 @@ class Rect:
         the vertices are numbered in the clockwise direction starting with p0.
         """
         if i == 0:
-            return self._p0
+            return Point(self._x0, self._y0)
         elif i == 1:
-            return Point(self._p0.x(), self._p1.y())
+            return Point(self._x0, self._y1)
         elif i == 2:
-            return self._p1
+            return Point(self._x1, self._y1)
         elif i == 3:
-            return Point(self._p1.x(), self._p0.y())
+            return Point(self._x1, self._y0)
 
     def setVertex(self, i, p):
         """ Set i-th vertex (Point) of this Rect. Other vertices change accordingly. """
         if not isinstance(p, Point):
             raise Exception('A vertex is a Point')
         if i == 0:
-            self._p0 = Point( p )
+            self._x0 = p.x()
+            self._y0 = p.y()
         elif i == 1:
-            self._p0.set( p.x(), self._p0.y() )
-            self._p1.set( self._p1.x(), p.y() )
+            self._x0 = p.x()
+            self._y1 = p.y()
         elif i == 2:
-            self._p1 = Point( p )
+            self._x1 = p.x()
+            self._y1 = p.y()
         elif i == 3:
-            self._p0.set( self._p0.x(), p.y() )
-            self._p1.set( p.x(), self._p1.y() )
+            self._y0 = p.y()
+            self._x1 = p.x()
 
     def translate(self, dx, dy = None):
         """ Translate this Rect by vector (Point) dp """
         if isinstance( dx, Point):
-            self._p0 += dx
-            self._p1 += dx
+            dy = dx.y()
+            dx = dx.x()
         else:
-            dp = Point(dx,dy)
-            self._p0 += dp
-            self._p1 += dp
+            dx = float(dx)
+            dy = 0.0 if dy is None else float(dy)
+        self._x0 += dx
+        self._y0 += dy
+        self._x1 += dx
+        self._y1 += dy
             
     def move_x0(self, x):
         """Move the Rect so its p0.x() == x. The width doesn't change."""
-        dx = x - self._p0.x()
-        self.translate(Point(dx,0))
+        dx = x - self._x0
+        self._x0 += dx
+        self._x1 += dx
+
+    def setX(self, x0, x1):
+        """Set the x coordinates of the corners keeping the y coordinates."""
+        self._x0 = float(x0)
+        self._x1 = float(x1)
 
     def move_y0(self, y):
         """Move the Rect so its p0.y() == y. The width doesn't change."""
-        dy = y - self._p0.y()
-        self.translate(Point(0, dy))
+        dy = y - self._y0
+        self._y0 += dy
+        self._y1 += dy
 
     def adjust(self, dp0, dp1):
         """ Adjust the Rect by translating p0 and p1 by dp0 and dp1 respectively"""
-        self._p0 += dp0
-        self._p1 += dp1
+        self._x0 += dp0.x()
+        self._y0 += dp0.y()
+        self._x1 += dp1.x()
+        self._y1 += dp1.y()
         
     def include(self, p):
         """ Expand the rectangle if needed to include a point. """
-        x0 = self._p0.x()
-        y0 = self._p0.y()
-        x1 = self._p1.x()
-        y1 = self._p1.y()
-        xspan = self.xSpan()
-        yspan = self.ySpan()
+        self._include(p.x(), p.y())
+        
+    def _include(self, x, y):
+        """ Expand the rectangle if needed to include a point (x,y). """
+        x0 = self._x0
+        y0 = self._y0
+        x1 = self._x1
+        y1 = self._y1
         if x0 == 0 and y0 == 0 and x1 == 0 and y1 == 0:
-            x0 = p.x()
-            y0 = p.y()
-            x1 = x0
-            y1 = y0
-        else:
-            if xspan == 0:
-                if p.x() < x0:
-                    x0 = p.x()
-                if p.x() > x1:
-                    x1 = p.x()
-            elif (p.x() - x0) / self.xSpan() < 0:
-                x0 = p.x()
-            elif (p.x() - x1) / self.xSpan() > 0:
-                x1 = p.x();
-            if yspan == 0:
-                if p.y() < y0:
-                    y0 = p.y()
-                if p.y() > y1:
-                    y1 = p.y()
-            elif (p.y() - y0) / self.ySpan() < 0:
-                y0 = p.y()
-            elif (p.y() - y1) / self.ySpan() > 0:
-                y1 = p.y()
-        self._p0 = Point(x0,y0)
-        self._p1 = Point(x1,y1)
+            self._x0 = self._x1 = x
+            self._y0 = self._y1 = y
+            return
+        xspan = x1 - x0
+        yspan = y1 - y0
+        if xspan == 0:
+            if x < x0:
+                self._x0 = x
+            if x > x1:
+                self._x1 = x
+        elif (x - x0) / xspan < 0:
+            self._x0 = x
+        elif (x - x1) / xspan > 0:
+            self._x1 = x
+        if yspan == 0:
+            if y < y0:
+                self._y0 = y
+            if y > y1:
+                self._y1 = y
+        elif (y - y0) / yspan < 0:
+            self._y0 = y
+        elif (y - y1) / yspan > 0:
+            self._y1 = y
         
     def unite(self, r):
         """ 
         Unite this Rect with another. The result is that this Rect changes to
         include both former self and the other rect. 
         """
-        if r.p0().x() != 0.0 or r.p0().y() != 0.0: 
-            self.include(r.p0())
-            self.include(r.p1())
+        if r._x0 != 0.0 or r._y0 != 0.0: 
+            self._include(r._x0, r._y0)
+            self._include(r._x1, r._y1)
         else:
-            self.include(r.p1())
-            self.include(r.p0())
+            self._include(r._x1, r._y1)
+            self._include(r._x0, r._y0)
         
     def xFlip(self):
         """ Flip the rect horizontally """
-        x0 = self._p0.x()
-        y0 = self._p0.y()
-        x1 = self._p1.x()
-        y1 = self._p1.y()
-        self._p0 = Point(x1,y0)
-        self._p1 = Point(x0,y1)
+        self._x0, self._x1 = self._x1, self._x0
         
     def yFlip(self):
         """ Flip the rect vertically """
-        x0 = self._p0.x()
-        y0 = self._p0.y()
-        x1 = self._p1.x()
-        y1 = self._p1.y()
-        self._p0 = Point(x0,y1)
-        self._p1 = Point(x1,y0)
+        self._y0, self._y1 = self._y1, self._y0
         
     def contains(self, p):
         """ Check if this rect contains a point or another rect. """
-        x0 = self._p0.x()
-        y0 = self._p0.y()
-        x1 = self._p1.x()
-        y1 = self._p1.y()
         if isinstance( p, Point ):
-            x = p.x()
-            y = p.y()
-            if x0 < x1:
-                dx = x - x0
-            else:
-                dx = x - x1;
-            if dx < 0 or dx > self.width():
-                return False
-            if y0 < y1:
-                dy = y - y0
-            else:
-                dy = y - y1
-            if dy < 0 or dy > self.height():
-                return False
-            return True
+            return self._contains(p.x(), p.y())
         else:
-            return self.contains( p.p0() ) and self.contains( p.p1() )
+            return self._contains(p._x0, p._y0) and self._contains(p._x1, p._y1)
 
-def _justifyX(rectList, xstart, xend):
-    """Justify a list of rectangles along x axis without checking if they will fit.
+    def _contains(self, x, y):
+        """ Check if this rect contains a point (x,y). """
+        x0 = self._x0
+        y0 = self._y0
+        x1 = self._x1
+        y1 = self._y1
+        if x0 < x1:
+            dx = x - x0
+        else:
+            dx = x - x1;
+        if dx < 0 or dx > self.width():
+            return False
+        if y0 < y1:
+            dy = y - y0
+        else:
+            dy = y - y1
+        if dy < 0 or dy > self.height():
+            return False
+        return True
+
+#---------------------------------------------------------------------------------
+# Alignment kernels working on lists of the x coordinates of rectangles: x0[i] and x1[i]
+# are the left and right borders of the i-th rect. The functions taking lists of Rects
+# are wrappers extracting the coordinates with xArrays() and storing them with setXArrays().
+
+def xArrays(rectList):
+    """Return the lists of the left (x0) and right (x1) borders of a list of rectangles."""
+    return [r.x0() for r in rectList], [r.x1() for r in rectList]
+
+def setXArrays(rectList, x0, x1):
+    """Move a list of rectangles along x axis to new borders x0 and x1."""
+    for i in range(len(rectList)):
+        rectList[i].setX(x0[i], x1[i])
+
+def justifyArrays(x0, x1, start, end, xstart, xend):
+    """Justify the rects start..end-1 along x axis without checking if they will fit.
     
     Args:
-        rectList: a list of rectangles.
+        x0, x1 (list): the left and right borders of the rects, changed in place.
+        start, end (int): the range of the rects.
         xstart (float): lower x bound.
         xend (float): upper x bound.
     """
-    n = len(rectList)
+    n = end - start
     if n == 0:
         return
     elif n == 1:
-        rectList[0].move_x0(xstart)
+        shift = xstart - x0[start]
+        x0[start] += shift
+        x1[start] += shift
         return
     # the width to fill
     jwidth = float(xend - xstart)
     # the sum of widths of all the rects
     rwidth = 0.0
-    for r in rectList:
-        rwidth += r.width()
+    for i in range(start, end):
+        rwidth += abs(x1[i] - x0[i])
     # the separation between rects
     dx = ( jwidth - rwidth ) / ( n - 1 )
-    rectList[0].move_x0(xstart)
-    for i in range(1,n):
-        rectList[i].move_x0( rectList[i-1].x1() + dx )
-        
-def _nXFit(rectList, xstart, xend, dx = 0):
-    """Find first n Rects in a list that fit together in interval [xstart, xend] with minimum
-    distance between rects dx.
-    
-    Args:
-        rectList: a list of rectangles.
-        xstart (float): lower x bound.
-        xend (float): upper x bound.
-        dx (float): minimum distance between rects.
+    x = xstart
+    for i in range(start, end):
+        shift = x - x0[i]
+        x0[i] += shift
+        x1[i] += shift
+        x = x1[i] + dx
+
+def nXFitArrays(x0, x1, start, xstart, xend, dx = 0):
+    """Find the number of rects starting at index start that fit together in interval 
+    [xstart, xend] with minimum distance between rects dx.
     
     Return:
-        tuple (n, width taken by first n rects separated by dx)
+        tuple (n, width taken by the n rects separated by dx)
     """
     # the width to fill
     jwidth = float(xend - xstart)
     # find the max number of rects that can fit into jwidth without overlapping
     rwidth = 0.0
     n = 0
-    for i in range(len(rectList)):
-        rwidth += rectList[i].width()
-        if i > 0:
+    for i in xrange(start, len(x0)):
+        w = abs(x1[i] - x0[i])
+        rwidth += w
+        if i > start:
             rwidth += dx
         if rwidth <= jwidth:
-            n = i + 1
+            n = i - start + 1
         else:
-            rwidth -= rectList[i].width()
-            if i > 0:
+            rwidth -= w
+            if i > start:
                 rwidth -= dx
             break
     return n,rwidth
+
+def alignArrays(x0, x1, start, end, xstart, xend, rwidth, alignment):
+    """Align the rects start..end-1 along x axis without checking if they will fit.
+    
+    Args:
+        x0, x1 (list): the left and right borders of the rects, changed in place.
+        start, end (int): the range of the rects.
+        xstart (float): lower x bound.
+        xend (float): upper x bound.
+        rwidth (float): the width of the rects with the minimum distances between them.
+        alignment (str): j (justify), l (left), r (right) or c (center).
+    """
+    if alignment == 'j':
+        justifyArrays(x0, x1, start, end, xstart, xend)
+    elif alignment == 'l':
+        justifyArrays(x0, x1, start, end, xstart, xstart + rwidth)
+    elif alignment == 'r':
+        justifyArrays(x0, x1, start, end, xend - rwidth, xend)
+    elif alignment == 'c':
+        c = ( xstart + xend ) / 2
+        w = rwidth / 2
+        justifyArrays(x0, x1, start, end, c - w, c + w)
+    else:
+        raise Exception('Unknown alignment ' + alignment)
+
+def breakLinesArrays(x0, x1, xstart, xend, dx = 0):
+    """Break a list of rects into lines fitting into interval [xstart, xend].
+    
+    Each line takes as many rects as fit with minimum distance dx between them, found 
+    by nXFitArrays() so that the widths are summed and compared in the same order. 
+    Each rect is added once and the first one not fitting once more on the next line, 
+    so the time is linear in the number of rects. A rect wider than the interval takes 
+    a line alone.
+    
+    Args:
+        x0, x1 (list): the left and right borders of the rects.
+        xstart (float): lower x bound.
+        xend (float): upper x bound.
+        dx (float): minimum distance between rects.
+    
+    Return:
+        A list of tuples (start, end, width): the line consists of the rects start..end-1 and 
+        takes width when the rects are separated by dx.
+    """
+    lines = []
+    n = len(x0)
+    start = 0
+    while start < n:
+        count, rwidth = nXFitArrays(x0, x1, start, xstart, xend, dx)
+        if count == 0:
+            count = 1
+            rwidth = abs(x1[start] - x0[start])
+        lines.append((start, start + count, rwidth))
+        start += count
+    return lines
+
+#---------------------------------------------------------------------------------
+def _justifyX(rectList, xstart, xend):
+    """Justify a list of rectangles along x axis without checking if they will fit.
+    
+    Args:
+        rectList: a list of rectangles.
+        xstart (float): lower x bound.
+        xend (float): upper x bound.
+    """
+    x0, x1 = xArrays(rectList)
+    justifyArrays(x0, x1, 0, len(x0), xstart, xend)
+    setXArrays(rectList, x0, x1)
+        
+def _nXFit(rectList, xstart, xend, dx = 0):
+    """Find first n Rects in a list that fit together in interval [xstart, xend] with minimum
+    distance between rects dx.
+    
+    Args:
+        rectList: a list of rectangles.
+        xstart (float): lower x bound.
+        xend (float): upper x bound.
+        dx (float): minimum distance between rects.
+    
+    Return:
+        tuple (n, width taken by first n rects separated by dx)
+    """
+    x0, x1 = xArrays(rectList)
+    return nXFitArrays(x0, x1, 0, xstart, xend, dx)
     
 
 def justifyX(rectList, xstart, xend, dx = 0):
@@ -344,7 +472,7 @@ def justifyX(rectList, xstart, xend, dx = 0):
     if n == 0:
         return n
     
-    _justifyX(rectList[:n], xstart, xend)
+    alignLine(rectList[:n], xstart, xend, rwidth, 'j')
     
     return n
 
@@ -367,7 +495,7 @@ def alignLeft(rectList, xstart, xend, dx):
     if n == 0:
         return n
     
-    _justifyX(rectList[:n], xstart, xstart + rwidth)
+    alignLine(rectList[:n], xstart, xend, rwidth, 'l')
     
     return n
 
@@ -389,7 +517,7 @@ def alignRight(rectList, xstart, xend, dx):
     if n == 0:
         return n
     
-    _justifyX(rectList[:n], xend - rwidth, xend)
+    alignLine(rectList[:n], xstart, xend, rwidth, 'r')
     
     return n
 
@@ -411,9 +539,38 @@ def center(rectList, xstart, xend, dx):
     if n == 0:
         return n
     
-    c = ( xstart + xend ) / 2
-    w = rwidth / 2
-    
-    _justifyX(rectList[:n], c - w, c + w)
+    alignLine(rectList[:n], xstart, xend, rwidth, 'c')
     
     return n
+
+def alignLine(rectList, xstart, xend, rwidth, alignment):
+    """Align a line of rectangles along x axis without checking if they will fit.
+    
+    Args:
+        rectList: a list of rectangles.
+        xstart (float): lower x bound.
+        xend (float): upper x bound.
+        rwidth (float): the width of the rects with the minimum distances between them.
+        alignment (str): j (justify), l (left), r (right) or c (center).
+    """
+    x0, x1 = xArrays(rectList)
+    alignArrays(x0, x1, 0, len(x0), xstart, xend, rwidth, alignment)
+    setXArrays(rectList, x0, x1)
+
+def breakLines(rectList, xstart, xend, dx = 0):
+    """Break a list of rectangles into lines fitting into interval [xstart, xend].
+    
+    See breakLinesArrays().
+    
+    Args:
+        rectList: a list of rectangles.
+        xstart (float): lower x bound.
+        xend (float): upper x bound.
+        dx (float): minimum distance between rects.
+    
+    Return:
+        A list of tuples (start, end, width): the line consists of rectList[start:end] and 
+        takes width when the rects are separated by dx.
+    """
+    x0, x1 = xArrays(rectList)
+    return breakLinesArrays(x0, x1, xstart, xend, dx)
@@ -1,4 +1,6 @@
+import pickle
 import unittest
+from random import Random
 from rect import *
 from rect import _justifyX, _nXFit
 from point import Point
@@ -141,6 +143,21 @@ class TestRect(unittest.TestCase):
         r.unite(r1)
         self.assertTrue(r.contains(r1) and r1.contains(r))
     
+    def test_points(self):
+        
+        r = Rect(Point(1,2), Point(3,4))
+        self.assertEqual(r, Rect(1,2,3,4))
+        self.assertEqual(str(r), '([1.0,2.0],[3.0,4.0])')
+        self.assertFalse(hasattr(r, '__dict__'))
+        # the points are copies
+        r.p0().set(5, 6)
+        r.vertex(2).set(5, 6)
+        self.assertEqual(r, Rect(1,2,3,4))
+        r.translate(1)
+        self.assertEqual(r, Rect(2,2,4,4))
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(pickle.loads(pickle.dumps(r, protocol)), r)
+        
     def test_flip(self):
         pass
                  
@@ -395,3 +412,79 @@ class TestRect(unittest.TestCase):
         self.assertAlmostEqual(rlist[2].y1(), 2)
         
         
+
+    def test_breakLines(self):
+        
+        self.assertEqual(breakLines([], 10, 14, 0.6), [])
+        rlist = [Rect(0,1,1,2), Rect(0,1,2,2), Rect(0,1,1,2), Rect(0,1,5,2), Rect(0,1,1,2)]
+        lines = breakLines(rlist, 10, 14, 0.5)
+        self.assertEqual([line[:2] for line in lines], [(0, 2), (2, 3), (3, 4), (4, 5)])
+        self.assertAlmostEqual(lines[0][2], 3.5)
+        self.assertAlmostEqual(lines[1][2], 1)
+        # a rect wider than the interval takes a line alone
+        self.assertAlmostEqual(lines[2][2], 5)
+        # the same breaks as with _nXFit
+        rlist = [Rect(0,0,0.1 * (i % 7 + 1),1) for i in range(100)]
+        start = 0
+        for line in breakLines(rlist, 0, 1.7, 0.2):
+            n, rwidth = _nXFit(rlist[start:], 0, 1.7, 0.2)
+            self.assertEqual(line[:2], (start, start + n))
+            self.assertAlmostEqual(line[2], rwidth)
+            start += n
+        self.assertEqual(start, 100)
+        # the widths are summed as in _nXFit: 3.9 + 2.5 + 0.9 + 2.5 + 7.9 <= 17.7
+        lines = breakLines([Rect(0,0,3.9,1), Rect(0,0,0.9,1), Rect(0,0,7.9,1)], 0, 17.7, 2.5)
+        self.assertEqual([line[:2] for line in lines], [(0, 3)])
+        random = Random(21)
+        for k in range(3000):
+            rlist = [Rect(0,0,random.randint(1,80) * 0.1,1) for i in range(random.randint(1,12))]
+            dx = random.randint(0,30) * 0.1
+            jwidth = random.randint(10,300) * 0.1
+            start = 0
+            for line in breakLines(rlist, 0, jwidth, dx):
+                n, rwidth = _nXFit(rlist[start:], 0, jwidth, dx)
+                if n == 0:
+                    n, rwidth = 1, rlist[start].width()
+                self.assertEqual(line, (start, start + n, rwidth))
+                start += n
+            self.assertEqual(start, len(rlist))
+        
+    def test_alignLine(self):
+        
+        for alignment, x0 in (('j', 10), ('l', 10), ('r', 11.4), ('c', 10.7)):
+            rlist = [Rect(0,1,1,2), Rect(0,1,1,2)]
+            alignLine(rlist, 10, 14, 2.6, alignment)
+            self.assertAlmostEqual(rlist[0].x0(), x0)
+            self.assertAlmostEqual(rlist[0].y0(), 1)
+            if alignment == 'j':
+                self.assertAlmostEqual(rlist[1].x1(), 14)
+            else:
+                self.assertAlmostEqual(rlist[1].x0(), x0 + 1.6)
+        self.assertRaises(Exception, alignLine, [Rect(0,1,1,2)], 10, 14, 1, 'x')
+        
+    def test_alignArrays(self):
+        
+        rlist = [Rect(0,1,1,2), Rect(3,1,5,2), Rect(0,1,1,2), Rect(0,1,2,2)]
+        x0, x1 = xArrays(rlist)
+        self.assertEqual(x0, [0, 3, 0, 0])
+        self.assertEqual(x1, [1, 5, 1, 2])
+        # align the middle two rects only
+        alignArrays(x0, x1, 1, 3, 10, 14, 3.5, 'r')
+        self.assertEqual(x0[0], 0)
+        self.assertEqual(x1[3], 2)
+        self.assertAlmostEqual(x0[1], 10.5)
+        self.assertAlmostEqual(x1[1], 12.5)
+        self.assertAlmostEqual(x0[2], 13)
+        self.assertAlmostEqual(x1[2], 14)
+        setXArrays(rlist, x0, x1)
+        self.assertAlmostEqual(rlist[1].x0(), 10.5)
+        self.assertAlmostEqual(rlist[2].x1(), 14)
+        self.assertAlmostEqual(rlist[2].y1(), 2)
+        # the kernels give the same results as the functions taking lists of rects
+        rlist = [Rect(0,0,0.1 * (i % 7 + 1),1) for i in range(50)]
+        x0, x1 = xArrays(rlist)
+        self.assertEqual(breakLinesArrays(x0, x1, 0, 1.7, 0.2), breakLines(rlist, 0, 1.7, 0.2))
+        self.assertEqual(nXFitArrays(x0, x1, 5, 0, 1.7, 0.2), _nXFit(rlist[5:], 0, 1.7, 0.2))
+        justifyArrays(x0, x1, 5, 12, 1, 4)
+        _justifyX(rlist[5:12], 1, 4)
+        self.assertEqual(xArrays(rlist), (x0, x1))
@@ -1,6 +1,338 @@
 """
 Defines string parsing classes. Parsers can be combined to parse complex syntaxes.
 """
+import re
+from collections import OrderedDict
+from timeit import default_timer
+
+# compiled character classes
+_charClasses = {}
+
+def charClass(chars, negate = False):
+    """Compile a regular expression matching a run of characters from a list.
+    
+    Args:
+        chars (str): characters to match.
+        negate (bool): if True match characters not in the list.
+    """
+    key = (chars, negate)
+    pattern = _charClasses.get(key)
+    if pattern is None:
+        escaped = ''.join([re.escape(c) for c in chars])
+        if negate:
+            pattern = re.compile('[^' + escaped + ']*')
+        else:
+            pattern = re.compile('[' + escaped + ']*')
+        _charClasses[key] = pattern
+    return pattern
+
+# a run of alphanumeric characters: contains any run of alphabetic characters or digits
+_alnum = re.compile(r'[^\W_]*')
+_ualnum = re.compile(r'[^\W_]*', re.UNICODE)
+
+def _alnumEnd(s, start, end):
+    """Return the end index of the run of alphanumeric characters starting at start."""
+    if isinstance(s, unicode):
+        return _ualnum.match(s, start, end).end()
+    return _alnum.match(s, start, end).end()
+
+class MemoTable:
+    """Packrat memo table shared by all parsers.
+    
+    Caches results of parsers keyed by the grammar node (see Parser._memoKey()),
+    start and end indices of the matched sub-string. The table lives for the duration of 
+    one top-level call to Parser.match() and is cleared when it returns. 
+    The number of stored entries is bounded by maxsize: when the table is full
+    the oldest entries are evicted.
+    
+    Memoization is off by default: enable it for grammars which backtrack over
+    the same sub-strings.
+    """
+    def __init__(self, maxsize = 100000):
+        """Constructor.
+        
+        Args:
+            maxsize (int): maximum number of entries kept in the table.
+        """
+        self.enabled = False
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # nesting level of Parser.match() calls
+        self._depth = 0
+        self._table = OrderedDict()
+        
+    def enable(self, maxsize = None):
+        """Switch memoization on, optionally changing the maximum size."""
+        if maxsize is not None:
+            self.maxsize = maxsize
+        self.enabled = True
+        
+    def disable(self):
+        """Switch memoization off."""
+        self.enabled = False
+        
+    def __len__(self):
+        """Return number of stored entries."""
+        return len(self._table)
+        
+    def enter(self):
+        """Called by Parser.match() on entry."""
+        self._depth += 1
+        
+    def leave(self):
+        """Called by Parser.match() on exit. Clears the table after a top-level match."""
+        self._depth -= 1
+        if self._depth == 0:
+            self._table.clear()
+        
+    def lookup(self, key):
+        """Find a stored result for a key or return None.
+        
+        Args:
+            key (tuple): (grammar node key, start, end)
+        """
+        entry = self._table.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+        
+    def store(self, key, entry):
+        """Store a result for a key."""
+        table = self._table
+        table[key] = entry
+        if len(table) > self.maxsize:
+            table.popitem(last = False)
+
+# the memo table used by Parser.parse
+memo = MemoTable()
+
+class IndexCache:
+    """Indexes of the parsed string shared by all parsers.
+    
+    An index (eg the pairs of brackets, see bracketIndex()) is built in one pass over 
+    the string and reused while the same string object is parsed. Like the memo table 
+    the cache lives for the duration of one top-level call to Parser.match(), Parser.parse() 
+    or build() and is cleared when it returns so the string isn't kept alive. 
+    Outside of these calls nothing is stored.
+    """
+    def __init__(self):
+        """Constructor."""
+        # nesting level of the top-level calls, 0 outside of them
+        self.depth = 0
+        # index key -> (string, index)
+        self._indexes = {}
+        
+    def __len__(self):
+        """Return number of stored indexes."""
+        return len(self._indexes)
+        
+    def enter(self):
+        """Called on entry to a top-level call."""
+        self.depth += 1
+        
+    def leave(self):
+        """Called on exit of a top-level call. Clears the cache when the outermost call returns."""
+        self.depth -= 1
+        if self.depth == 0:
+            self._indexes.clear()
+        
+    def lookup(self, s, key):
+        """Find a stored index of a string or return None.
+        
+        Args:
+            s (str): the string.
+            key (tuple): the kind of the index.
+        """
+        entry = self._indexes.get(key)
+        if entry is not None and entry[0] is s:
+            return entry[1]
+        return None
+        
+    def store(self, s, key, index):
+        """Store an index of a string replacing the index of any other string."""
+        if self.depth > 0:
+            self._indexes[key] = (s, index)
+
+# the index cache used by the parsers
+indexes = IndexCache()
+
+class ParserStats:
+    """Statistics of the calls to Parser.parse() of a parser or a parser class."""
+    def __init__(self, name):
+        """Constructor.
+        
+        Args:
+            name (str): name of the parser or the class.
+        """
+        self.name = name
+        # number of calls
+        self.calls = 0
+        # number of successful matches
+        self.successes = 0
+        # number of characters consumed by the successful matches
+        self.chars = 0
+        # number of failed attempts inside an AltParser
+        self.backtracks = 0
+        # cumulative time in seconds including the time spent in the child parsers
+        self.time = 0.0
+        
+    def add(self, stats):
+        """Add the numbers of another ParserStats object to this one."""
+        self.calls += stats.calls
+        self.successes += stats.successes
+        self.chars += stats.chars
+        self.backtracks += stats.backtracks
+        self.time += stats.time
+
+class Profiler:
+    """Collects statistics of parser calls.
+    
+    When enabled Parser.parse() reports every call to the profiler which records 
+    the statistics for each grammar node (parser object). Profiling is off by default.
+    Compiled parsers (see compileParser()) are seen as single nodes.
+    """
+    def __init__(self):
+        """Constructor."""
+        self.enabled = False
+        self.reset()
+        
+    def enable(self):
+        """Switch profiling on."""
+        self.enabled = True
+        
+    def disable(self):
+        """Switch profiling off."""
+        self.enabled = False
+        
+    def reset(self):
+        """Delete the collected statistics."""
+        # parser -> ParserStats
+        self._nodes = {}
+        # parsers being called
+        self._stack = []
+        
+    def profile(self, parser, s, start, end, n):
+        """Call the parser and record the statistics. Called by Parser.parse()."""
+        stats = self._nodes.get(parser)
+        if stats is None:
+            stats = ParserStats('%s#%d' % (parser.__class__.__name__, len(self._nodes)))
+            self._nodes[parser] = stats
+        stack = self._stack
+        if stack:
+            parent = stack[-1]
+        else:
+            parent = None
+        stack.append(parser)
+        t = default_timer()
+        try:
+            if memo.enabled:
+                m = parser._parseMemo(s, start, end, n)
+            else:
+                m = parser._parseChecked(s, start, end, n)
+        finally:
+            stats.time += default_timer() - t
+            stack.pop()
+        stats.calls += 1
+        if m is None:
+            if isinstance(parent, AltParser):
+                stats.backtracks += 1
+        else:
+            stats.successes += 1
+            stats.chars += m.size
+        return m
+        
+    def report(self, byClass = False):
+        """Return the collected statistics.
+        
+        Args:
+            byClass (bool): if True sum the statistics of the parsers of the same class.
+            
+        Return:
+            A list of ParserStats objects sorted by time in descending order.
+        """
+        if byClass:
+            classes = {}
+            for parser, stats in self._nodes.items():
+                name = parser.__class__.__name__
+                if name not in classes:
+                    classes[name] = ParserStats(name)
+                classes[name].add(stats)
+            rows = classes.values()
+        else:
+            rows = self._nodes.values()
+        return sorted(rows, key = lambda stats: stats.time, reverse = True)
+    
+    def formatReport(self, byClass = False, limit = None):
+        """Return the collected statistics as a table in a string.
+        
+        Args:
+            byClass (bool): if True sum the statistics of the parsers of the same class.
+            limit (int): maximum number of rows, if None print all.
+        """
+        rows = self.report(byClass)[:limit]
+        width = max([len(stats.name) for stats in rows] + [6])
+        lines = ['%-*s %10s %10s %10s %10s %10s' % 
+                 (width, 'parser', 'calls', 'successes', 'chars', 'backtracks', 'time')]
+        for stats in rows:
+            lines.append('%-*s %10d %10d %10d %10d %10.4f' % (width, stats.name, stats.calls, 
+                         stats.successes, stats.chars, stats.backtracks, stats.time))
+        return '\n'.join(lines)
+
+# the profiler used by Parser.parse
+profiler = Profiler()
+
+class Match(object):
+    """Result of a successful match.
+    
+    A lightweight record produced by Parser.parse(). Parsers don't store the results of 
+    parse() in themselves so one grammar object can be reused to match any number of tokens.
+    """
+    __slots__ = ('parser', 'start', 'size', 'docItem', 'children')
+    
+    def __init__(self, parser, start, size, docItem = None, children = None):
+        """Constructor.
+        
+        Args:
+            parser (Parser): the parser which made the match.
+            start (int): starting index of the matching sub-string.
+            size (int): size of the matching sub-string.
+            docItem: a document item created by the parser (optional).
+            children (list): matches of the child parsers (optional).
+        """
+        self.parser = parser
+        self.start = start
+        self.size = size
+        self.docItem = docItem
+        self.children = children
+        
+    def hasMatch(self):
+        """A Match object always represents a match."""
+        return True
+    
+    def getMatch(self, s):
+        """Return the matching sub-string of s."""
+        return s[self.start : self.start + self.size]
+    
+    def getEnd(self):
+        """Return the end index of the match."""
+        return self.start + self.size
+    
+    def __getitem__(self, i):
+        """Return i-th child match."""
+        return self.children[i]
+    
+    def __len__(self):
+        """Return number of child matches."""
+        if self.children is None:
+            return 0
+        return len(self.children)
+    
+    def __nonzero__(self):
+        """A Match is true even if it has no children."""
+        return True
 
 class Parser:
     """Base class for all parsers."""
@@ -13,6 +345,8 @@ class Parser:
         self._start = 0
         # size of the matching sub-string
         self._size = 0
+        # the Match object of the last call to match()
+        self._result = None
         # Set to true if the concrete parser can match an empty string, ie 
         # an empty string satisfies the match criteria.
         self._canMatchEmpty = False
@@ -28,6 +362,7 @@ class Parser:
         """Try to find a match in a string.
          
         Match string s starting at index start and upto index end (index of last character + 1).
+        The result is stored in this parser and can be accessed with hasMatch(), getMatch(), etc.
         
         Args:
             s (str): a string to find a match in.
@@ -36,34 +371,174 @@ class Parser:
         Return:
             True if match was found and False if not.
         """
-        self._hasMatch = False
+        indexes.enter()
+        try:
+            m = self.parse(s, start, end)
+            build(m, s)
+        finally:
+            indexes.leave()
+        self._setResult(m, start)
+        return self._hasMatch
+    
+    def parse(self, s, start = 0, end = -1):
+        """Try to find a match in a string without changing the state of this parser.
+         
+        Args:
+            s (str): a string to find a match in.
+            start (int): starting index in s (default 0)
+            end (int): ending index in s (default -1 meaning to the end of the string)
+        Return:
+            A Match object if match was found and None if not. The deferred actions 
+            of the parsers aren't run, see build().
+        """
+        if not indexes.depth:
+            # a top-level call: keep the indexes of s until it returns
+            indexes.enter()
+            try:
+                return self.parse(s, start, end)
+            finally:
+                indexes.leave()
         s_len = len(s)
         # n: length of the searchable sub-string
         n = end - start
-        # handle empty string: if can match empty strings return True
-        # if not return False
+        # handle empty string: if can match empty strings return an empty match
+        # if not return None
         if s_len == 0 or n == 0 or start >= s_len:
-            self._start = start
-            self._size = 0
-            self._hasMatch = self._canMatchEmpty
-            return self._hasMatch
+            if self._canMatchEmpty:
+                return Match(self, start, 0)
+            return None
 
         if n < 0 or end > s_len:
             end = s_len
             n = s_len - start
             
-        self._start = start
-        self._hasMatch,size = self._test(s, start, end)
-        # make sure _size is 0 if there is no match
-        if self._hasMatch:
-            if size > n:
-                raise Exception('Wrong size returned by a parser')
-            self._size = size
+        if profiler.enabled:
+            return profiler.profile(self, s, start, end, n)
+        if memo.enabled:
+            return self._parseMemo(s, start, end, n)
+        
+        # same as _parseChecked()
+        m = self._parse(s, start, end)
+        if m is not None and m.size > n:
+            raise Exception('Wrong size returned by a parser')
+        return m
+        
+    def _parseChecked(self, s, start, end, n):
+        """Call _parse() and check the size of the match."""
+        m = self._parse(s, start, end)
+        if m is not None and m.size > n:
+            raise Exception('Wrong size returned by a parser')
+        return m
+        
+    def _parseMemo(self, s, start, end, n):
+        """Implements parse() with memoization."""
+        memo.enter()
+        try:
+            key = self._memoKey()
+            if key is not None:
+                key = (key, start, end)
+                entry = memo.lookup(key)
+                if entry is not None:
+                    # failed matches are stored as False
+                    return entry or None
+            m = self._parseChecked(s, start, end, n)
+            if key is not None:
+                memo.store(key, m or False)
+            return m
+        finally:
+            memo.leave()
+    
+    def _parse(self, s, start, end):
+        """Virtual protected method returning a Match object or None. 
+        
+        The default implementation calls _test(). Parsers which need to return more information
+        than the size of the match (child matches, document items) override this method.
+        Arguments are the same as of _test().
+        """
+        hasMatch, size = self._test(s, start, end)
+        if hasMatch:
+            return Match(self, start, size)
+        return None
+    
+    def _parseSteps(self, s, start, end):
+        """Generator version of _parse() used by StackParser to avoid recursion.
+        
+        To match a child parser the generator yields a tuple (parser, start, end) and receives 
+        the result of parser.parse(s, start, end) (a Match or None). The last yielded value 
+        is a tuple with one element: the result of this parser. The default implementation 
+        calls _parse().
+        """
+        yield (self._parse(s, start, end),)
+        
+    def _setResult(self, m, start):
+        """Store the result of parse() in this parser.
+        
+        Args:
+            m (Match): the match or None.
+            start (int): the starting index passed to parse().
+        """
+        self._result = m
+        if m is None:
+            self._hasMatch = False
+            self._start = start
+            self._size = 0
         else:
-            self._size = 0 
+            self._hasMatch = True
+            self._start = m.start
+            self._size = m.size
         
-        return self._hasMatch
+    def _memoKey(self):
+        """Return a hashable key identifying the grammar of this parser for memoization.
         
+        Parsers returning equal keys must give equal results on the same sub-string.
+        The default None means that results of this parser are not memoized. 
+        """
+        return None
+
+    def _build(self, m, s):
+        """Return the docItem of a match of this parser.
+        
+        The deferred action of the parser: called by build() after the whole match is found,
+        the children of m are already built. Only matches having a list of children (can be
+        empty) are built. The default returns the current m.docItem.
+        
+        Args:
+            m (Match): a match of this parser.
+            s (str): the parsed string.
+        """
+        return m.docItem
+        
+    def _firstChars(self):
+        """Return the set of the characters a match of this parser can start with.
+        
+        If s[start] is not in the set, parse(s, start, end) with start < end returns None.
+        AltParser uses the sets to skip alternatives which cannot match. The default None 
+        means that the set is unknown and the parser must always be tried.
+        """
+        return None
+
+    def getResult(self):
+        """Return the Match object of the last call to match() or None if there was no match."""
+        return self._result
+    
+    def _compileAsRule(self):
+        """Return True if the generated code must be put into a separate function
+        rather than inlined into the code of the parent parser."""
+        return False
+    
+    def _compile(self, gen, out, pos, end):
+        """Generate code assigning the result of this parser to a variable.
+        
+        Called by CodeGenerator.emit() which handles empty sub-strings, so pos < end 
+        in the generated code. The default implementation calls _parse().
+        
+        Args:
+            gen (CodeGenerator): the code generator.
+            out (str): name of the variable to assign the Match or None to.
+            pos (str): name of the variable with the starting index.
+            end (str): name of the variable with the ending index.
+        """
+        gen.line('%s = %s._parse(s, %s, %s)' % (out, gen.const(self), pos, end))
 
     def hasMatch(self):
         """Checks if this parser had a match."""
@@ -109,13 +584,14 @@ class Parser:
         """ 
         return self._start + self._size
 
-    def lookAtParent(self, parser, s):
-        """Complex parsers may call this method to pass a reference to themselves to
-        a child parser. Can be useful in case a parser depends on results of another 
-        sibling parser. 
+    def lookAtParent(self, m, last, s):
+        """ListParser calls this method of its token parser after each matched token.
+        Can be useful in case a parser depends on results of the previous token. 
+        The implementations may modify m and last.
         
         Args:
-            parser (Parser): a complex parent parser
+            m (Match): the match of this parser
+            last (Match): the match of the previous token in the list or None
             s (str): string being parsed
         """
         pass
@@ -139,6 +615,16 @@ class CharParser(Parser):
         else:
             return (False, 0)
         
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        gen.line('%s = None' % out)
+        gen.line('if s[%s] in %s:' % (pos, gen.const(self._chars)))
+        gen.line('    %s = Match(%s, %s, 1)' % (out, gen.const(self), pos))
+        
+    def _firstChars(self):
+        """Implements the first characters."""
+        return frozenset(self._chars)
+        
     def clone(self):
         """Implements cloning."""
         return CharParser(self._chars)
@@ -162,6 +648,12 @@ class NotCharParser(Parser):
         else:
             return (False, 0)
         
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        gen.line('%s = None' % out)
+        gen.line('if s[%s] not in %s:' % (pos, gen.const(self._chars)))
+        gen.line('    %s = Match(%s, %s, 1)' % (out, gen.const(self), pos))
+        
     def clone(self):
         """Implements cloning."""
         return NotCharParser(self._chars)
@@ -177,15 +669,20 @@ class AllNotCharParser(Parser):
         self._chars = s
         if len(s) == 0:
             raise Exception('List of characters cannot be empty')
+        self._pattern = charClass(s, True)
     
     def _test(self, s, start, end):
         """Implements the match test."""
-        for i in range(start,end): 
-            if s[i] in self._chars:
-                if i == start:
-                    return (False, 0)
-                return (True, i - start)
-        return (True, end - start)
+        size = self._pattern.match(s, start, end).end() - start
+        return (size > 0, size)
+        
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        i = gen.tmp()
+        gen.line('%s = None' % out)
+        gen.line('%s = %s.match(s, %s, %s).end()' % (i, gen.const(self._pattern), pos, end))
+        gen.line('if %s > %s:' % (i, pos))
+        gen.line('    %s = Match(%s, %s, %s - %s)' % (out, gen.const(self), pos, i, pos))
         
     def clone(self):
         """Implements cloning."""
@@ -211,6 +708,16 @@ class StringParser(Parser):
         else:
             return (False, 0)
         
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        gen.line('%s = None' % out)
+        gen.line('if s.startswith(%s, %s):' % (gen.const(self._string), pos))
+        gen.line('    %s = Match(%s, %s, %d)' % (out, gen.const(self), pos, len(self._string)))
+        
+    def _firstChars(self):
+        """Implements the first characters."""
+        return frozenset(self._string[0])
+        
     def clone(self):
         """
         Implements cloning.
@@ -260,6 +767,7 @@ class ZeroOrMoreSpaces(Parser):
         """Constructor."""
         Parser.__init__(self)
         self._chars = ' \t\n'
+        self._pattern = charClass(self._chars)
         self._canMatchEmpty = True
         
     def clone(self):
@@ -268,10 +776,12 @@ class ZeroOrMoreSpaces(Parser):
 
     def _test(self, s, start, end):
         """Implements the match test."""
-        for i in range(start,end):
-            if s[i] not in self._chars:
-                return (True, i - start)
-        return (True, end - start)
+        return (True, self._pattern.match(s, start, end).end() - start)
+        
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        gen.line('%s = Match(%s, %s, %s.match(s, %s, %s).end() - %s)' % 
+                 (out, gen.const(self), pos, gen.const(self._pattern), pos, end, pos))
 
 class AllParser(Parser):
     """Match any string even empty.
@@ -288,6 +798,10 @@ class AllParser(Parser):
     def _test(self, s, start, end):
         """Implements the match test."""
         return (True, end - start)
+        
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        gen.line('%s = Match(%s, %s, %s - %s)' % (out, gen.const(self), pos, end, pos))
 
 class AlphaParser(Parser):
     """Match a string containing alphabetic characters."""
@@ -301,13 +815,17 @@ class AlphaParser(Parser):
 
     def _test(self, s, start, end):
         """Implements the match test."""
-        for i in range(start,end):
-            if not s[i].isalpha():
-                if i == start:
-                    return (False, 0)
-                else:
-                    return (True, i - start)
-        return (True, end - start)
+        i = _alnumEnd(s, start, end)
+        if i == start:
+            return (False, 0)
+        if not s[start:i].isalpha():
+            # the run contains digits: find the first one
+            i = start
+            while s[i].isalpha():
+                i += 1
+            if i == start:
+                return (False, 0)
+        return (True, i - start)
 
 class DigitParser(Parser):
     """Match a string containing digits only characters."""
@@ -321,13 +839,17 @@ class DigitParser(Parser):
 
     def _test(self, s, start, end):
         """Implements the match test."""
-        for i in range(start,end):
-            if not s[i].isdigit():
-                if i == start:
-                    return (False, 0)
-                else:
-                    return (True, i - start)
-        return (True, end - start)
+        i = _alnumEnd(s, start, end)
+        if i == start:
+            return (False, 0)
+        if not s[start:i].isdigit():
+            # the run contains letters: find the first one
+            i = start
+            while s[i].isdigit():
+                i += 1
+            if i == start:
+                return (False, 0)
+        return (True, i - start)
 
 class MultiParser(Parser):
     """Base class for a complex parser containing other parsers."""
@@ -374,21 +896,76 @@ class SeqParser(MultiParser):
             p.addParser( c.clone() )
         return p
     
-    def _test(self, s, start, end):
+    def _parse(self, s, start, end):
         """Implements the match test."""
         if len(self._parsers) == 0:
             raise Exception('Empty SeqParser.')
         
         i = start
+        children = []
         for c in self._parsers:
-            c.match( s, i, end )
-            if not c.hasMatch():
-                return (False, 0)
-            i = c.getEnd()
-        return (True, i - start)
+            m = c.parse( s, i, end )
+            if m is None:
+                return None
+            children.append(m)
+            i = m.start + m.size
+        return Match(self, start, i - start, None, children)
+    
+    def _parseSteps(self, s, start, end):
+        """Implements the match test for StackParser."""
+        if len(self._parsers) == 0:
+            raise Exception('Empty SeqParser.')
+        
+        i = start
+        children = []
+        for c in self._parsers:
+            m = yield (c, i, end)
+            if m is None:
+                yield (None,)
+                return
+            children.append(m)
+            i = m.start + m.size
+        yield (Match(self, start, i - start, None, children),)
+    
+    def _firstChars(self):
+        """The first characters of the first parser."""
+        if len(self._parsers) == 0:
+            return None
+        return self._parsers[0]._firstChars()
+        
+    def _setResult(self, m, start):
+        """Store the results in this parser and in the child parsers."""
+        Parser._setResult(self, m, start)
+        if m:
+            for c, cm in zip(self._parsers, m.children):
+                c._setResult(cm, cm.start)
+        
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        if len(self._parsers) == 0:
+            raise Exception('Empty SeqParser.')
+        i = gen.tmp()
+        gen.line('%s = None' % out)
+        gen.line('%s = %s' % (i, pos))
+        children = []
+        for c in self._parsers:
+            cm = gen.tmp()
+            gen.emit(c, cm, i, end, len(children) == 0)
+            children.append(cm)
+            gen.line('if %s is not None:' % cm)
+            gen.indent()
+            gen.line('%s = %s.start + %s.size' % (i, cm, cm))
+        gen.line('%s = Match(%s, %s, %s - %s, None, [%s])' % 
+                 (out, gen.const(self), pos, i, pos, ', '.join(children)))
+        for c in self._parsers:
+            gen.dedent()
 
 class ListParser(MultiParser):
-    """Parsers a list of similar tokens. All tokens must be matched by the same type of parser."""
+    """Parsers a list of similar tokens. All tokens must be matched by the same type of parser.
+    
+    The token and delimiter parsers are reused for every token. Matches of the tokens 
+    (and delimiters) can be accessed by indexing the ListParser after a call to match().
+    """
     def __init__(self, parser, zero = False, max_matches = -1):
         """Constructor.
         
@@ -401,8 +978,9 @@ class ListParser(MultiParser):
         MultiParser.__init__(self)
         self._canMatchEmpty = zero
         self._maxMatches = max_matches # maximum number of matches, -1 means infinite
-        self._istesting = False
         self._token = None
+        # matches of the tokens and delimiters after a call to match()
+        self._tokens = []
         if isinstance(parser, Parser):
             self._token = parser
             self._delimiter = None
@@ -423,100 +1001,229 @@ class ListParser(MultiParser):
             p = ListParser(self._token.clone(),self._canMatchEmpty)
         return p
 
-    def _test(self, s, start, end):
+    def _parse(self, s, start, end):
         """Implements the match test."""
-        p = self._token
-        self.addParser(p)
-        if self._delimiter:
-            d = self._delimiter
-            self.addParser(d)
-        done = False
+        token = self._token
+        delimiter = self._delimiter
+        children = []
+        # the last matched token
+        last = None
         i = start
         nFound = 0
-        self._istesting = True
-        while not done: 
+        while True: 
             # try the token parser
-            p.match(s,i,end)
-            if not p.hasMatch():
+            m = token.parse(s,i,end)
+            if m is None:
                 if i == start:
-                    self._istesting = False
-                    del self._parsers[:]
-                    #print 'stop 1'
-                    return (self._canMatchEmpty, 0)
+                    if self._canMatchEmpty:
+                        return Match(self, start, 0, None, [])
+                    return None
                 # if delimiter parser is defined check that the last token can be empty
-                if self._delimiter:
-                    if self._canLastBeEmpty:
-                        del self._parsers[-1]
-                        self._istesting = False
-                        #print 'stop 2'
-                        return (True, self._parsers[-1].getEnd() - start)
-                    else:
-                        del self._parsers[-2:]
-                        self._istesting = False
-                        #print 'stop 3'
-                        return (False, 0)
-                else:
-                    del self._parsers[-1]
-                self._istesting = False
-                #print 'stop 4'
-                return (True, self._parsers[-1].getEnd() - start)
-            p.lookAtParent(self,s)
+                if delimiter and not self._canLastBeEmpty:
+                    return None
+                if delimiter:
+                    # the empty last token
+                    children.append(Match(token, i, 0))
+                return Match(self, start, i - start, None, children)
+            token.lookAtParent(m, last, s)
+            children.append(m)
+            last = m
+            i = m.start + m.size
             # the token had match: try next delimiter
-            if self._delimiter:
-                i = p.getEnd()
-                d.match(s,i,end)
-                if not d.hasMatch():
-                    self._istesting = False
-                    del self._parsers[-1]
-                    #print 'stop 5'
-                    return (True, i - start)
+            if delimiter:
+                d = delimiter.parse(s,i,end)
+                if d is None:
+                    return Match(self, start, i - start, None, children)
             if self._maxMatches > 0:
                 if nFound >= self._maxMatches:
-                    self._istesting = False
-                    #print 'stop 6'
-                    return False,0
+                    return None
                 nFound += 1
             
             # token and delimiter matched: prepare next iteration
-            i = self._parsers[-1].getEnd()
-            # clone the token parser
-            p = self._token.clone() 
-            self.addParser(p)
-            if self._delimiter:
-                # clone the delimiter parser
-                d = self._delimiter.clone() 
-                self.addParser(d)
+            if delimiter:
+                children.append(d)
+                i = d.start + d.size
+                
+    def _parseSteps(self, s, start, end):
+        """Implements the match test for StackParser. Same as _parse()."""
+        token = self._token
+        delimiter = self._delimiter
+        children = []
+        last = None
+        i = start
+        nFound = 0
+        while True: 
+            m = yield (token, i, end)
+            if m is None:
+                if i == start:
+                    if self._canMatchEmpty:
+                        yield (Match(self, start, 0, None, []),)
+                    else:
+                        yield (None,)
+                    return
+                if delimiter and not self._canLastBeEmpty:
+                    yield (None,)
+                    return
+                if delimiter:
+                    children.append(Match(token, i, 0))
+                yield (Match(self, start, i - start, None, children),)
+                return
+            token.lookAtParent(m, last, s)
+            children.append(m)
+            last = m
+            i = m.start + m.size
+            if delimiter:
+                d = yield (delimiter, i, end)
+                if d is None:
+                    yield (Match(self, start, i - start, None, children),)
+                    return
+            if self._maxMatches > 0:
+                if nFound >= self._maxMatches:
+                    yield (None,)
+                    return
+                nFound += 1
+            if delimiter:
+                children.append(d)
+                i = d.start + d.size
                 
-        self._istesting = False
-        print 'stop 7'
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        token = self._token
+        delimiter = self._delimiter
+        me = gen.const(self)
+        children = gen.tmp()
+        last = gen.tmp()
+        i = gen.tmp()
+        nFound = gen.tmp()
+        m = gen.tmp()
+        d = gen.tmp()
+        gen.line('%s = []' % children)
+        gen.line('%s = None' % last)
+        gen.line('%s = %s' % (i, pos))
+        gen.line('%s = 0' % nFound)
+        gen.line('while True:')
+        gen.indent()
+        gen.emit(token, m, i, end)
+        gen.line('if %s is None:' % m)
+        gen.indent()
+        gen.line('if %s == %s:' % (i, pos))
+        if self._canMatchEmpty:
+            gen.line('    %s = Match(%s, %s, 0, None, [])' % (out, me, pos))
+        else:
+            gen.line('    %s = None' % out)
+        if delimiter and not self._canLastBeEmpty:
+            gen.line('else:')
+            gen.line('    %s = None' % out)
+        else:
+            gen.line('else:')
+            if delimiter:
+                gen.line('    %s.append(Match(%s, %s, 0))' % (children, gen.const(token), i))
+            gen.line('    %s = Match(%s, %s, %s - %s, None, %s)' % (out, me, pos, i, pos, children))
+        gen.line('break')
+        gen.dedent()
+        if overrides(token, 'lookAtParent'):
+            gen.line('%s.lookAtParent(%s, %s, s)' % (gen.const(token), m, last))
+        gen.line('%s.append(%s)' % (children, m))
+        gen.line('%s = %s' % (last, m))
+        gen.line('%s = %s.start + %s.size' % (i, m, m))
+        if delimiter:
+            gen.emit(delimiter, d, i, end)
+            gen.line('if %s is None:' % d)
+            gen.line('    %s = Match(%s, %s, %s - %s, None, %s)' % (out, me, pos, i, pos, children))
+            gen.line('    break')
+        if self._maxMatches > 0:
+            gen.line('if %s >= %d:' % (nFound, self._maxMatches))
+            gen.line('    %s = None' % out)
+            gen.line('    break')
+            gen.line('%s += 1' % nFound)
+        if delimiter:
+            gen.line('%s.append(%s)' % (children, d))
+            gen.line('%s = %s.start + %s.size' % (i, d, d))
+        gen.dedent()
+        
+    def _firstChars(self):
+        """The first characters of the token parser if the list cannot be empty."""
+        if self._canMatchEmpty:
+            return None
+        return self._token._firstChars()
+        
+    def _setResult(self, m, start):
+        """Store the matches of the tokens."""
+        Parser._setResult(self, m, start)
+        if m and m.children:
+            self._tokens = m.children
+        else:
+            self._tokens = []
                 
+    def __getitem__(self, i):
+        """Return match of i-th token or delimiter."""
+        return self._tokens[i]
+    
+    def __len__(self):
+        """Return number of matched tokens and delimiters."""
+        return len(self._tokens)
+        
     def lastToken(self):
-        n = len(self._parsers)
-        if self._istesting:
-            if self._delimiter:
-                if n < 4:
-                    return None
-                else:
-                    return self._parsers[-4]
-            else:
-                if n < 2:
-                    return None
-                else:
-                    return self._parsers[-2]
-            
+        """Return match of the last token."""
         if not self.hasMatch():
             return None
+        n = len(self._tokens)
         if n == 0 or (n == 1 and self._canMatchEmpty):
             return None
-        return self._parsers[-1]
+        return self._tokens[-1]
                     
 class AltParser(MultiParser):
-    """A set of alternative parsers."""
+    """A set of alternative parsers.
+    
+    The alternatives are tried in the order they were added. Alternatives which cannot 
+    start with the first character of the sub-string (see Parser._firstChars()) are skipped.
+    """
     def __init__(self):
         """Constructor."""
         MultiParser.__init__(self)
         # the parser which had a match
         self._good = None
+        # character -> the alternatives which can start with it
+        self._dispatch = {}
+        # True while the first characters are computed (for recursive grammars)
+        self._inFirstChars = False
+        
+    def addParser(self, p):
+        """Add an alternative parser.
+        
+        Args:
+            p (Parser): a child parser.
+        """
+        MultiParser.addParser(self, p)
+        self._dispatch = {}
+        
+    def _candidates(self, c):
+        """Return the list of the alternatives which can start with a character."""
+        candidates = self._dispatch.get(c)
+        if candidates is None:
+            candidates = []
+            for p in self._parsers:
+                first = p._firstChars()
+                if first is None or c in first:
+                    candidates.append(p)
+            self._dispatch[c] = candidates
+        return candidates
+        
+    def _firstChars(self):
+        """The union of the first characters of the alternatives."""
+        if self._inFirstChars:
+            return None
+        self._inFirstChars = True
+        try:
+            chars = set()
+            for p in self._parsers:
+                first = p._firstChars()
+                if first is None:
+                    return None
+                chars.update(first)
+            return frozenset(chars)
+        finally:
+            self._inFirstChars = False
 
     def clone(self):
         """Implements cloning. Clones all child parsers."""
@@ -529,17 +1236,102 @@ class AltParser(MultiParser):
         """Return the parser which had a match or None if none had a match"""
         return self._good
         
-    def _test(self, s, start, end):
-        """Implements the match test."""
+    def _parse(self, s, start, end):
+        """Implements the match test. Returns the match of the first alternative which matched."""
         if len(self._parsers) == 0:
             raise Exception('Empty AltParser.')
         
-        for c in self._parsers:
-            c.match( s, start, end )
-            if c.hasMatch():
-                self._good = c
-                return (True, c.getEnd() - start)
-        return (False, 0)
+        candidates = self._dispatch.get(s[start])
+        if candidates is None:
+            candidates = self._candidates(s[start])
+        for c in candidates:
+            m = c.parse( s, start, end )
+            if m is not None:
+                return m
+        return None
+    
+    def _parseSteps(self, s, start, end):
+        """Implements the match test for StackParser."""
+        if len(self._parsers) == 0:
+            raise Exception('Empty AltParser.')
+        
+        for c in self._candidates(s[start]):
+            m = yield (c, start, end)
+            if m is not None:
+                yield (m,)
+                return
+        yield (None,)
+    
+    def _setResult(self, m, start):
+        """Store the results in this parser and in the good child parser."""
+        Parser._setResult(self, m, start)
+        if m:
+            self._good = m.parser
+            self._good._setResult(m, start)
+        else:
+            self._good = None
+        
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        if len(self._parsers) == 0:
+            raise Exception('Empty AltParser.')
+        c = gen.tmp()
+        gen.line('%s = None' % out)
+        gen.line('%s = s[%s]' % (c, pos))
+        n = len(self._parsers)
+        for k in range(n):
+            if k > 0:
+                gen.line('if %s is None:' % out)
+                gen.indent()
+            p = self._parsers[k]
+            first = p._firstChars()
+            if first is None:
+                gen.emit(p, out, pos, end, True)
+            else:
+                gen.line('if %s in %s:' % (c, gen.const(first)))
+                gen.indent()
+                gen.emit(p, out, pos, end, True)
+                gen.dedent()
+        for k in range(n - 1):
+            gen.dedent()
+
+def bracketIndex(s, bra, ket):
+    """Find the pairs of matching single-character brackets in a string.
+    
+    The index is built in one pass over the string and is kept in the index cache 
+    while the same string object is parsed (see IndexCache).
+    
+    Args:
+        s (str): the string.
+        bra (str): opening bracket.
+        ket (str): closing bracket, can be equal to bra.
+        
+    Return:
+        A dict mapping the index of each opening bracket to the index of its closing bracket.
+    """
+    key = ('brackets', bra, ket)
+    index = indexes.lookup(s, key)
+    if index is not None:
+        return index
+    index = {}
+    if bra == ket:
+        # each bracket is closed by the next one
+        i = s.find(bra)
+        while i >= 0:
+            j = s.find(ket, i + 1)
+            if j >= 0:
+                index[i] = j
+            i = j
+    else:
+        stack = []
+        for m in re.finditer('[%s]' % re.escape(bra + ket), s):
+            i = m.start()
+            if s[i] == bra:
+                stack.append(i)
+            elif stack:
+                index[stack.pop()] = i
+    indexes.store(s, key, index)
+    return index
 
 class BracketsParser(MultiParser):
     """Matches a string enclosed in brackets.
@@ -562,16 +1354,27 @@ class BracketsParser(MultiParser):
         p = BracketsParser(self._bra,self._ket, self[0])
         return p
         
-    def _test(self, s, start, end):
-        """Implements the match test."""
+    def _findKet(self, s, start, end):
+        """Find the closing bracket.
+        
+        Return:
+            Index of the closing bracket matching the opening bracket at start or -1 if
+            s doesn't start with the opening bracket or the closing bracket is not found.
+        """
         n = end - start
         l_bra = len(self._bra)
         l_ket = len(self._ket)
         if n < l_bra + l_ket:
-            return (False, 0)
+            return -1
+        
+        if l_bra == 1 and l_ket == 1:
+            i = bracketIndex(s, self._bra, self._ket).get(start, -1)
+            if i < end:
+                return i
+            return -1
         
         if not s.startswith(self._bra, start, end):
-            return (False, 0)
+            return -1
         
         i = start + l_bra
         level = 1
@@ -580,12 +1383,7 @@ class BracketsParser(MultiParser):
             if s.startswith(self._ket, i, end):
                 level -= 1
                 if level == 0:
-                    # the closing bracket is found: try to match the child parser
-                    self[0].match(s, start + l_bra, i)
-                    if self[0].hasMatch():
-                        return (True, i + l_ket - start)
-                    else:
-                        return (False, 0)
+                    return i
                 i += l_ket
             # skip any inner brackets
             elif s.startswith(self._bra, i, end):
@@ -594,8 +1392,342 @@ class BracketsParser(MultiParser):
             else:
                 i += 1
         # closing bracket was not found: failed
-        return (False, 0)
+        return -1
         
+    def _parse(self, s, start, end):
+        """Implements the match test."""
+        i = self._findKet(s, start, end)
+        if i < 0:
+            return None
+        # the closing bracket is found: try to match the child parser
+        m = self[0].parse(s, start + len(self._bra), i)
+        if m is not None:
+            return Match(self, start, i + len(self._ket) - start, None, [m])
+        return None
+        
+    def _parseSteps(self, s, start, end):
+        """Implements the match test for StackParser."""
+        i = self._findKet(s, start, end)
+        if i < 0:
+            yield (None,)
+            return
+        m = yield (self[0], start + len(self._bra), i)
+        if m is not None:
+            yield (Match(self, start, i + len(self._ket) - start, None, [m]),)
+            return
+        yield (None,)
+        
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation."""
+        me = gen.const(self)
+        i = gen.tmp()
+        inner = gen.tmp()
+        m = gen.tmp()
+        gen.line('%s = None' % out)
+        gen.line('%s = %s._findKet(s, %s, %s)' % (i, me, pos, end))
+        gen.line('if %s >= 0:' % i)
+        gen.indent()
+        gen.line('%s = %s + %d' % (inner, pos, len(self._bra)))
+        gen.emit(self[0], m, inner, i)
+        gen.line('if %s is not None:' % m)
+        gen.line('    %s = Match(%s, %s, %s + %d - %s, None, [%s])' % 
+                 (out, me, pos, i, len(self._ket), pos, m))
+        gen.dedent()
+    
+    def _firstChars(self):
+        """The first character of the opening bracket."""
+        return frozenset(self._bra[0])
         
+    def _setResult(self, m, start):
+        """Store the results in this parser and in the child parser."""
+        Parser._setResult(self, m, start)
+        if m:
+            self[0]._setResult(m.children[0], m.children[0].start)
 
-    
\ No newline at end of file
+
+def runSteps(steps, s):
+    """Run a generator returned by Parser._parseSteps() matching the child parsers 
+    with recursive calls to parse().
+    
+    Return:
+        The result of the generator: a Match or None.
+    """
+    request = steps.next()
+    while len(request) == 3:
+        parser, start, end = request
+        request = steps.send(parser.parse(s, start, end))
+    return request[0]
+
+def build(m, s):
+    """Run the deferred actions of the parsers in a match tree.
+    
+    parse() only finds matches, the doc items are created here by calling _build() of 
+    the parsers of the matches: the children first and the siblings in order. Matches without
+    a list of children (leaves) or which already have a docItem are skipped. Parser.match() calls 
+    this function, the results of parse() must be built explicitly.
+    
+    Args:
+        m (Match): the match or None.
+        s (str): the parsed string.
+    """
+    if m is None or m.children is None or m.docItem is not None:
+        return
+    # None on the stack marks that the match below it has its children built
+    stack = [m]
+    push = stack.append
+    pop = stack.pop
+    indexes.enter()
+    try:
+        while stack:
+            m = pop()
+            if m is None:
+                m = pop()
+                m.docItem = m.parser._build(m, s)
+                continue
+            push(m)
+            push(None)
+            for c in reversed(m.children):
+                # a child built earlier can be referenced by a match of a following sibling
+                if c is not None and c.children is not None and c.docItem is None:
+                    push(c)
+    finally:
+        indexes.leave()
+
+class StackParser(Parser):
+    """Runs a parser using an explicit stack instead of recursive calls to parse().
+    
+    The parsers defining _parseSteps() (the combinators and the latex parsers) are run as 
+    generators kept in a list so the depth of the parsed structure isn't limited by 
+    the Python recursion limit. When the memo table or the profiler is enabled the parser 
+    is called recursively.
+    """
+    def __init__(self, parser):
+        """Constructor.
+        
+        Args:
+            parser (Parser): the parser to run.
+        """
+        Parser.__init__(self)
+        self.parser = parser
+        self._canMatchEmpty = parser._canMatchEmpty
+        
+    def clone(self):
+        """Implements cloning."""
+        return StackParser(self.parser)
+    
+    def _parse(self, s, start, end):
+        """Implements the match test."""
+        if memo.enabled or profiler.enabled:
+            return self.parser.parse(s, start, end)
+        s_len = len(s)
+        stack = [self.parser._parseSteps(s, start, end)]
+        # maximum sizes of the matches of the running parsers
+        sizes = [end - start]
+        m = None
+        while True:
+            request = stack[-1].send(m)
+            if len(request) == 1:
+                # a parser returned its result
+                m = request[0]
+                stack.pop()
+                n = sizes.pop()
+                if m is not None and m.size > n:
+                    raise Exception('Wrong size returned by a parser')
+                if not stack:
+                    return m
+                continue
+            # a parser requested to match a child parser: do what parse() does
+            parser, i, e = request
+            n = e - i
+            if s_len == 0 or n == 0 or i >= s_len:
+                if parser._canMatchEmpty:
+                    m = Match(parser, i, 0)
+                else:
+                    m = None
+                continue
+            if n < 0 or e > s_len:
+                e = s_len
+                n = s_len - i
+            stack.append(parser._parseSteps(s, i, e))
+            sizes.append(n)
+            m = None
+    
+    def _compile(self, gen, out, pos, end):
+        """Implements code generation: call the compiled parser and use the explicit stack 
+        if the structure is nested deeper than the recursion limit allows."""
+        gen.line('try:')
+        gen.line('    %s = %s(s, %s, %s)' % (out, gen.rule(self.parser), pos, end))
+        gen.line('except RuntimeError:')
+        gen.line('    %s = %s._parse(s, %s, %s)' % (out, gen.const(self), pos, end))
+    
+    def _firstChars(self):
+        """The first characters of the parser."""
+        return self.parser._firstChars()
+        
+    def _setResult(self, m, start):
+        """Store the result and the doc item if there is one."""
+        Parser._setResult(self, m, start)
+        if m:
+            self.docItem = m.docItem
+        else:
+            self.docItem = None
+
+def overrides(parser, name, base = Parser):
+    """Check if the class of a parser overrides a method of a base class."""
+    method = getattr(parser.__class__, name)
+    return getattr(method, 'im_func', method) is not base.__dict__[name]
+
+class CodeGenerator:
+    """Generates Python source code of a function doing the work of a parser.
+    
+    Each parser generates its own code in its _compile() method. Parsers are either inlined 
+    into the code of their parent or put into separate functions (rules). The generated 
+    functions have the signature of Parser._parse().
+    """
+    # maximum indentation level of the generated code before a parser is moved into 
+    # a separate function
+    maxIndent = 40
+    
+    def __init__(self):
+        """Constructor."""
+        # objects used by the generated code: name -> object
+        self.consts = {'Match': Match}
+        # names of the constants: id(object) -> name
+        self._constNames = {}
+        # source code of the generated functions
+        self.functions = []
+        # names of the functions generated for parsers: id(parser) -> name
+        self._rules = {}
+        # stack of (lines, indent) of the functions being generated
+        self._stack = []
+        self._lines = None
+        self._indent = 0
+        self._ntmp = 0
+        
+    def const(self, obj):
+        """Return the name under which an object is accessible to the generated code."""
+        key = id(obj)
+        name = self._constNames.get(key)
+        if name is None:
+            name = '_k%d' % len(self._constNames)
+            self._constNames[key] = name
+            self.consts[name] = obj
+        return name
+    
+    def tmp(self):
+        """Return a name for a new local variable."""
+        self._ntmp += 1
+        return '_v%d' % self._ntmp
+        
+    def line(self, text):
+        """Add a line of code at the current indentation level."""
+        self._lines.append('    ' * self._indent + text)
+        
+    def indent(self):
+        """Increase the indentation level."""
+        self._indent += 1
+        
+    def dedent(self):
+        """Decrease the indentation level."""
+        self._indent -= 1
+        
+    def emit(self, parser, out, pos, end, nonEmpty = False):
+        """Generate code assigning the result of a parser to a variable.
+        
+        Args:
+            parser (Parser): the parser.
+            out (str): name of the variable to assign the Match or None to.
+            pos (str): name of the variable with the starting index.
+            end (str): name of the variable with the ending index.
+            nonEmpty (bool): True if pos < end is known to be true.
+        """
+        if not nonEmpty:
+            # handle empty sub-strings as Parser.parse() does 
+            self.line('if %s >= %s:' % (pos, end))
+            if parser._canMatchEmpty:
+                self.line('    %s = Match(%s, %s, 0)' % (out, self.const(parser), pos))
+            else:
+                self.line('    %s = None' % out)
+            self.line('else:')
+            self.indent()
+        if self._indent > self.maxIndent or id(parser) in self._rules or parser._compileAsRule():
+            self.line('%s = %s(s, %s, %s)' % (out, self.rule(parser), pos, end))
+        else:
+            parser._compile(self, out, pos, end)
+        if not nonEmpty:
+            self.dedent()
+        
+    def rule(self, parser):
+        """Return the name of a function implementing a parser, generate it if needed."""
+        name = self._rules.get(id(parser))
+        if name is not None:
+            return name
+        name = '_r%d' % len(self._rules)
+        # register the name before generating the body to allow recursion
+        self._rules[id(parser)] = name
+        self.const(parser)
+        self._stack.append((self._lines, self._indent))
+        self._lines = ['def %s(s, start, end):' % name]
+        self._indent = 1
+        parser._compile(self, 'm', 'start', 'end')
+        self.line('return m')
+        self.functions.append('\n'.join(self._lines))
+        self._lines, self._indent = self._stack.pop()
+        return name
+    
+    def source(self):
+        """Return the source code of all generated functions."""
+        return '\n\n'.join(self.functions) + '\n'
+
+class CompiledParser(Parser):
+    """A parser running code generated from another parser.
+    
+    Produces the same matches as the original parser but avoids the overhead 
+    of calling parse() of every node of the grammar. The memo table is not used.
+    """
+    def __init__(self, parser):
+        """Constructor.
+        
+        Args:
+            parser (Parser): the parser to compile.
+        """
+        Parser.__init__(self)
+        self.parser = parser
+        self._canMatchEmpty = parser._canMatchEmpty
+        self.docItem = None
+        gen = CodeGenerator()
+        name = gen.rule(parser)
+        self.source = gen.source()
+        namespace = dict(gen.consts)
+        exec(compile(self.source, '<compiled %s>' % parser.__class__.__name__, 'exec'), namespace)
+        self._function = namespace[name]
+        
+    def clone(self):
+        """Implements cloning."""
+        return CompiledParser(self.parser)
+    
+    def _parse(self, s, start, end):
+        """Implements the match test."""
+        return self._function(s, start, end)
+    
+    def _firstChars(self):
+        """The first characters of the parser."""
+        return self.parser._firstChars()
+        
+    def _setResult(self, m, start):
+        """Store the result and the doc item if there is one."""
+        Parser._setResult(self, m, start)
+        if m:
+            self.docItem = m.docItem
+        else:
+            self.docItem = None
+
+def compileParser(parser):
+    """Compile a parser into generated Python code.
+    
+    Args:
+        parser (Parser): a parser, eg a grammar built from other parsers.
+    Return:
+        A CompiledParser.
+    """
+    return CompiledParser(parser)
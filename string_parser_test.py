@@ -389,7 +389,44 @@ class TestStringParser(unittest.TestCase):
         self.assertEqual(p.getMatch(s),'world!')
         self.assertTrue( p.goodParser() )
         self.assertEqual(p.goodParser().getMatch(s),'world!')
-        
+
+    def test_AltParser_dispatch(self):
+
+        counting = CountingParser()
+        p = sp.AltParser()
+        p.addParser( sp.StringParser('hello') )
+        p.addParser( counting )
+        p.addParser( sp.CharParser('ha') )
+        self.assertEqual( p._firstChars(), None )
+
+        # the alternatives are tried in order
+        s = 'hello'
+        p.match( s )
+        self.assertEqual( p.getMatch(s), 'hello' )
+        s = 'hi'
+        p.match( s )
+        self.assertEqual( p.getMatch(s), 'h' )
+        self.assertEqual( counting.count, 1 )
+        s = 'ABC'
+        p.match( s )
+        self.assertEqual( p.getMatch(s), 'ABC' )
+        self.assertEqual( counting.count, 2 )
+
+        # added parsers update the dispatch table
+        p.addParser( sp.StringParser('xyz') )
+        s = 'xyz'
+        p.match( s )
+        self.assertEqual( p.getMatch(s), 'xyz' )
+        self.assertEqual( counting.count, 3 )
+
+        p = sp.AltParser()
+        p.addParser( sp.StringParser('hello') )
+        p.addParser( sp.CharParser('ab') )
+        self.assertEqual( p._firstChars(), frozenset('hab') )
+        self.assertEqual( combine(sp.SeqParser(), p)._firstChars(), frozenset('hab') )
+        self.assertEqual( sp.ListParser(p)._firstChars(), frozenset('hab') )
+        self.assertEqual( sp.ListParser(p, True)._firstChars(), None )
+
     def test_BracketsParser(self):
         
         p = sp.BracketsParser()
@@ -413,6 +450,29 @@ class TestStringParser(unittest.TestCase):
         self.assertEqual(p.getMatch(s),'((a) + b*(c+sin(x)))')
         self.assertEqual(p[0].getMatch(s),'(a) + b*(c+sin(x))')
         
+        p = sp.BracketsParser()
+        s = '((a)'
+        p.match(s)
+        self.assertFalse(p.hasMatch())
+        p.match(s, 1)
+        self.assertEqual(p.getMatch(s),'(a)')
+        p.match(s, 1, 3)
+        self.assertFalse(p.hasMatch())
+        
+        p = sp.BracketsParser('$', '$')
+        s = '$a$b$'
+        p.match(s)
+        self.assertEqual(p.getMatch(s),'$a$')
+        p.match(s, 2)
+        self.assertEqual(p.getMatch(s),'$b$')
+        
+    def test_bracketIndex(self):
+        
+        self.assertEqual(sp.bracketIndex('{a{b}}{', '{', '}'), {0:5, 2:4})
+        self.assertEqual(sp.bracketIndex('}a{b}}', '{', '}'), {2:4})
+        self.assertEqual(sp.bracketIndex('$a$b$', '$', '$'), {0:2, 2:4})
+        self.assertEqual(sp.bracketIndex('', '$', '$'), {})
+        
     def test_AlphaParser(self):
         
         p = sp.AlphaParser()
@@ -433,6 +493,55 @@ class TestStringParser(unittest.TestCase):
         self.assertTrue(p.hasMatch())
         self.assertEqual(p.getMatch(s),'Alpha')
         
+    def test_AlphaParser_unicode(self):
+        
+        p = sp.AlphaParser()
+        s = u'\u03b1\u03b2c1'
+        p.match(s)
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(p.getMatch(s),u'\u03b1\u03b2c')
+        
+        p = sp.AlphaParser()
+        s = u'\u00b2a'
+        p.match(s)
+        self.assertFalse(p.hasMatch())
+        
+    def test_DigitParser(self):
+        
+        p = sp.DigitParser()
+        s = '123abc'
+        p.match(s)
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(p.getMatch(s),'123')
+        
+        p = sp.DigitParser()
+        s = '123456'
+        p.match(s, 1, 4)
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(p.getMatch(s),'234')
+        
+        p = sp.DigitParser()
+        p.match('a123')
+        self.assertFalse(p.hasMatch())
+        
+        p = sp.DigitParser()
+        s = u'12\u00b2x'
+        p.match(s)
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(p.getMatch(s),u'12\u00b2')
+        
+    def test_AllNotCharParser_end(self):
+        
+        p = sp.AllNotCharParser(' ]')
+        s = 'function]'
+        p.match(s, 2, 5)
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(p.getMatch(s),'nct')
+        
+        p = sp.AllNotCharParser(' ]')
+        p.match(s, 8)
+        self.assertFalse(p.hasMatch())
+        
 class TestListParser(unittest.TestCase):
     
     def test_ListParser(self):
@@ -505,7 +614,31 @@ class TestListParser(unittest.TestCase):
         self.assertFalse(p.hasMatch())
         self.assertEqual(p.lastToken(), None)
         
-    def xtest_lookAtParent(self):
+    def test_no_cloning(self):
+        
+        class NoCloneParser(sp.CharParser):
+            def clone(self):
+                raise Exception('Token parsers must not be cloned')
+        
+        token = NoCloneParser('abc')
+        p = sp.ListParser( (token,sp.CharParser(',')) )
+        s = 'a,b,c'
+        m = p.parse(s)
+        self.assertTrue(isinstance(m, sp.Match))
+        self.assertEqual(m.getMatch(s), s)
+        self.assertEqual(len(m), 5)
+        self.assertEqual(m[4].getMatch(s), 'c')
+        self.assertTrue(m[4].parser is token)
+        # parse() doesn't change the state of the parsers
+        self.assertFalse(p.hasMatch())
+        self.assertFalse(token.hasMatch())
+        
+        p.match(s)
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(len(p), 5)
+        self.assertTrue(p.getResult() is not None)
+        
+    def test_lookAtParent(self):
         
         class MockParser(sp.CharParser):
             def __init__(self, s):
@@ -514,34 +647,336 @@ class TestListParser(unittest.TestCase):
             def clone(self):
                 return MockParser(self._chars)
                 
-            def lookAtParent(self, parser, s):
-                if isinstance(parser, sp.ListParser):
-                    last = parser.lastToken()
-                    if last:
-                        last.mess = last.getMatch(s)+' is followed by '+self.getMatch(s)+'\n'
-                        #print last.mess
+            def lookAtParent(self, m, last, s):
+                if last:
+                    last.docItem = last.getMatch(s)+' is followed by '+m.getMatch(s)+'\n'
+                    #print last.docItem
                         
         mock = MockParser('abc')
         p = sp.ListParser( mock )
         p.match('bca')
-        self.assertEqual( p[0].mess, 'b is followed by c\n' )
-        self.assertEqual( p[1].mess, 'c is followed by a\n' )
+        self.assertEqual( p[0].docItem, 'b is followed by c\n' )
+        self.assertEqual( p[1].docItem, 'c is followed by a\n' )
                 
         mock = MockParser('abc')
         p = sp.ListParser( (mock,sp.CharParser(',')) )
         p.match('a,b,c')
-        self.assertEqual( p[0].mess, 'a is followed by b\n' )
-        self.assertEqual( p[2].mess, 'b is followed by c\n' )
+        self.assertEqual( p[0].docItem, 'a is followed by b\n' )
+        self.assertEqual( p[2].docItem, 'b is followed by c\n' )
         
         mock = MockParser('abc')
         p = sp.ListParser( (mock,sp.CharParser(','),True) )
         p.match('b,a,c')
-        self.assertEqual( p[0].mess, 'b is followed by a\n' )
-        self.assertEqual( p[2].mess, 'a is followed by c\n' )
+        self.assertEqual( p[0].docItem, 'b is followed by a\n' )
+        self.assertEqual( p[2].docItem, 'a is followed by c\n' )
         
         mock = MockParser('abc')
         p = sp.ListParser( (mock,sp.CharParser(','),True) )
         p.match('a,c,b,')
-        self.assertEqual( p[0].mess, 'a is followed by c\n' )
-        self.assertEqual( p[2].mess, 'c is followed by b\n' )
+        self.assertEqual( p[0].docItem, 'a is followed by c\n' )
+        self.assertEqual( p[2].docItem, 'c is followed by b\n' )
                 
+        
+class CountingParser(ABCParser):
+    """Test parser matching 'ABC' and counting calls to _test"""
+    def __init__(self):
+        ABCParser.__init__(self)
+        self.count = 0
+        
+    def _test(self, s, start, end):
+        self.count += 1
+        return ABCParser._test(self, s, start, end)
+    
+    def _memoKey(self):
+        return (CountingParser,)
+        
+class TestMemoTable(unittest.TestCase):
+    
+    def setUp(self):
+        sp.memo.enable()
+        
+    def tearDown(self):
+        sp.memo.disable()
+        
+    def make_parser(self, counter, n = 1):
+        p = sp.AltParser()
+        for c in 'xy':
+            seq = sp.SeqParser()
+            for i in range(n):
+                seq.addParser(counter)
+            seq.addParser(sp.CharParser(c))
+            p.addParser(seq)
+        return p
+        
+    def test_memo(self):
+        counter = CountingParser()
+        p = self.make_parser(counter)
+        s = 'ABCy'
+        p.match(s)
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(p.getMatch(s), s)
+        self.assertEqual(counter.count, 1)
+        # the table is cleared after a top-level match
+        self.assertEqual(len(sp.memo), 0)
+        p.match(s)
+        self.assertEqual(counter.count, 2)
+        
+    def test_memo_disabled(self):
+        sp.memo.disable()
+        counter = CountingParser()
+        p = self.make_parser(counter)
+        p.match('ABCy')
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(counter.count, 2)
+        
+    def test_memo_maxsize(self):
+        counter = CountingParser()
+        p = self.make_parser(counter, 2)
+        s = 'ABCABCy'
+        p.match(s)
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(counter.count, 2)
+        
+        # the second alternative doesn't find the evicted entries
+        sp.memo.enable(1)
+        counter.count = 0
+        p.match(s)
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(counter.count, 4)
+        sp.memo.enable(100000)
+        
+class TestIndexCache(unittest.TestCase):
+    
+    def test_brackets(self):
+        s = 'a(b(c)d)(e'
+        p = sp.SeqParser()
+        p.addParser(sp.CharParser('a'))
+        p.addParser(sp.BracketsParser(parser = sp.AllParser()))
+        built = []
+        bracketIndex = sp.bracketIndex
+        def countingIndex(s, bra, ket):
+            index = bracketIndex(s, bra, ket)
+            built.append(index)
+            return index
+        sp.bracketIndex = countingIndex
+        try:
+            p.match(s)
+        finally:
+            sp.bracketIndex = bracketIndex
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(p.getMatch(s), 'a(b(c)d)')
+        self.assertEqual(built[0], {1: 7, 3: 5})
+        # the cache is cleared after a top-level match
+        self.assertEqual(len(sp.indexes), 0)
+        
+    def test_reuse(self):
+        s = '(a)(b)'
+        sp.indexes.enter()
+        try:
+            index = sp.bracketIndex(s, '(', ')')
+            self.assertTrue(sp.bracketIndex(s, '(', ')') is index)
+            self.assertFalse(sp.bracketIndex(s[:], '[', ']') is index)
+            self.assertEqual(len(sp.indexes), 2)
+        finally:
+            sp.indexes.leave()
+        self.assertEqual(len(sp.indexes), 0)
+        # nothing is stored outside of match(), parse() and build()
+        sp.bracketIndex(s, '(', ')')
+        self.assertEqual(len(sp.indexes), 0)
+        
+    def test_parse(self):
+        s = '(ab)' * 200
+        p = sp.ListParser(sp.BracketsParser(parser = sp.AlphaParser()))
+        stored = []
+        store = sp.indexes.store
+        def countingStore(s, key, index):
+            stored.append(key)
+            store(s, key, index)
+        sp.indexes.store = countingStore
+        try:
+            m = p.parse(s)
+        finally:
+            del sp.indexes.store
+        self.assertEqual(m.size, len(s))
+        # a top-level parse() builds the index once
+        self.assertEqual(stored, [('brackets', '(', ')')])
+        self.assertEqual(len(sp.indexes), 0)
+        
+        
+def matchTree(m, s):
+    """Convert a Match into nested tuples for comparisons."""
+    if m is None:
+        return None
+    return (m.getMatch(s), m.docItem, [matchTree(c, s) for c in m.children or []])
+        
+def combine(p, *parsers):
+    """Add sub-parsers to a SeqParser or an AltParser."""
+    for c in parsers:
+        p.addParser(c)
+    return p
+        
+class TestCompileParser(unittest.TestCase):
+    
+    def check(self, p, strings):
+        c = sp.compileParser(p)
+        for s in strings:
+            for start in range(len(s) + 1):
+                self.assertEqual(matchTree(c.parse(s, start), s), matchTree(p.parse(s, start), s))
+        
+    def test_leaves(self):
+        strings = ['', 'ABC', 'abc 123', '  \n x', 'ABCABCx']
+        self.check(sp.CharParser('aA'), strings)
+        self.check(sp.NotCharParser('b '), strings)
+        self.check(sp.AllNotCharParser('x'), strings)
+        self.check(sp.StringParser('ABC'), strings)
+        self.check(sp.NotStringParser('BC'), strings)
+        self.check(sp.ZeroOrMoreSpaces(), strings)
+        self.check(sp.AlphaParser(), strings)
+        self.check(sp.DigitParser(), strings)
+        self.check(ABCParser(), strings)
+        
+    def test_combinators(self):
+        strings = ['', 'ABC', 'ABC,ABC', 'ABC, ABC,', 'x(ABC)y', '((A)(B))', '((A))((B))']
+        abc = sp.StringParser('ABC')
+        self.check(combine(sp.SeqParser(), abc, sp.ZeroOrMoreSpaces(), sp.CharParser(',')), strings)
+        self.check(combine(sp.AltParser(), sp.CharParser('('), abc, sp.AlphaParser()), strings)
+        self.check(sp.ListParser(abc), strings)
+        self.check(sp.ListParser((abc, sp.CharParser(','))), strings)
+        self.check(sp.ListParser((combine(sp.SeqParser(), sp.ZeroOrMoreSpaces(), abc), sp.CharParser(','), True)), strings)
+        self.check(sp.BracketsParser(parser = sp.AlphaParser()), strings)
+        self.check(sp.BracketsParser('((', '))', sp.ListParser(sp.NotCharParser('()'))), strings)
+        
+    def test_match(self):
+        p = sp.compileParser(sp.ListParser((sp.AlphaParser(), sp.CharParser(','))))
+        s = 'ab,cd,'
+        p.match(s)
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(p.getMatch(s), s)
+        self.assertEqual(p.getResult().children[2].getMatch(s), 'cd')
+        p.match('')
+        self.assertFalse(p.hasMatch())
+        
+class BuildingParser(ABCParser):
+    """Test parser matching 'ABC' with a deferred action recording the built matches"""
+    def __init__(self, built):
+        ABCParser.__init__(self)
+        self.built = built
+        
+    def _parse(self, s, start, end):
+        if s.startswith('ABC', start) and start + 3 <= end:
+            return sp.Match(self, start, 3, None, [])
+        return None
+        
+    def _build(self, m, s):
+        self.built.append(m.start)
+        return 'item %d' % m.start
+        
+class TestBuild(unittest.TestCase):
+    
+    def test_abandoned(self):
+        built = []
+        a = BuildingParser(built)
+        b = BuildingParser(built)
+        p = combine(sp.AltParser(), combine(sp.SeqParser(), a, sp.CharParser('x')), 
+                                    combine(sp.SeqParser(), b, sp.CharParser('y')))
+        s = 'ABCy'
+        m = p.parse(s)
+        self.assertEqual(m[0].parser, b)
+        self.assertEqual(m[0].docItem, None)
+        self.assertEqual(built, [])
+        sp.build(m, s)
+        self.assertEqual(m[0].docItem, 'item 0')
+        self.assertEqual(built, [0])
+        # match() runs the actions of the matched parsers only
+        del built[:]
+        p.match(s)
+        self.assertEqual(built, [0])
+        
+    def test_order(self):
+        built = []
+        p = sp.ListParser((BuildingParser(built), sp.CharParser(',')))
+        s = 'ABC,ABC,ABC'
+        p.match(s)
+        self.assertEqual(built, [0, 4, 8])
+        self.assertEqual([m.docItem for m in p.getResult().children[::2]], ['item 0', 'item 4', 'item 8'])
+        # built matches are skipped
+        sp.build(p.getResult(), s)
+        self.assertEqual(built, [0, 4, 8])
+        
+class TestStackParser(unittest.TestCase):
+    
+    def test_StackParser(self):
+        strings = ['', 'ABC', 'ABC,ABC', 'ABC, ABC,', 'x(ABC)y', '((A)(B))']
+        abc = sp.StringParser('ABC')
+        parsers = [combine(sp.SeqParser(), abc, sp.ZeroOrMoreSpaces(), sp.CharParser(',')),
+                   combine(sp.AltParser(), sp.CharParser('('), abc, sp.AlphaParser()),
+                   sp.ListParser((combine(sp.SeqParser(), sp.ZeroOrMoreSpaces(), abc), sp.CharParser(','), True)),
+                   sp.ListParser(sp.CharParser('ABC'), False, 2),
+                   sp.BracketsParser(parser = sp.ListParser(sp.NotCharParser('()')))]
+        for p in parsers:
+            c = sp.StackParser(p)
+            for s in strings:
+                for start in range(len(s) + 1):
+                    self.assertEqual(matchTree(c.parse(s, start), s), matchTree(p.parse(s, start), s))
+        
+    def test_deep_nesting(self):
+        # a grammar of nested brackets: (((...)))
+        alt = sp.AltParser()
+        alt.addParser(sp.CharParser('x'))
+        alt.addParser(sp.BracketsParser(parser = alt))
+        n = 3000
+        s = '(' * n + 'x' + ')' * n
+        self.assertRaises(RuntimeError, alt.parse, s)
+        p = sp.StackParser(alt)
+        p.match(s)
+        self.assertTrue(p.hasMatch())
+        self.assertEqual(p.getEnd(), len(s))
+        
+    def test_wrong_size(self):
+        p = sp.StackParser(WrongSizeParser())
+        self.assertRaises(Exception, p.match, 'abc')
+        
+class TestProfiler(unittest.TestCase):
+    
+    def tearDown(self):
+        sp.profiler.disable()
+        sp.profiler.reset()
+    
+    def test_profiler(self):
+        abc = ABCParser()
+        alt = sp.AltParser()
+        alt.addParser(abc)
+        alt.addParser(sp.CharParser('x'))
+        p = sp.ListParser(alt)
+        
+        sp.profiler.reset()
+        sp.profiler.enable()
+        p.match('ABCxABCy')
+        sp.profiler.disable()
+        # not recorded
+        p.match('ABC')
+        
+        rows = sp.profiler.report()
+        self.assertEqual(len(rows), 4)
+        stats = dict([(row.name, row) for row in rows])
+        self.assertEqual(rows[0].name, 'ListParser#0')
+        self.assertEqual(stats['ListParser#0'].calls, 1)
+        self.assertEqual(stats['ListParser#0'].chars, 7)
+        self.assertEqual(stats['AltParser#1'].calls, 4)
+        self.assertEqual(stats['AltParser#1'].successes, 3)
+        self.assertEqual(stats['AltParser#1'].backtracks, 0)
+        self.assertEqual(stats['ABCParser#2'].calls, 4)
+        self.assertEqual(stats['ABCParser#2'].successes, 2)
+        self.assertEqual(stats['ABCParser#2'].chars, 6)
+        self.assertEqual(stats['ABCParser#2'].backtracks, 2)
+        # not tried on 'y'
+        self.assertEqual(stats['CharParser#3'].calls, 1)
+        self.assertEqual(stats['CharParser#3'].backtracks, 0)
+        
+        rows = sp.profiler.report(True)
+        self.assertEqual([row.name for row in rows][0], 'ListParser')
+        
+        table = sp.profiler.formatReport(limit = 2).split('\n')
+        self.assertEqual(len(table), 3)
+        self.assertTrue(table[0].startswith('parser'))
+        self.assertTrue(table[1].startswith('ListParser#0'))